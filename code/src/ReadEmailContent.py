@@ -1,14 +1,17 @@
+import io
 import os
-import extract_msg  # For .msg file extraction
 import email
 import re
+import shutil
+import tempfile
+from concurrent.futures import CancelledError, Future
 from email import policy
 from email.parser import BytesParser
-from pdfminer.high_level import extract_text  # For PDF extraction
-from docx import Document  # For DOCX extraction
-import win32com.client  # For reading .doc files on Windows
-from PIL import Image  # For image processing
-import pytesseract  # For OCR (extracting text from images)
+import instrumentation
+
+# Parsers for attachments (pdfminer, python-docx, PIL, pytesseract) are
+# imported on first use of their file type, so importing this module stays cheap
+# and works on hosts that lack some of them.
 
 # Get the directory of the currently running Python script
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -19,114 +22,261 @@ input_folder = os.path.join(script_dir, "Input")
 # Define the input folder
 SHARED_FOLDER = input_folder
 
-# Define a dedicated folder for attachments
-ATTACHMENTS_FOLDER = os.path.join(SHARED_FOLDER, "Attachments")
-os.makedirs(ATTACHMENTS_FOLDER, exist_ok=True)  # Ensure the folder exists
+# Attachments larger than this (bytes) are spilled to a per-message temp folder instead of parsed in memory
+SPILL_THRESHOLD = int(os.getenv("ATTACHMENT_SPILL_THRESHOLD", 16 * 1024 * 1024))
 
-# Function to read attachment content
-def read_attachment_content(file_path):
-    try:
-        file_extension = os.path.splitext(file_path)[1].lower()
+# Attachment types whose readers need a real file on disk
+PATH_ONLY_EXTENSIONS = (".msg",)
+
+class SpillDir:
+    """Per-message temporary folder, created only when an attachment has to be written to disk."""
+
+    def __init__(self):
+        self.path = None
+        self.count = 0
 
-        if file_extension == ".txt":
-            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                return f.read().strip()
+    # Write an attachment payload and return its path (names are numbered so duplicates never collide)
+    def write(self, filename, data):
+        if self.path is None:
+            self.path = tempfile.mkdtemp(prefix="email-attachments-")
+        self.count += 1
+        att_path = os.path.join(self.path, f"{self.count}-{os.path.basename(filename)}")
+        with open(att_path, "wb") as f:
+            f.write(data)
+        return att_path
 
-        elif file_extension == ".pdf":
-            return extract_text(file_path).strip()
+    def cleanup(self):
+        if self.path:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
 
-        elif file_extension == ".docx":
-            doc = Document(file_path)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cleanup()
+
+# Extract text from a binary stream (open file or BytesIO) according to the file extension
+def read_attachment_stream(file_extension, stream):
+    if file_extension == ".txt":
+        return stream.read().decode("utf-8", errors="ignore").strip()
+
+    elif file_extension == ".pdf":
+        from pdfminer.high_level import extract_text  # For PDF extraction
+        with instrumentation.span("pdfminer"):
+            return extract_text(stream).strip()
+
+    elif file_extension == ".docx":
+        from docx import Document  # For DOCX extraction
+        with instrumentation.span("docx"):
+            doc = Document(stream)
             return "\n".join([para.text for para in doc.paragraphs]).strip()
 
-        elif file_extension == ".doc":  # Support for older .doc files
-            word = win32com.client.Dispatch("Word.Application")
-            word.Visible = False  # Run in background
-            doc = word.Documents.Open(file_path)
-            text = doc.Content.Text.strip()
-            doc.Close(False)
-            word.Quit()
-            return text
-
-        elif file_extension in [".jpg", ".jpeg", ".png"]:  # Extract text from images using OCR
-            img = Image.open(file_path)
+    elif file_extension == ".doc":  # Support for older .doc files, read natively (no Word needed)
+        from docreader import extract_doc_text
+        with instrumentation.span("doc"):
+            return extract_doc_text(stream.read())
+
+    elif file_extension in [".jpg", ".jpeg", ".png"]:  # Extract text from images using OCR
+        from PIL import Image  # For image processing
+        import pytesseract  # For OCR (extracting text from images)
+        with instrumentation.span("ocr"):
+            img = Image.open(stream)
             return pytesseract.image_to_string(img).strip()
 
-        elif file_extension in [".eml", ".msg"]:  # Process attached email files recursively
+    elif file_extension == ".eml":  # Process attached email files recursively
+        return format_eml_message(BytesParser(policy=policy.default).parse(stream))
+
+    else:
+        return f"Unsupported file type: {file_extension}"
+
+# Function to read attachment content from a file on disk
+def read_attachment_content(file_path):
+    try:
+        file_extension = os.path.splitext(file_path)[1].lower()
+
+        if file_extension in [".eml", ".msg"]:  # Process attached email files recursively
             return extract_email_content(file_path)
 
-        else:
-            return f"Unsupported file type: {file_extension}"
+        with open(file_path, "rb") as f:
+            return read_attachment_stream(file_extension, f)
 
     except Exception as e:
+        instrumentation.record_error("attachment", e, file=os.path.basename(file_path))
         return f"Error reading file: {str(e)}"
 
-# Function to extract emails from .msg and .eml files
-def extract_email_content(file_path):
-    email_content = []
+# Function to read attachment content from an in-memory payload (bytes, bytearray or memoryview)
+def read_attachment_bytes(filename, data, spill_dir=None, spill_threshold=None):
+    spill_threshold = SPILL_THRESHOLD if spill_threshold is None else spill_threshold
+    file_extension = os.path.splitext(filename)[1].lower()
+    try:
+        if len(data) > spill_threshold or file_extension in PATH_ONLY_EXTENSIONS:
+            if spill_dir is not None:
+                return read_attachment_content(spill_dir.write(filename, data))
+            with SpillDir() as own_spill_dir:
+                return read_attachment_content(own_spill_dir.write(filename, data))
+        return read_attachment_stream(file_extension, io.BytesIO(data))
+    except Exception as e:
+        instrumentation.record_error("attachment", e, file=filename)
+        return f"Error reading file: {str(e)}"
+
+# Format subject, sender, body and attachments as one text block (same layout for .eml and .msg).
+# Attachment entries are (filename, content) pairs, where content may be a Future from an
+# AttachmentPool, or already formatted error lines. A Future cancelled before its attachment was
+# read (AttachmentPool.cancel, or a shutdown that cancels queued tasks) gives an error entry,
+# the same one the pool returns for a cancelled running task.
+def format_email_text(subject, sender, email_body, attachments):
     email_pattern = r"<([^>]+)>"
 
-    if file_path.endswith(".eml"):
-        with open(file_path, "rb") as f:
-            eml_msg = BytesParser(policy=policy.default).parse(f)
+    sender_name = sender.split("<")[0].strip() if "<" in sender else sender
+    email_from_match = re.search(email_pattern, sender)
+    email_from = email_from_match.group(1) if email_from_match else sender
+
+    attachment_contents = ["Attachment Content:"]
+    for entry in attachments:
+        if isinstance(entry, str):
+            attachment_contents.append(entry)
+            continue
+        filename, content = entry
+        if isinstance(content, Future):
+            try:
+                content = content.result()
+            except CancelledError as e:
+                instrumentation.record_error("attachment", e, file=filename)
+                content = "Error reading file: cancelled"
+        attachment_contents.append(f"Filename: {filename}\nContent:\n{content}")
+
+    attachment_text = "\n".join(attachment_contents)
+
+    # Format the extracted email content with comma separators
+    return f"Subject: {subject}, Sender: {sender_name}, EmailFrom: {email_from}, EmailBody: {email_body}, {attachment_text}"
 
-        subject = eml_msg.get("subject", "No Subject")
-        sender = eml_msg.get("from", "Unknown Sender")
-        sender_name = sender.split("<")[0].strip() if "<" in sender else sender
-        email_from_match = re.search(email_pattern, sender)
-        email_from = email_from_match.group(1) if email_from_match else sender
+# Read one attachment inline, or hand it to the attachment pool when one is given
+def _read_attachment(filename, data, spill_dir, attachment_pool):
+    if attachment_pool is not None:
+        return attachment_pool.submit(filename, data)
+    return read_attachment_bytes(filename, data, spill_dir)
 
-        email_body = eml_msg.get_body(preferencelist=("plain", "html"))
-        email_body = email_body.get_content().strip() if email_body else "No Content"
-        if isinstance(email_body, bytes):
-            email_body = email_body.decode("utf-8", errors="ignore").strip()
+# Format a parsed .eml message (headers, body and attachments) as one text block
+def format_eml_message(eml_msg, attachment_pool=None):
+    subject = eml_msg.get("subject", "No Subject")
+    sender = eml_msg.get("from", "Unknown Sender")
 
-        # Ensure Attachments folder exists
-        os.makedirs(ATTACHMENTS_FOLDER, exist_ok=True)
+    email_body = eml_msg.get_body(preferencelist=("plain", "html"))
+    email_body = email_body.get_content().strip() if email_body else "No Content"
+    if isinstance(email_body, bytes):
+        email_body = email_body.decode("utf-8", errors="ignore").strip()
 
-        # Extract and save attachments, including nested .eml, .msg, and image files
-        attachment_contents = ["Attachment Content:"]
+    # Read attachments straight from the decoded payloads, including nested .eml, .msg, and image files;
+    # only oversized or path-only ones go to a temp folder owned by this message
+    attachments = []
+    with SpillDir() as spill_dir:
         for part in eml_msg.iter_parts():
             filename = part.get_filename()
             content_type = part.get_content_type()
 
             if filename:
-                att_path = os.path.join(ATTACHMENTS_FOLDER, filename)
                 try:
-                    with open(att_path, "wb") as f:
-                        data = part.get_payload(decode=True)
-                        if data:
-                            f.write(data)
-                    
-                    print(f"Successfully saved: {att_path}")  # Debugging output
-                    
-                    # Process nested .eml, .msg, and image files
-                    if filename.endswith(".eml") or filename.endswith(".msg") or content_type == "message/rfc822":
-                        eml_attachment_content = extract_email_content(att_path)
-                        attachment_contents.append(f"Filename: {filename}\nContent:\n{eml_attachment_content}")
-                    elif filename.endswith(".jpg") or filename.endswith(".jpeg") or filename.endswith(".png"):
-                        content = read_attachment_content(att_path)
-                        attachment_contents.append(f"Filename: {filename}\nContent:\n{content}")
+                    if content_type == "message/rfc822":
+                        content = format_eml_message(part.get_content(), attachment_pool)
                     else:
-                        content = read_attachment_content(att_path)
-                        attachment_contents.append(f"Filename: {filename}\nContent:\n{content}")
+                        content = _read_attachment(filename, part.get_payload(decode=True) or b"", spill_dir, attachment_pool)
+                    attachments.append((filename, content))
                 except Exception as e:
-                    print(f"Error saving {filename}: {str(e)}")  # Debugging output
-                    attachment_contents.append(f"Error saving {filename}: {str(e)}")
+                    instrumentation.record_error("attachment", e, file=filename)
+                    attachments.append(f"Error reading {filename}: {str(e)}")
 
-        if not attachment_contents:
-            attachment_contents.append("No Attachments")
+    return format_email_text(subject, sender, email_body, attachments)
 
-        attachment_text = "\n".join(attachment_contents)
+# Plain-text body of an Outlook message, falling back to the HTML body
+def _msg_body(msg):
+    email_body = msg.body
+    if not email_body:
+        email_body = msg.htmlBody or ""
+    if isinstance(email_body, bytes):
+        email_body = email_body.decode("utf-8", errors="ignore")
+    return email_body.strip() or "No Content"
 
-        # Format the extracted email content with comma separators
-        email_content.append(f"Subject: {subject}, Sender: {sender_name}, EmailFrom: {email_from}, EmailBody: {email_body}, {attachment_text}")
+# Format an opened Outlook message (extract_msg) as one text block, recursing into embedded messages
+def format_msg_message(msg, attachment_pool=None):
+    subject = msg.subject or "No Subject"
+    sender = msg.sender or "Unknown Sender"
+    email_body = _msg_body(msg)
+
+    attachments = []
+    with SpillDir() as spill_dir:
+        for attachment in msg.attachments:
+            filename = getattr(attachment, "longFilename", None) or getattr(attachment, "shortFilename", None) or getattr(attachment, "name", None) or "attachment"
+            try:
+                data = attachment.data
+                if isinstance(data, (bytes, bytearray, memoryview)):
+                    content = _read_attachment(filename, data, spill_dir, attachment_pool)
+                elif data is not None and hasattr(data, "attachments"):  # Embedded Outlook message
+                    content = format_msg_message(data, attachment_pool)
+                else:
+                    content = "No Content"
+                attachments.append((filename, content))
+            except Exception as e:
+                instrumentation.record_error("attachment", e, file=filename)
+                attachments.append(f"Error reading {filename}: {str(e)}")
+
+    return format_email_text(subject, sender, email_body, attachments)
+
+# Function to extract emails from .msg and .eml files
+# (with an AttachmentPool, attachments are extracted in worker processes)
+def extract_email_content(file_path, attachment_pool=None):
+    email_content = []
+    file_extension = os.path.splitext(file_path)[1].lower()
+
+    if file_extension == ".eml":
+        with open(file_path, "rb") as f:
+            eml_msg = BytesParser(policy=policy.default).parse(f)
+        email_content.append(format_eml_message(eml_msg, attachment_pool))
+
+    elif file_extension == ".msg":
+        import extract_msg  # For .msg file extraction
+        # Closing the message releases the OLE file handle, including those of embedded messages
+        msg = extract_msg.openMsg(file_path)
+        try:
+            email_content.append(format_msg_message(msg, attachment_pool))
+        finally:
+            msg.close()
 
     return "\n".join(email_content)
 
-# Function to process emails in the shared folder
-def extract_msg_files():
+# Threading headers (Message-ID, In-Reply-To, References) of an .eml or .msg file, without reading attachments
+def read_thread_headers(file_path):
+    file_extension = os.path.splitext(file_path)[1].lower()
+    headers = None
+
+    if file_extension == ".eml":
+        with open(file_path, "rb") as f:
+            headers = BytesParser(policy=policy.default).parse(f, headersonly=True)
+
+    elif file_extension == ".msg":
+        import extract_msg  # For .msg file extraction
+        msg = extract_msg.openMsg(file_path)
+        try:
+            headers = msg.header
+        finally:
+            msg.close()
+
+    if headers is None:
+        return {}
+    return {"message_id": str(headers.get("Message-ID", "") or ""),
+            "in_reply_to": str(headers.get("In-Reply-To", "") or ""),
+            "references": str(headers.get("References", "") or "")}
+
+# Function to process emails in the shared folder (only new or changed ones when a manifest is given)
+def extract_msg_files(manifest=None):
     email_strings = []
+    if manifest is not None:
+        for file_path in manifest.scan(SHARED_FOLDER, (".msg", ".eml")):
+            email_content = extract_email_content(file_path)
+            manifest.record(file_path, email_content)
+            email_strings.append(email_content)
+        return email_strings
+
     for filename in os.listdir(SHARED_FOLDER):
         file_path = os.path.join(SHARED_FOLDER, filename)
 
@@ -136,8 +286,9 @@ def extract_msg_files():
 
     return email_strings
 
-# Extract and print email data
-email_data = extract_msg_files()
-for email in email_data:
-    print(email)
-    print("\n" + "=" * 80 + "\n")  # Separator for readability
\ No newline at end of file
+# Extract and print email data when run as a script
+if __name__ == "__main__":
+    email_data = extract_msg_files()
+    for email_text in email_data:
+        print(email_text)
+        print("\n" + "=" * 80 + "\n")  # Separator for readability
@@ -0,0 +1,159 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# Default seconds a single attachment may take before its worker is killed
+DEFAULT_TIMEOUT = 120
+
+# Default attachments a worker process handles before it is replaced (bounds memory growth)
+DEFAULT_MAX_TASKS_PER_CHILD = 50
+
+# How often a waiting slot checks for cancellation and shutdown
+POLL_INTERVAL = 0.1
+
+# Worker process loop: extract attachments sent over the pipe until the task budget is used up
+def _worker_main(conn, max_tasks):
+    import ReadEmailContent
+    try:
+        for _ in range(max_tasks):
+            try:
+                task = conn.recv()
+            except EOFError:
+                break
+            if task is None:
+                break
+            filename, data = task
+            conn.send(ReadEmailContent.read_attachment_bytes(filename, data))
+    finally:
+        conn.close()
+
+class _Slot:
+    """One worker process and the thread that feeds it tasks, enforces timeouts and recycles it."""
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.process = None
+        self.conn = None
+        self.tasks_done = 0
+        self.thread = threading.Thread(target=self.run, name=f"attachment-slot-{index}", daemon=True)
+        self.thread.start()
+
+    def _start_process(self):
+        parent_conn, child_conn = self.pool.ctx.Pipe()
+        self.process = self.pool.ctx.Process(target=_worker_main, args=(child_conn, self.pool.max_tasks_per_child), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.tasks_done = 0
+
+    def _stop_process(self, kill=False):
+        if self.process is None:
+            return
+        if kill:
+            self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+        self.process = None
+        self.conn = None
+
+    def run(self):
+        while True:
+            task = self.pool.tasks.get()
+            if task is None:
+                self._stop_process(kill=True)
+                return
+            future, filename, data = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._execute(future, filename, data))
+            except Exception as e:
+                self._stop_process(kill=True)
+                future.set_result(f"Error reading file: {str(e) or type(e).__name__}")
+            finally:
+                self.pool.cancelled.discard(future)
+
+    # Run one task in the worker process, killing the worker on timeout, cancellation or crash
+    def _execute(self, future, filename, data):
+        if self.process is None or self.tasks_done >= self.pool.max_tasks_per_child or not self.process.is_alive():
+            self._stop_process()
+            self._start_process()
+        self.conn.send((filename, bytes(data)))
+        self.tasks_done += 1
+
+        deadline = time.monotonic() + self.pool.timeout if self.pool.timeout else None
+        while True:
+            if self.conn.poll(POLL_INTERVAL):
+                try:
+                    return self.conn.recv()
+                except EOFError:
+                    self._stop_process(kill=True)
+                    return "Error reading file: attachment worker exited unexpectedly"
+            if future in self.pool.cancelled or self.pool.closing:
+                self.pool.cancelled.discard(future)
+                self._stop_process(kill=True)
+                return "Error reading file: cancelled"
+            if deadline and time.monotonic() > deadline:
+                self._stop_process(kill=True)
+                return f"Error reading file: timed out after {self.pool.timeout}s"
+
+class AttachmentPool:
+    """Extracts attachment text in separate processes so PDF parsing and OCR never block the pipeline.
+
+    `submit` returns a Future holding the extracted text (or an "Error reading file" message,
+    like read_attachment_bytes). Each task has a timeout after which its worker is killed and
+    replaced, and workers are recycled after `max_tasks_per_child` attachments.
+    """
+
+    def __init__(self, max_workers=None, timeout=DEFAULT_TIMEOUT, max_tasks_per_child=DEFAULT_MAX_TASKS_PER_CHILD, mp_context=None):
+        self.ctx = mp_context or multiprocessing.get_context("spawn")
+        self.timeout = timeout
+        self.max_tasks_per_child = max_tasks_per_child
+        self.tasks = queue.Queue()
+        self.cancelled = set()
+        self.closing = False
+        self.slots = [_Slot(self, index) for index in range(max_workers or os.cpu_count() or 1)]
+
+    # Queue one attachment for extraction
+    def submit(self, filename, data):
+        if self.closing:
+            raise RuntimeError("AttachmentPool is shut down")
+        future = Future()
+        self.tasks.put((future, filename, data))
+        return future
+
+    # Cancel a task: drop it if still queued, kill its worker if already running
+    def cancel(self, future):
+        if not future.cancel() and not future.done():
+            self.cancelled.add(future)
+
+    # Cancel every queued or running task that is not finished yet
+    def cancel_stragglers(self, futures):
+        for future in futures:
+            if not future.done():
+                self.cancel(future)
+
+    def shutdown(self, cancel_futures=False):
+        if cancel_futures:
+            self.closing = True
+            while True:
+                try:
+                    task = self.tasks.get_nowait()
+                except queue.Empty:
+                    break
+                if task is not None:
+                    task[0].cancel()
+        for _ in self.slots:
+            self.tasks.put(None)
+        for slot in self.slots:
+            slot.thread.join()
+        self.closing = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown(cancel_futures=exc_info[0] is not None)
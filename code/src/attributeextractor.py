@@ -0,0 +1,172 @@
+import re
+
+# Value shapes that key attributes take in our notices
+DATE = r"\d{1,2}[-/ ](?:[A-Za-z]{3,9}|\d{1,2})[-/ ]\d{2,4}|(?:[A-Z][a-z]{2,8}\.?) \d{1,2}, \d{4}|\d{4}-\d{2}-\d{2}"
+MONEY = r"(?:USD|US\$|\$)\s?\d[\d,]*(?:\.\d+)?(?:\s?(?:MM|M|million|billion)\b)?"
+RATE = r"\d+(?:\.\d+)?\s?%"
+IDENTIFIER = r"[A-Z0-9][A-Z0-9-]{5,19}\b"
+ACCOUNT = r"[X*\d][X*\d -]{2,24}\d"
+TEXT = r"[^\n*,;|]{2,100}"
+
+class Label:
+    """One label of an attribute rule and the context it needs around it.
+
+    `text` is matched case-insensitively and starts with a letter (the scanner's first-letter guard).
+    `before` lists alternatives that must end right before the label (fixed-width, case-sensitive
+    regexes such as LINE_START) and `after` is a regex that must follow it; neither is part of the match.
+    """
+
+    def __init__(self, text, before=(), after=None):
+        self.text = text
+        self.before = before
+        self.after = after
+
+    def pattern(self):
+        before = "|".join(f"(?m:(?<={context}))" for context in self.before)
+        after = f"(?={self.after})" if self.after else ""
+        return (f"(?:{before})" if before else "") + f"(?i:{self.text})" + after
+
+# Label contexts: the start of a line, optionally in markdown bold; the line below a number;
+# the colon after a field name
+LINE_START = (r"^", r"^\*\*")
+AFTER_NUMBER_LINE = (r"\d\n", r"\d\n\*\*")
+FIELD_COLON = r"\**\s*:"
+
+# Built-in rules by attribute name: labels and the value shape.
+# Attributes listed in config.json without a rule here are matched as "<name>: <text>".
+# Labels are full field names or phrases of the notices; a word that any email may contain
+# (Effective, Borrower, Reference, MEI) is a Label with the context it has in the notices.
+ATTRIBUTE_RULES = {
+    "Deal CUSIP": (["Deal CUSIP"], IDENTIFIER),
+    "Deal ISIN": (["Deal ISIN"], IDENTIFIER),
+    "Facility CUSIP": (["Facility CUSIP"], IDENTIFIER),
+    "Facility ISIN": (["Facility ISIN"], IDENTIFIER),
+    # A bare "MEI" or "ABA" only as a field name, followed by its colon
+    "Lender MEI": (["Lender MEI", Label("MEI", after=FIELD_COLON)], IDENTIFIER),
+    "ABA Number": (["ABA Number", r"ABA No\.?", "ABA Routing Number", Label("ABA", after=FIELD_COLON)], r"\d{9}\b"),
+    "Account Number": ([r"Account No\.?", "Account Number", r"Acct\.? No\.?"], ACCOUNT),
+    "Loan ID": (["Loan ID", r"Loan No\.?", "Loan Number"], IDENTIFIER),
+    "Transaction ID": (["Transaction ID", "Transaction Reference", r"Txn ID"], IDENTIFIER),
+    "Card Number (Masked)": (["Card Number", r"Card No\.?"], r"[X*\d][X*\d -]{10,22}\d"),
+    # "Effective 15-Apr-2025, ..." opens a notice; "effective from/as of" follows a change
+    "Effective Date": (["Effective Date", Label("Effective", before=LINE_START, after=r" \d"),
+                        Label("effective", after=r" from\b"), Label("effective as", after=r" of\b")], DATE),
+    "Due Date": (["Due Date", "Payment Due Date", Label("is due", after=r" (?:on|by)\b"),
+                  Label("are due", after=r" (?:on|by)\b"), Label("falls? due", after=r" (?:on|by)\b")], DATE),
+    "Date of Transaction": (["Date of Transaction", "Transaction Date"], DATE),
+    "Previous Principal Balance": (["Previous Global Principal Balance", "Previous Principal Balance"], MONEY),
+    "New Principal Balance": (["New Global Principal Balance", "New Principal Balance"], MONEY),
+    "Repayment Amount": (["Repayment Amount", "principal repayment", "share of the repayment", "elected to repay[^\n$]{0,60}?a total"], MONEY),
+    "Loan Amount": (["Loan Amount"], MONEY),
+    "Disbursed Amount": (["Disbursed Amount", "Disbursement Amount"], MONEY),
+    "Outstanding Amount": (["Outstanding Amount", "Outstanding Amount Due", "Amount Due"], MONEY),
+    "Disputed Amount": (["Disputed Amount", "Dispute Amount"], MONEY),
+    "Requested Limit": (["Requested Limit", "New Commitment Amount", "New Credit Limit"], MONEY),
+    "Previous Commitment Amount": (["Previous Commitment Amount"], MONEY),
+    "Previous Interest Rate": (["Previous Interest Rate"], RATE),
+    # "... rate of 5.2% will be changed to 5.5%"
+    "New Interest Rate": (["New Interest Rate", "interest rate (?:will be|has been) changed", Label("will be changed", before=(r"% ",))], RATE),
+    "Facility Type": (["Facility Type"], TEXT),
+    "Customer Name": (["Customer Name", "Borrower Name", Label("Borrower", before=LINE_START)], TEXT),
+    # The remittance reference sits right below the account number of the payment instructions
+    "Payment Reference": (["Payment Reference", Label("Reference", before=AFTER_NUMBER_LINE)], TEXT),
+}
+
+# Attribute collecting every amount not claimed by a labelled rule
+AMOUNTS = "Amounts"
+
+# Between a label and its value: a colon (optionally in markdown bold) or a short linking phrase
+SEPARATOR = r"(?:\**\s*[:#]\s*\**|\s+(?:of|is|on|from|to|at|by|due is|due on|will be)\b)?\s*(?:USD\s)?"
+TEXT_SEPARATOR = r"\**\s*:\s*\**\s*"
+
+class KeyAttributeExtractor:
+    """Extracts key attributes of structured loan notices with one compiled regex and a single pass.
+
+    Every rule becomes one named alternative of a combined pattern, so `extract` is one
+    `finditer` over the text whatever the number of attributes; the first value of each
+    attribute wins, and unlabelled amounts are collected under "Amounts". The word boundary
+    and the possible first letters of a label are checked once, before any alternative is
+    tried, which makes the scan several times faster than searching rule by rule.
+    """
+
+    def __init__(self, key_attributes=None):
+        names = list(dict.fromkeys(key_attributes or ATTRIBUTE_RULES))
+        alternatives = []
+        first_letters = set()
+        self.names = []
+        for name in names:
+            labels, value = ATTRIBUTE_RULES.get(name, ([re.escape(name)], TEXT))
+            labels = [label if isinstance(label, Label) else Label(label) for label in labels]
+            separator = TEXT_SEPARATOR if value == TEXT else SEPARATOR
+            first_letters.update(letter for label in labels for letter in (label.text[0].lower(), label.text[0].upper()))
+            # Longer labels first so "Effective Date" wins over "Effective" at the same position
+            label = "|".join(label.pattern() for label in sorted(labels, key=lambda label: len(label.text), reverse=True))
+            alternatives.append(f"(?:{label}){separator}(?P<a{len(self.names)}>{value})")
+            self.names.append(name)
+        guard = "".join(re.escape(letter) for letter in sorted(first_letters))
+        self.pattern = re.compile(f"\\b(?=[{guard}])(?:{'|'.join(alternatives)})|(?=[$U])(?P<a{len(self.names)}>{MONEY})")
+        self.names.append(AMOUNTS)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get("key_attributes", []))
+
+    # {attribute: value} found in one email, plus the unclaimed amounts as a list
+    def extract(self, email_text):
+        found = {}
+        amounts = []
+        for match in self.pattern.finditer(email_text):
+            name = self.names[int(match.lastgroup[1:])]
+            value = match.group(match.lastgroup).strip()
+            if name == AMOUNTS:
+                if value not in amounts:
+                    amounts.append(value)
+            elif value and name not in found:
+                found[name] = value
+        if amounts:
+            found[AMOUNTS] = amounts
+        return found
+
+    def extract_batch(self, email_texts):
+        return [self.extract(email_text) for email_text in email_texts]
+
+# Key attributes of an analysis result as {name: value}, whether the model returned a dict or "name: value" strings
+def key_attributes_as_dict(key_attributes):
+    if isinstance(key_attributes, dict):
+        return dict(key_attributes)
+    attributes = {}
+    for item in key_attributes or []:
+        name, _, value = str(item).partition(":")
+        attributes[name.strip()] = value.strip()
+    return attributes
+
+def _normalize(value):
+    return re.sub(r"[\s,$]|USD|\.0+\b", "", str(value)).lower()
+
+# Check the model's key attributes against the extracted ones: extracted values fill in what
+# the model left out (listed in "extracted_attributes", which the confidence score does not
+# count), and attributes where both disagree are reported as conflicts (or, with prefer_extracted,
+# replaced, for results that were not produced from this email's text)
+def merge_key_attributes(response_json, extracted, prefer_extracted=False):
+    attributes = key_attributes_as_dict(response_json.get("key_attributes", []))
+    lowered = {name.lower(): name for name in attributes}
+    extracted_only = list(response_json.pop("extracted_attributes", []))
+    conflicts = {}
+    for name, value in extracted.items():
+        if name == AMOUNTS:
+            continue
+        model_name = lowered.get(name.lower())
+        if model_name is None:
+            attributes[name] = value
+            extracted_only.append(name)
+        elif prefer_extracted:
+            attributes[model_name] = value
+        elif _normalize(attributes[model_name]) != _normalize(value) and _normalize(value) not in _normalize(attributes[model_name]):
+            conflicts[name] = {"model": attributes[model_name], "extracted": value}
+    response_json["key_attributes"] = attributes
+    if extracted_only:
+        response_json["extracted_attributes"] = extracted_only
+    response_json.pop("key_attribute_conflicts", None)
+    if conflicts:
+        response_json["key_attribute_conflicts"] = conflicts
+    return response_json
@@ -0,0 +1,446 @@
+import argparse
+import csv
+import json
+import os
+import statistics
+import sys
+from dotenv import load_dotenv
+import emailpipeline
+import instrumentation
+from llmdispatcher import LLMDispatcher
+from llmbackends import LlamaCppBackend
+from emailbatcher import EmailBatcher, DEFAULT_BATCH_TOKENS
+from resultcache import ResultCache, CACHE_PATH
+from ingestmanifest import IngestManifest, MANIFEST_PATH, PROCESSED_FOLDER, file_sha256
+from checkpointjournal import CheckpointJournal, CHECKPOINT_PATH
+from promptbudget import DEFAULT_TOKEN_BUDGET
+from threadindex import ThreadIndex, THREAD_INDEX_PATH
+from srregistry import SRRegistry, SR_REGISTRY_PATH
+from nearduplicates import NearDuplicateIndex, NEAR_DUPLICATE_PATH, DEFAULT_SIMILARITY_THRESHOLD
+from localclassifier import LocalClassifier, MODEL_PATH
+from attributeextractor import KeyAttributeExtractor
+from structuredoutput import build_output_schema
+from attachmentpool import AttachmentPool, DEFAULT_TIMEOUT, DEFAULT_MAX_TASKS_PER_CHILD
+from stagedpipeline import Stage, StagedPipeline
+
+# Threads in the parse stage of the pipeline
+DEFAULT_PARSE_WORKERS = 4
+
+# Most emails the local pre-classifier scores in one batch
+LOCAL_BATCH_SIZE = 64
+
+# Column order of the CSV export (same as the Streamlit download)
+CSV_FIELDS = ["File", "SR Number", "Request Type", "Sub Request Type", "Key Attributes", "Main Intent", "Confidence Score", "Confidence Explanation", "Total Tokens", "Repairs", "Error"]
+
+# Expand directories and file arguments into the list of emails to analyze
+# (with a manifest, directories only contribute new or changed files)
+def collect_files(paths, manifest=None):
+    files = []
+    for path in paths:
+        if os.path.isdir(path) and manifest is not None:
+            files.extend(manifest.scan(path, emailpipeline.SUPPORTED_EXTENSIONS))
+        elif os.path.isdir(path):
+            for file_name in sorted(os.listdir(path)):
+                file_path = os.path.join(path, file_name)
+                if os.path.isfile(file_path) and file_name.lower().endswith(emailpipeline.SUPPORTED_EXTENSIONS):
+                    files.append(file_path)
+        else:
+            files.append(path)
+    return files
+
+class BatchAnalyzer:
+    """Runs the email pipeline over many files and produces one result record per file.
+
+    `llm` is normally an LLMDispatcher. Files then go through a staged pipeline: `parse_workers`
+    threads read files (handing attachments to the attachment pool's processes) while one
+    classify thread per dispatcher slot waits on the LLM, so parsing overlaps the LLM calls;
+    records still come back in input order and `pipeline.stats()` shows how busy each stage is.
+    With a pre-classifier, a "local" stage between them scores the parsed emails in batches.
+    With a CheckpointJournal, every record is journaled as it is produced and files the journal
+    has completed are not analyzed again (their record comes back marked "resumed").
+    With `on_route`, replies are streamed and on_route(file, request_type, sub_request_type)
+    is called as soon as those fields are complete, before the record is finished.
+    """
+
+    def __init__(self, llm, cache=None, attachment_pool=None, model=emailpipeline.MODEL_NAME, temperature=emailpipeline.TEMPERATURE,
+                 token_budget=DEFAULT_TOKEN_BUDGET, thread_index=None, near_duplicates=None,
+                 pre_classifier=None, attribute_extractor=None, output_schema=None, on_route=None, sr_registry=None,
+                 parse_workers=DEFAULT_PARSE_WORKERS, journal=None):
+        self.llm = llm
+        self.cache = cache
+        self.attachment_pool = attachment_pool
+        self.model = model
+        self.temperature = temperature
+        self.token_budget = token_budget
+        self.thread_index = thread_index
+        self.near_duplicates = near_duplicates
+        self.pre_classifier = pre_classifier
+        self.attribute_extractor = attribute_extractor
+        self.output_schema = output_schema
+        self.on_route = on_route
+        self.sr_registry = sr_registry
+        self.parse_workers = parse_workers
+        self.journal = journal
+        self.pipeline = None
+
+    # Analyze one file and return a result record (errors are recorded, not raised)
+    def analyze_file(self, file_path):
+        return self._classify(self._parse(file_path))
+
+    # Parse stage: the file's text (attachments included), thread headers, journal key and a slot for
+    # the local prediction (no text when the record is already final: a parse error, or a file
+    # completed by an earlier run)
+    def _parse(self, file_path):
+        with instrumentation.span("parse", trace_id=file_path):
+            return self._read(file_path) + (None,)
+
+    def _read(self, file_path):
+        record = {"file": file_path}
+        file_hash = None
+        try:
+            if self.journal is not None:
+                file_hash = file_sha256(file_path)
+                completed = self.journal.completed(file_hash)
+                if completed is not None:
+                    instrumentation.count("emails", status="resumed")
+                    return dict(completed, file=file_path, resumed=True), None, None, None
+            email_text = emailpipeline.read_email_file(file_path, self.attachment_pool)
+            if not email_text.strip():
+                record["error"] = "Empty email content"
+                return record, None, None, file_hash
+            thread_headers = emailpipeline.read_email_headers(file_path) if self.thread_index else None
+        except Exception as e:
+            record["error"] = str(e)
+            return record, None, None, file_hash
+        return record, email_text, thread_headers, file_hash
+
+    # Local stage: the pre-classifier's predictions for a batch of parsed emails, scored together
+    def _preclassify(self, batch):
+        with instrumentation.span("local", emails=len(batch)):
+            texts = [emailpipeline.preprocess_email(parsed[1]) for parsed in batch if parsed[1] is not None]
+            predictions = iter(self.pre_classifier.classify_batch(texts, self.output_schema))
+            return [parsed[:4] + (next(predictions) if parsed[1] is not None else None,) for parsed in batch]
+
+    # Classify stage: the rest of the pipeline, LLM call included; the record is journaled before it is returned
+    def _classify(self, parsed):
+        record, email_text, thread_headers, file_hash, local_prediction = parsed
+        if email_text is not None:
+            with instrumentation.span("classify", trace_id=record["file"]):
+                self._analyze(record, email_text, thread_headers, local_prediction)
+        if "error" in record:
+            instrumentation.record_error("email", record["error"], file=record["file"])
+            instrumentation.count("emails", status="failed")
+        elif not record.get("resumed"):
+            instrumentation.count("emails", status="analyzed")
+        if file_hash is not None:
+            self.journal.commit(file_hash, record)
+        return record
+
+    def _analyze(self, record, email_text, thread_headers, local_prediction=None):
+        file_path = record["file"]
+        try:
+            record["result"] = emailpipeline.analyze_email(email_text, self.llm, self.cache, self.model, self.temperature,
+                                                          self.token_budget, self.thread_index, thread_headers,
+                                                          self.near_duplicates, self.pre_classifier, self.attribute_extractor,
+                                                          self.output_schema, self._route_callback(file_path), self.sr_registry,
+                                                          local_prediction)
+        except json.JSONDecodeError as e:
+            record["error"] = e.msg if hasattr(e, "errors") else f"AI did not return valid JSON: {str(e)}"
+            record["repairs"] = getattr(e, "repairs", 0)
+        except Exception as e:
+            record["error"] = str(e)
+
+    # on_field callback that reports the routing fields of one file once both have arrived
+    def _route_callback(self, file_path):
+        if self.on_route is None:
+            return None
+        fields = {}
+
+        def on_field(name, value):
+            if name in emailpipeline.ROUTING_FIELDS and name not in fields:
+                fields[name] = value
+                if len(fields) == len(emailpipeline.ROUTING_FIELDS):
+                    self.on_route(file_path, *(fields[name] for name in emailpipeline.ROUTING_FIELDS))
+        return on_field
+
+    # Analyze files concurrently through the staged pipeline, yielding records in input order
+    def analyze_files(self, files):
+        if isinstance(self.llm, LLMDispatcher):
+            stages = [Stage("parse", self._parse, self.parse_workers)]
+            if self.pre_classifier is not None:
+                stages.append(Stage("local", self._preclassify, batch_size=LOCAL_BATCH_SIZE))
+            self.pipeline = StagedPipeline(stages + [Stage("classify", self._classify, self.llm.max_concurrency)])
+            yield from self.pipeline.imap(files)
+        else:
+            for file_path in files:
+                yield self.analyze_file(file_path)
+
+class ResultWriter:
+    """Streams result records to JSONL and/or CSV, flushing after every record.
+
+    With `atomic`, records go to temporary files next to the outputs, which replace them in one
+    rename on a clean close: an output file is either the previous one or a complete new one.
+    When the `with` block exits with an exception, the temporary files are deleted instead.
+    With `append` (not atomic), records are added to existing outputs; a CSV gets its header when it is new.
+    """
+
+    def __init__(self, jsonl_path=None, csv_path=None, atomic=False, append=False):
+        self.atomic = atomic
+        self.append = append
+        self.renames = []
+        self.jsonl_file = self._open(jsonl_path)
+        self.csv_file = self._open(csv_path, newline="")
+        self.csv_writer = None
+        if self.csv_file:
+            self.csv_writer = csv.DictWriter(self.csv_file, fieldnames=CSV_FIELDS)
+            if self.csv_file.tell() == 0:
+                self.csv_writer.writeheader()
+
+    def write(self, record):
+        if self.jsonl_file:
+            self.jsonl_file.write(json.dumps(record) + "\n")
+            self.jsonl_file.flush()
+        if self.csv_writer:
+            row = emailpipeline.result_to_row(record["result"]) if "result" in record else {}
+            row["File"] = record["file"]
+            row["Error"] = record.get("error", "")
+            if "repairs" in record:
+                row["Repairs"] = record["repairs"]
+            self.csv_writer.writerow(row)
+            self.csv_file.flush()
+
+    def _open(self, path, **kwargs):
+        if not path:
+            return None
+        if self.atomic:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            self.renames.append((tmp_path, path))
+            path = tmp_path
+        return open(path, "a" if self.append else "w", encoding="utf-8", **kwargs)
+
+    # Close the outputs; atomic outputs replace the previous files only when publish is true
+    def close(self, publish=True):
+        for f in (self.jsonl_file, self.csv_file):
+            if f and not f.closed:
+                if self.atomic and publish:
+                    os.fsync(f.fileno())
+                f.close()
+        for tmp_path, path in self.renames:
+            if publish:
+                os.replace(tmp_path, path)
+            elif os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.renames = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(publish=exc_type is None)
+
+# Route notification for --stream: the request types of a file, before its record is written
+def print_route(file_path, request_type, sub_request_type):
+    print(f"Routed {file_path}: {request_type} / {sub_request_type}", file=sys.stderr)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze a batch of emails without the Streamlit UI.")
+    parser.add_argument("paths", nargs="+", help="Directories or .eml/.msg/.txt files to analyze")
+    parser.add_argument("--incremental", action="store_true", help="Skip files the manifest has already seen unchanged")
+    add_pipeline_arguments(parser)
+    return parser.parse_args(argv)
+
+# Options for the output, the LLM and every pipeline component (shared with inputwatcher.py)
+def add_pipeline_arguments(parser):
+    parser.add_argument("--jsonl", help="Write one JSON result per line to this file")
+    parser.add_argument("--csv", help="Write results as CSV to this file")
+    parser.add_argument("--backend", choices=["openai", "llamacpp"], help="LLM backend (default: the \"llm\" section of config.json)")
+    parser.add_argument("--model", help="Chat model name (openai backend)")
+    parser.add_argument("--temperature", type=float, help="Sampling temperature")
+    parser.add_argument("--api-base", help="OpenAI-compatible endpoint URL (e.g. a local fakechatserver.py)")
+    parser.add_argument("--model-path", help="GGUF model file (llamacpp backend)")
+    parser.add_argument("--llama-workers", type=int, help="Worker processes, each holding one loaded model (llamacpp backend)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum LLM requests in flight")
+    parser.add_argument("--parse-workers", type=int, default=DEFAULT_PARSE_WORKERS,
+                        help="Threads reading files while earlier emails wait on the LLM")
+    parser.add_argument("--rpm", type=int, help="Requests per minute limit")
+    parser.add_argument("--tpm", type=int, help="Tokens per minute limit")
+    parser.add_argument("--max-retries", type=int, default=5, help="Retries on 429/5xx responses")
+    parser.add_argument("--token-budget", type=int, default=DEFAULT_TOKEN_BUDGET,
+                        help="Prompt tokens allowed for the email content; larger attachments are summarized "
+                             "(0 = no limit; always capped to the context window of the llamacpp backend)")
+    parser.add_argument("--thread-index", default=THREAD_INDEX_PATH, help="Thread deduplication index database")
+    parser.add_argument("--no-thread-index", action="store_true", help="Classify every email in full, ignoring known threads")
+    parser.add_argument("--sr-registry", default=SR_REGISTRY_PATH, help="SR registry database (SR numbers and prior classifications)")
+    parser.add_argument("--no-sr-registry", action="store_true",
+                        help="Generate random SR numbers without a registry (not safe with parallel runs)")
+    parser.add_argument("--near-duplicates", nargs="?", const=NEAR_DUPLICATE_PATH, metavar="DB",
+                        help="Reuse the result and SR of a near-identical earlier email from this MinHash index (default: near_duplicates.sqlite)")
+    parser.add_argument("--similarity-threshold", type=float, default=DEFAULT_SIMILARITY_THRESHOLD,
+                        help="Estimated Jaccard similarity at which --near-duplicates reuses a result")
+    parser.add_argument("--local-model", nargs="?", const=MODEL_PATH, metavar="PATH",
+                        help="Classify with this local model first and only call the LLM below --local-threshold (default: local_classifier.json)")
+    parser.add_argument("--local-threshold", type=float,
+                        help="Probability the local model needs to skip the LLM (default: the threshold calibrated when it was trained)")
+    parser.add_argument("--batch-emails", type=int, default=0, metavar="N",
+                        help="Pack up to N short emails into one LLM request (0: one email per request)")
+    parser.add_argument("--batch-tokens", type=int, default=DEFAULT_BATCH_TOKENS, help="Email tokens allowed in one batched request")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream replies and print each email's route as soon as its request types are known")
+    parser.add_argument("--no-structured-output", action="store_true",
+                        help="Do not constrain and validate replies against the config.json output schema")
+    parser.add_argument("--no-attribute-rules", action="store_true",
+                        help="Do not merge regex-extracted key attributes (config.json key_attributes) into the results")
+    parser.add_argument("--attachment-workers", type=int, default=0,
+                        help="Extract attachments in this many worker processes (0 = inline)")
+    parser.add_argument("--attachment-timeout", type=float, default=DEFAULT_TIMEOUT, help="Seconds allowed per attachment")
+    parser.add_argument("--worker-max-tasks", type=int, default=DEFAULT_MAX_TASKS_PER_CHILD,
+                        help="Attachments a worker process handles before it is replaced")
+    parser.add_argument("--checkpoint", nargs="?", const=CHECKPOINT_PATH, metavar="DB",
+                        help="Journal every result in DB and skip files it has completed, so an interrupted run "
+                             "can be resumed by running it again (default: batch_checkpoint.sqlite)")
+    parser.add_argument("--manifest", default=MANIFEST_PATH, help="Ingestion manifest database used by --incremental")
+    parser.add_argument("--move-processed", nargs="?", const=PROCESSED_FOLDER, metavar="DIR",
+                        help="Move successfully analyzed files into DIR (default: processed/)")
+    parser.add_argument("--trace", metavar="FILE", help="Append a JSON line per pipeline stage of every email (timings, tokens, errors) to FILE")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="Serve stage timings and token, cache, retry and failure counters for Prometheus on PORT (/metrics)")
+    parser.add_argument("--cache", default=CACHE_PATH, help="Result cache database")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the LLM")
+    parser.add_argument("--cache-ttl", type=float, help="Seconds before a cached result expires")
+    parser.add_argument("--cache-max-entries", type=int, default=10000, help="Cached results kept before LRU eviction")
+
+# Command-line overrides of the backend's config.json settings
+def backend_options(args, config):
+    backend = args.backend or config.get("llm", {}).get("backend", "openai")
+    options = {} if args.temperature is None else {"temperature": args.temperature}
+    if backend == "openai":
+        # Retries are handled by the dispatcher, with backoff shared across workers
+        options["max_retries"] = 0
+        if args.model:
+            options["model"] = args.model
+        if args.api_base:
+            options["openai_api_base"] = args.api_base
+    elif backend == "llamacpp":
+        if args.model_path:
+            options["model_path"] = os.path.abspath(args.model_path)
+        if args.llama_workers:
+            options["workers"] = args.llama_workers
+    return options
+
+# Build the LLM dispatcher, the pipeline components and the analyzer from the command-line options
+def build_analyzer(args, config):
+    if args.trace or args.metrics_port is not None:
+        instrumentation.enable(args.trace)
+        if args.metrics_port is not None:
+            instrumentation.serve_metrics(args.metrics_port)
+    output_schema = None if args.no_structured_output else build_output_schema(config)
+    # A batched request answers with an array, so the API is not held to the single-email schema;
+    # every demultiplexed entry is still validated against it
+    llm = emailpipeline.create_backend(config, args.backend, output_schema=None if args.batch_emails else output_schema,
+                                       **backend_options(args, config))
+    batcher = EmailBatcher(llm, output_schema, args.batch_emails, args.batch_tokens) if args.batch_emails else None
+    # With batching, each request in flight holds up to --batch-emails waiting emails
+    dispatcher = LLMDispatcher(batcher or llm, max_concurrency=args.concurrency * max(1, args.batch_emails),
+                               requests_per_minute=args.rpm, tokens_per_minute=args.tpm, max_retries=args.max_retries)
+    cache = None if args.no_cache else ResultCache(args.cache, max_entries=args.cache_max_entries, ttl_seconds=args.cache_ttl)
+
+    attachment_pool = None
+    if args.attachment_workers:
+        attachment_pool = AttachmentPool(args.attachment_workers, timeout=args.attachment_timeout,
+                                         max_tasks_per_child=args.worker_max_tasks)
+    thread_index = None if args.no_thread_index else ThreadIndex(args.thread_index)
+    sr_registry = None if args.no_sr_registry else SRRegistry(args.sr_registry)
+    near_duplicates = NearDuplicateIndex(args.near_duplicates, args.similarity_threshold) if args.near_duplicates else None
+    pre_classifier = LocalClassifier.load(args.local_model, args.local_threshold, config) if args.local_model else None
+    attribute_extractor = None if args.no_attribute_rules else KeyAttributeExtractor.from_config(config)
+    token_budget = emailpipeline.backend_token_budget(llm, args.token_budget, output_schema)
+    journal = CheckpointJournal(args.checkpoint) if args.checkpoint else None
+    return BatchAnalyzer(dispatcher, cache, attachment_pool, emailpipeline.backend_model_name(llm), llm.temperature, token_budget,
+                         thread_index, near_duplicates, pre_classifier, attribute_extractor, output_schema,
+                         print_route if args.stream else None, sr_registry, args.parse_workers, journal)
+
+# Print the statistics of the analyzer's components to stderr and release them
+def close_analyzer(analyzer):
+    dispatcher = analyzer.llm
+    batcher = dispatcher.llm if isinstance(dispatcher.llm, EmailBatcher) else None
+    backend = batcher.llm if batcher else dispatcher.llm
+    if analyzer.pipeline:
+        print(f"Stages: {json.dumps(analyzer.pipeline.stats())}", file=sys.stderr)
+    if analyzer.journal:
+        print(f"Checkpoint: {json.dumps(analyzer.journal.stats)}", file=sys.stderr)
+        analyzer.journal.close()
+    if analyzer.cache is not None:
+        print(f"Cache: {json.dumps(analyzer.cache.stats())}", file=sys.stderr)
+        analyzer.cache.close()
+    if analyzer.thread_index:
+        print(f"Threads: {json.dumps(analyzer.thread_index.stats)}", file=sys.stderr)
+        analyzer.thread_index.close()
+    if analyzer.sr_registry:
+        print(f"SR registry: {json.dumps(analyzer.sr_registry.stats)}", file=sys.stderr)
+        analyzer.sr_registry.close()
+    if analyzer.near_duplicates:
+        print(f"Near-duplicates: {json.dumps(analyzer.near_duplicates.stats)}", file=sys.stderr)
+        analyzer.near_duplicates.close()
+    if batcher:
+        print(f"Batching: {json.dumps(batcher.stats)}", file=sys.stderr)
+    if analyzer.pre_classifier:
+        print(f"Local classifier: {json.dumps(analyzer.pre_classifier.stats)}", file=sys.stderr)
+    if analyzer.attachment_pool:
+        analyzer.attachment_pool.shutdown()
+    if isinstance(backend, LlamaCppBackend):
+        backend.close()
+    instrumentation.disable()
+
+def main(argv=None):
+    args = parse_args(argv)
+    load_dotenv()
+    manifest = IngestManifest(args.manifest) if args.incremental or args.move_processed else None
+    files = collect_files(args.paths, manifest if args.incremental else None)
+    analyzer = build_analyzer(args, emailpipeline.load_config())
+    dispatcher = analyzer.llm
+
+    failed = 0
+    total_tokens = 0
+    prompt_tokens = 0
+    cached_prompt_tokens = 0
+    repairs = 0
+    first_fields = []
+    handled = []
+    with ResultWriter(args.jsonl, args.csv, atomic=True) as writer:
+        for record in analyzer.analyze_files(files):
+            writer.write(record)
+            if not (args.jsonl or args.csv):
+                print(json.dumps(record))
+            repairs += record.get("repairs", 0) or record.get("result", {}).get("token_usage", {}).get("repairs", 0)
+            if "error" in record:
+                failed += 1
+                print(f"Error processing {record['file']}: {record['error']}", file=sys.stderr)
+                continue
+            # The tokens of a resumed record were spent by an earlier run
+            token_usage = {} if record.get("resumed") else record["result"].get("token_usage", {})
+            total_tokens += token_usage.get("total_tokens", 0)
+            prompt_tokens += token_usage.get("prompt_tokens", 0)
+            cached_prompt_tokens += token_usage.get("cached_prompt_tokens", 0)
+            if not record.get("resumed") and record["result"].get("streaming", {}).get("first_field") is not None:
+                first_fields.append(record["result"]["streaming"]["first_field"])
+            handled.append(record["file"])
+
+    # Inputs are only moved (or marked analyzed) once the outputs holding their results are committed,
+    # so a run that fails before that still sees them when it is resumed
+    for file_path in handled:
+        if args.move_processed:
+            manifest.move_to_processed(file_path, args.move_processed)
+        elif manifest is not None:
+            manifest.record(file_path, status="analyzed")
+
+    print(f"Processed {len(files)} file(s), {failed} failed, {dispatcher.stats['retries']} LLM retries, {repairs} output repairs, {total_tokens} tokens.", file=sys.stderr)
+    if cached_prompt_tokens:
+        print(f"Prompt cache: {cached_prompt_tokens} of {prompt_tokens} prompt tokens served from the provider cache.", file=sys.stderr)
+    if first_fields:
+        print(f"Streaming: median time to first field {statistics.median(first_fields):.3f}s over {len(first_fields)} LLM call(s).",
+              file=sys.stderr)
+    close_analyzer(analyzer)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""Benchmark key-attribute extraction on the sample corpus: the combined single-pass scanner against one search per rule.
+
+    python benchmarks/bench_attributes.py --repeat 200
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import re
+import sys
+import time
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_DIR)
+
+from attributeextractor import KeyAttributeExtractor, Label, ATTRIBUTE_RULES, SEPARATOR, TEXT_SEPARATOR, TEXT  # noqa: E402
+from emailpipeline import load_config, preprocess_email, read_email_file, SUPPORTED_EXTENSIONS  # noqa: E402
+
+TEST_DIR = os.path.join(os.path.dirname(SRC_DIR), "test")
+
+# Sample emails: Emails.csv plus every readable email in Input/ and the test folder
+def load_corpus():
+    texts = []
+    with open(os.path.join(TEST_DIR, "Emails.csv"), "r", encoding="utf-8-sig", newline="") as f:
+        texts.extend(row["email"] for row in csv.DictReader(f))
+    for path in sorted(glob.glob(os.path.join(SRC_DIR, "Input", "*")) + glob.glob(os.path.join(TEST_DIR, "*"))):
+        if path.lower().endswith(SUPPORTED_EXTENSIONS):
+            try:
+                texts.append(read_email_file(path))
+            except Exception as e:  # .msg needs extract_msg
+                print(f"Skipping {os.path.basename(path)}: {e}", file=sys.stderr)
+    return [preprocess_email(text) for text in texts]
+
+# Baseline: one compiled pattern per attribute, each searched over the whole text
+def per_rule_patterns(key_attributes):
+    patterns = {}
+    for name in key_attributes:
+        labels, value = ATTRIBUTE_RULES.get(name, ([re.escape(name)], TEXT))
+        labels = [label if isinstance(label, Label) else Label(label) for label in labels]
+        label = "|".join(label.pattern() for label in sorted(labels, key=lambda label: len(label.text), reverse=True))
+        separator = TEXT_SEPARATOR if value == TEXT else SEPARATOR
+        patterns[name] = re.compile(f"\\b(?:{label}){separator}({value})")
+    return patterns
+
+def extract_per_rule(patterns, text):
+    found = {}
+    for name, pattern in patterns.items():
+        match = pattern.search(text)
+        if match:
+            found[name] = match.group(1).strip()
+    return found
+
+def time_bulk(func, texts, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            func(text)
+    elapsed = time.perf_counter() - start
+    total_bytes = sum(len(text) for text in texts) * repeat
+    return {"emails_per_second": round(len(texts) * repeat / elapsed), "mb_per_second": round(total_bytes / elapsed / 1e6, 2),
+            "us_per_email": round(elapsed / (len(texts) * repeat) * 1e6, 1)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    key_attributes = load_config()["key_attributes"]
+    texts = load_corpus()
+    extractor = KeyAttributeExtractor(key_attributes)
+    patterns = per_rule_patterns(key_attributes)
+
+    report = {"emails": len(texts), "attributes": len(key_attributes),
+              "attributes_found": sum(len(found) for found in extractor.extract_batch(texts)),
+              "single_pass": time_bulk(extractor.extract, texts, args.repeat),
+              "per_rule": time_bulk(lambda text: extract_per_rule(patterns, text), texts, args.repeat)}
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Benchmark LLM backends: tokens per second through the OpenAI-compatible and the local llama.cpp backend.
+
+The OpenAI backend is measured against a local fake chat endpoint unless --api-base points
+elsewhere; the llama.cpp backend is measured when its GGUF model file exists.
+
+    python benchmarks/bench_backends.py --emails 20 --model-path llama_model/llama-2-7b-chat.Q4_K_M.gguf --llama-workers 2
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_DIR)
+
+from emailpipeline import load_config, create_backend, preprocess_email, build_messages  # noqa: E402
+from fakechatserver import FakeChatServer  # noqa: E402
+from llmbackends import LlamaCppBackend  # noqa: E402
+from promptbudget import TokenUsage  # noqa: E402
+from structuredoutput import build_output_schema  # noqa: E402
+
+EMAILS_CSV = os.path.join(os.path.dirname(SRC_DIR), "test", "Emails.csv")
+
+def load_emails(count):
+    with open(EMAILS_CSV, "r", encoding="utf-8-sig", newline="") as f:
+        texts = [preprocess_email(row["email"]) for row in csv.DictReader(f)]
+    return (texts * (count // len(texts) + 1))[:count]
+
+# Classify every email once and report throughput (after one untimed warm-up call per worker,
+# so connection setup and model loading are not counted); llama.cpp gets the whole batch at once
+def run(llm, messages_list, concurrency):
+    usage = TokenUsage()
+    local = isinstance(llm, LlamaCppBackend)
+    if local:
+        llm.batch(messages_list[:llm.workers])
+    else:
+        llm(messages_list[0])
+    start = time.perf_counter()
+    if local:
+        responses = llm.batch(messages_list)
+    else:
+        with ThreadPoolExecutor(concurrency) as executor:
+            responses = list(executor.map(llm, messages_list))
+    elapsed = time.perf_counter() - start
+    for messages, response in zip(messages_list, responses):
+        usage.add(messages, response)
+    return {"emails": len(messages_list), "seconds": round(elapsed, 3),
+            "emails_per_second": round(len(messages_list) / elapsed, 2),
+            "prompt_tokens_per_second": round(usage.prompt_tokens / elapsed),
+            "completion_tokens_per_second": round(usage.completion_tokens / elapsed),
+            "total_tokens_per_second": round((usage.prompt_tokens + usage.completion_tokens) / elapsed)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--emails", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight for the OpenAI backend")
+    parser.add_argument("--api-base", help="OpenAI-compatible endpoint (default: a local fake server)")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake server seconds per response")
+    parser.add_argument("--model-path", help="GGUF model for the llama.cpp backend (default: config.json)")
+    parser.add_argument("--llama-workers", type=int, help="llama.cpp worker processes")
+    args = parser.parse_args()
+
+    config = load_config()
+    output_schema = build_output_schema(config)
+    messages_list = [build_messages(text, output_schema) for text in load_emails(args.emails)]
+    report = {}
+
+    server = None
+    if not args.api_base:
+        server = FakeChatServer(("127.0.0.1", 0), latency=args.latency)
+        server.start_background()
+    try:
+        llm = create_backend(config, "openai", api_key=None if args.api_base else "fake", output_schema=output_schema,
+                             openai_api_base=args.api_base or server.base_url, max_retries=0)
+        report["openai"] = run(llm, messages_list, args.concurrency)
+    except Exception as e:
+        report["openai"] = {"error": str(e)}
+    finally:
+        if server:
+            server.shutdown()
+
+    llama_options = {"model_path": os.path.abspath(args.model_path)} if args.model_path else {}
+    if args.llama_workers:
+        llama_options["workers"] = args.llama_workers
+    try:
+        llm = create_backend(config, "llamacpp", output_schema=output_schema, **llama_options)
+    except (FileNotFoundError, ImportError) as e:
+        report["llamacpp"] = {"skipped": str(e)}
+    else:
+        try:
+            report["llamacpp"] = run(llm, messages_list, args.concurrency)
+        finally:
+            llm.close()
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
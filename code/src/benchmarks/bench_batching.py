@@ -0,0 +1,97 @@
+"""Benchmark multi-email batching against one email per request: throughput and emails per dollar on the code/test emails.
+
+Requests go to a local fake chat endpoint (with a fixed latency per request) unless
+--api-base points at a real one; cost is computed from the reported token usage.
+
+    python benchmarks/bench_batching.py --repeat 5 --batch-emails 8
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_DIR)
+
+from emailpipeline import load_config, create_llm, preprocess_email, classify_email, read_email_file, SUPPORTED_EXTENSIONS  # noqa: E402
+from emailbatcher import EmailBatcher, DEFAULT_BATCH_TOKENS  # noqa: E402
+from fakechatserver import FakeChatServer  # noqa: E402
+from llmdispatcher import LLMDispatcher  # noqa: E402
+from structuredoutput import build_output_schema  # noqa: E402
+
+TEST_DIR = os.path.join(os.path.dirname(SRC_DIR), "test")
+
+# gpt-4o-mini list prices in USD per million tokens
+PRICES = {"input": 0.15, "cached_input": 0.075, "output": 0.60}
+
+# Emails.csv plus every readable email file in code/test
+def load_corpus():
+    with open(os.path.join(TEST_DIR, "Emails.csv"), "r", encoding="utf-8-sig", newline="") as f:
+        texts = [row["email"] for row in csv.DictReader(f)]
+    for path in sorted(glob.glob(os.path.join(TEST_DIR, "*"))):
+        if path.lower().endswith(SUPPORTED_EXTENSIONS):
+            try:
+                texts.append(read_email_file(path))
+            except Exception as e:  # .msg needs extract_msg
+                print(f"Skipping {os.path.basename(path)}: {e}", file=sys.stderr)
+    return [preprocess_email(text) for text in texts]
+
+def cost(token_usage):
+    cached = token_usage.get("cached_prompt_tokens", 0)
+    prompt = token_usage.get("prompt_tokens", 0) + token_usage.get("summary_prompt_tokens", 0)
+    completion = token_usage.get("completion_tokens", 0) + token_usage.get("summary_completion_tokens", 0)
+    return ((prompt - cached) * PRICES["input"] + cached * PRICES["cached_input"] + completion * PRICES["output"]) / 1e6
+
+def run(llm, texts, output_schema, concurrency):
+    dispatcher = LLMDispatcher(llm, max_concurrency=concurrency, max_retries=3)
+    start = time.perf_counter()
+    results = dispatcher.map(lambda text: classify_email(text, dispatcher, output_schema=output_schema), texts)
+    elapsed = time.perf_counter() - start
+    total_cost = sum(cost(result["token_usage"]) for result in results)
+    return {"emails": len(texts), "seconds": round(elapsed, 3),
+            "emails_per_second": round(len(texts) / elapsed, 2),
+            "prompt_tokens": sum(result["token_usage"]["prompt_tokens"] for result in results),
+            "completion_tokens": sum(result["token_usage"]["completion_tokens"] for result in results),
+            "cost_usd": round(total_cost, 6), "emails_per_dollar": round(len(texts) / total_cost) if total_cost else None}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Copies of the corpus to classify")
+    parser.add_argument("--batch-emails", type=int, default=8)
+    parser.add_argument("--batch-tokens", type=int, default=DEFAULT_BATCH_TOKENS)
+    parser.add_argument("--concurrency", type=int, default=4, help="LLM requests in flight")
+    parser.add_argument("--api-base", help="OpenAI-compatible endpoint (default: a local fake server)")
+    parser.add_argument("--latency", type=float, default=0.3, help="Fake server seconds per request")
+    args = parser.parse_args()
+
+    output_schema = build_output_schema(load_config())
+    texts = load_corpus() * args.repeat
+    server = None
+    if not args.api_base:
+        server = FakeChatServer(("127.0.0.1", 0), latency=args.latency)
+        server.start_background()
+    try:
+        single = create_llm(api_key=None if args.api_base else "fake", openai_api_base=args.api_base or server.base_url,
+                            output_schema=output_schema, max_retries=0)
+        unconstrained = create_llm(api_key=None if args.api_base else "fake", openai_api_base=args.api_base or server.base_url,
+                                   max_retries=0)
+        batcher = EmailBatcher(unconstrained, output_schema, args.batch_emails, args.batch_tokens)
+        report = {"single": run(single, texts, output_schema, args.concurrency)}
+        single_requests = server.stats["requests"] if server else None
+        report["batched"] = run(batcher, texts, output_schema, args.concurrency * args.batch_emails)
+        report["batched"]["batcher"] = batcher.stats
+        if server:
+            report["single"]["requests"] = single_requests
+            report["batched"]["requests"] = server.stats["requests"] - single_requests
+    finally:
+        if server:
+            server.shutdown()
+    if report["single"]["emails_per_dollar"] and report["batched"]["emails_per_dollar"]:
+        report["emails_per_dollar_ratio"] = round(report["batched"]["emails_per_dollar"] / report["single"]["emails_per_dollar"], 2)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Benchmark .doc text extraction: the native docreader against Word COM automation (Windows only).
+
+    python benchmarks/bench_doc.py --repeat 200
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_DIR)
+
+from docreader import extract_doc_text  # noqa: E402
+
+SAMPLE_DOC = os.path.join(SRC_DIR, "Input", "Attachments", "file-sample_100kB.doc")
+
+# Previous implementation: a fresh Word.Application per file
+def extract_with_word_com(file_path):
+    import win32com.client
+    word = win32com.client.Dispatch("Word.Application")
+    word.Visible = False
+    doc = word.Documents.Open(os.path.abspath(file_path))
+    text = doc.Content.Text.strip()
+    doc.Close(False)
+    word.Quit()
+    return text
+
+def time_calls(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - start)
+    return result, {"median_ms": round(statistics.median(samples) * 1000, 3), "min_ms": round(min(samples) * 1000, 3),
+                    "max_ms": round(max(samples) * 1000, 3), "files_per_second": round(len(samples) / sum(samples), 1)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--file", default=SAMPLE_DOC)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    with open(args.file, "rb") as f:
+        data = f.read()
+
+    text, native = time_calls(lambda: extract_doc_text(data), args.repeat)
+    report = {"file": os.path.basename(args.file), "bytes": len(data), "chars": len(text), "docreader": native}
+
+    try:
+        import win32com.client  # noqa: F401
+    except ImportError:
+        report["word_com"] = "skipped (win32com not available)"
+    else:
+        com_text, report["word_com"] = time_calls(lambda: extract_with_word_com(args.file), min(args.repeat, 5))
+        report["word_com_chars"] = len(com_text)
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
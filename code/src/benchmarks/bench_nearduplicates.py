@@ -0,0 +1,88 @@
+"""Benchmark MinHash signatures on the sample corpus: the current signature against hashing every joined shingle.
+
+The corpus is also padded to longer emails, where the per-shingle cost dominates.
+
+    python benchmarks/bench_nearduplicates.py --repeat 50
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_DIR)
+
+import nearduplicates  # noqa: E402
+from nearduplicates import NUM_HASHES, SHINGLE_SIZE, minhash_signature, signature_similarity  # noqa: E402
+from emailpipeline import preprocess_email  # noqa: E402
+
+EMAILS_CSV = os.path.join(os.path.dirname(SRC_DIR), "test", "Emails.csv")
+
+# Email lengths (in words) the corpus is repeated up to
+LENGTHS = (100, 1000, 5000)
+
+def load_corpus():
+    with open(EMAILS_CSV, "r", encoding="utf-8-sig", newline="") as f:
+        return [preprocess_email(row["email"]) for row in csv.DictReader(f)]
+
+# Baseline: every shingle of the whole text joined and hashed with blake2b, bin minimums in Python
+def per_shingle_signature(clean_email_text, num_hashes=NUM_HASHES):
+    words = re.sub(r"\d", "0", clean_email_text.lower().replace("*", "")).split()
+    shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+    bins = [None] * num_hashes
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+        index, value = value % num_hashes, value // num_hashes
+        if bins[index] is None or value < bins[index]:
+            bins[index] = value
+    return bins
+
+# Texts of about `length` words: the sample emails one after the other, starting at each of them
+def padded(texts, length):
+    words = [text.split() for text in texts]
+    result = []
+    for first in range(len(texts)):
+        sample = []
+        index = first
+        while len(sample) < length:
+            sample += words[index % len(texts)] or ["-"]
+            index += 1
+        result.append(" ".join(sample[:length]))
+    return result
+
+def time_per_email(func, texts, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            func(text)
+    return round((time.perf_counter() - start) / (len(texts) * repeat) * 1e6, 1)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    texts = load_corpus()
+    numpy = nearduplicates._get_numpy()
+    report = {"emails": len(texts), "numpy": bool(numpy), "max_shingle_tokens": nearduplicates.MAX_SHINGLE_TOKENS, "us_per_email": {}}
+    for length in LENGTHS:
+        sample = padded(texts, length)
+        timings = {"signature": time_per_email(minhash_signature, sample, args.repeat),
+                   "per_shingle": time_per_email(per_shingle_signature, sample, args.repeat)}
+        if numpy:
+            nearduplicates._numpy = False
+            timings["signature_without_numpy"] = time_per_email(minhash_signature, sample, args.repeat)
+            nearduplicates._numpy = numpy
+        report["us_per_email"][f"{length}_words"] = timings
+    # A one-word edit should barely move the estimated similarity
+    edited = [text.replace(" the ", " a ", 1) for text in texts]
+    report["mean_similarity_after_edit"] = round(sum(signature_similarity(minhash_signature(a), minhash_signature(b))
+                                                     for a, b in zip(texts, edited)) / len(texts), 3)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
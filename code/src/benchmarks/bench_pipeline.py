@@ -0,0 +1,258 @@
+"""Benchmark and accuracy harness: replay the labelled code/test corpus through the pipeline against a deterministic mock LLM.
+
+Every email goes through parsing, preprocessing, prompt assembly, the LLM call, reply parsing
+and compute_confidence, each stage timed. The mock server answers each email with its labelled
+classification after a fixed latency, so accuracy measures what the pipeline keeps of a correct
+reply; point --api-base at a real endpoint to measure the model instead. The report is compared
+with a saved JSON baseline and regressions make the exit status 1.
+
+    python benchmarks/bench_pipeline.py --repeat 20 --save-baseline
+    python benchmarks/bench_pipeline.py --repeat 20
+"""
+import argparse
+import ast
+import csv
+import glob
+import json
+import os
+import re
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_DIR)
+
+import emailpipeline  # noqa: E402
+from fakechatserver import FakeChatServer  # noqa: E402
+from promptbudget import DEFAULT_TOKEN_BUDGET, TokenUsage, fit_email_to_budget  # noqa: E402
+from structuredoutput import build_output_schema  # noqa: E402
+
+TEST_DIR = os.path.join(os.path.dirname(SRC_DIR), "test")
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_pipeline.json")
+
+STAGES = ["parse_file", "preprocess", "prompt", "llm", "parse_reply", "confidence"]
+
+# Relative slowdown (and absolute milliseconds, to ignore noise on tiny stages) counted as a regression
+LATENCY_TOLERANCE = 0.25
+LATENCY_NOISE_MS = 1.0
+
+class LabelledEmail:
+    """One corpus email: where its text comes from and its ground-truth labels."""
+
+    def __init__(self, name, labels, text=None, path=None):
+        self.name = name
+        self.labels = labels
+        self.text = text
+        self.path = path
+
+    # The raw email text (the parsing stage: reading the file, or nothing for CSV rows)
+    def read(self):
+        return self.text if self.path is None else emailpipeline.read_email_file(self.path)
+
+def _attributes(value):
+    if isinstance(value, dict):
+        return value
+    try:
+        parsed = ast.literal_eval(value) if value else {}
+    except (ValueError, SyntaxError):
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+# Labelled emails: the rows of Emails.csv and the files described in DataSet details.xlsx
+def load_corpus():
+    corpus = []
+    with open(os.path.join(TEST_DIR, "Emails.csv"), "r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            labels = {"request_type": row["request_type"], "sub_request_type": row["sub_request_type"],
+                      "key_attributes": _attributes(row.get("key_attributes")), "main_intent": row.get("main_intent", "")}
+            corpus.append(LabelledEmail(f"Emails.csv: {row.get('EmailSubject', '')}", labels, text=row["email"]))
+    try:
+        import pandas as pd
+        rows = pd.read_excel(os.path.join(TEST_DIR, "DataSet details.xlsx")).fillna("").to_dict("records")
+    except ImportError as e:
+        print(f"Skipping DataSet details.xlsx: {e}", file=sys.stderr)
+        rows = []
+    for row in rows:
+        files = [path for path in glob.glob(os.path.join(TEST_DIR, f"Email {row.get('S.No')}_*"))
+                 if path.lower().endswith(emailpipeline.SUPPORTED_EXTENSIONS)]
+        if not files:
+            continue
+        labels = {"request_type": row["Request Type"], "sub_request_type": row.get("Sub-Request Type") or row["Request Type"],
+                  "key_attributes": _attributes(row.get("JSON Data")), "main_intent": row.get("Intent", "")}
+        item = LabelledEmail(os.path.basename(files[0]), labels, path=files[0])
+        try:
+            item.read()
+        except Exception as e:  # .msg needs extract_msg
+            print(f"Skipping {item.name}: {e}", file=sys.stderr)
+            continue
+        corpus.append(item)
+    return corpus
+
+class LabelledChatServer(FakeChatServer):
+    """Mock LLM that answers each known email with its labelled classification (Unknown otherwise)."""
+
+    def __init__(self, address, corpus, latency=0.0):
+        super().__init__(address, latency=latency, seed=0)
+        # The email text starts the user message (it may be cut down by the token budget afterwards)
+        self.answers = [(emailpipeline.preprocess_email(item.read())[:200], item.labels) for item in corpus]
+
+    def reply_content(self, request):
+        user_text = next((m.get("content") or "" for m in reversed(request.get("messages", [])) if m.get("role") == "user"), "")
+        labels = next((labels for key, labels in self.answers if user_text.startswith(key)), None)
+        if labels is None:
+            labels = {"request_type": "Unknown", "sub_request_type": "N/A", "key_attributes": {}, "main_intent": ""}
+        reply = dict(labels, key_attributes={name: str(value) for name, value in labels["key_attributes"].items()},
+                     confidence_explanation="Labelled answer from the mock server.")
+        return json.dumps(reply)
+
+# Run one email through every stage; returns (result, {stage: seconds})
+def run_email(item, llm, output_schema, token_budget):
+    timings = {}
+    start = time.perf_counter()
+    email_text = item.read()
+    timings["parse_file"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    clean_email_text = emailpipeline.preprocess_email(email_text)
+    sr_number = emailpipeline.assign_sr_number(clean_email_text)
+    timings["preprocess"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    usage = TokenUsage()
+    prompt_text = fit_email_to_budget(clean_email_text, token_budget, llm, usage) if token_budget else clean_email_text
+    messages = emailpipeline.build_messages(prompt_text, output_schema)
+    timings["prompt"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    response = llm(messages)
+    timings["llm"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    try:
+        response_json = emailpipeline.parse_response(response.content, output_schema)
+    except json.JSONDecodeError as e:
+        timings["parse_reply"] = time.perf_counter() - start
+        return {"error": e.msg}, timings
+    timings["parse_reply"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = emailpipeline.finalize_response(response_json, sr_number)
+    timings["confidence"] = time.perf_counter() - start
+    return result, timings
+
+def _normalize(value):
+    return re.sub(r"[\s,$]|USD", "", str(value)).lower()
+
+# Request type, sub-request type and key-attribute value matches against the labels
+def score(result, labels):
+    key_attributes = result.get("key_attributes")
+    found = {str(name).lower(): value for name, value in key_attributes.items()} if isinstance(key_attributes, dict) else {}
+    expected = labels["key_attributes"]
+    matched = sum(1 for name, value in expected.items()
+                  if name.lower() in found and _normalize(value) in _normalize(found[name.lower()]))
+    return {"error": "error" in result, "request_type": result.get("request_type") == labels["request_type"],
+            "sub_request_type": result.get("sub_request_type") == labels["sub_request_type"],
+            "attributes_expected": len(expected), "attributes_matched": matched}
+
+def percentiles(samples):
+    samples = sorted(samples)
+    def pick(q):
+        return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 3)
+    return {"p50_ms": pick(0.5), "p90_ms": pick(0.9), "p99_ms": pick(0.99), "mean_ms": round(statistics.fmean(samples) * 1000, 3)}
+
+def run_corpus(corpus, llm, output_schema, token_budget, repeat):
+    stage_samples = {stage: [] for stage in STAGES}
+    totals = []
+    scores = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in corpus:
+            result, timings = run_email(item, llm, output_schema, token_budget)
+            for stage, seconds in timings.items():
+                stage_samples[stage].append(seconds)
+            totals.append(sum(timings.values()))
+            scores.append(score(result, item.labels))
+    elapsed = time.perf_counter() - start
+    expected = sum(s["attributes_expected"] for s in scores)
+    return {
+        "emails": len(totals),
+        "errors": sum(s["error"] for s in scores),
+        "throughput_emails_per_second": round(len(totals) / elapsed, 2),
+        "stages": {stage: percentiles(samples) for stage, samples in stage_samples.items() if samples},
+        "total": percentiles(totals),
+        "accuracy": {"request_type": round(sum(s["request_type"] for s in scores) / len(scores), 4),
+                     "sub_request_type": round(sum(s["sub_request_type"] for s in scores) / len(scores), 4),
+                     "key_attributes": round(sum(s["attributes_matched"] for s in scores) / expected, 4) if expected else None},
+    }
+
+# Peak Python heap over one pass (tracemalloc slows the code down, so it gets its own pass)
+def memory_peak(corpus, llm, output_schema, token_budget):
+    tracemalloc.start()
+    run_corpus(corpus, llm, output_schema, token_budget, 1)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"python_peak_mb": round(peak / 2 ** 20, 2),
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+# Differences from the baseline that count as regressions
+def compare(report, baseline):
+    regressions = []
+    for stage, current in list(report["stages"].items()) + [("total", report["total"])]:
+        before = baseline["stages"].get(stage) if stage != "total" else baseline.get("total")
+        if before and current["p50_ms"] > before["p50_ms"] * (1 + LATENCY_TOLERANCE) and current["p50_ms"] - before["p50_ms"] > LATENCY_NOISE_MS:
+            regressions.append(f"{stage} p50 {before['p50_ms']}ms -> {current['p50_ms']}ms")
+    if report["throughput_emails_per_second"] < baseline["throughput_emails_per_second"] * (1 - LATENCY_TOLERANCE):
+        regressions.append(f"throughput {baseline['throughput_emails_per_second']} -> {report['throughput_emails_per_second']} emails/s")
+    for name, value in report["accuracy"].items():
+        before = baseline["accuracy"].get(name)
+        if value is not None and before is not None and value < before:
+            regressions.append(f"{name} accuracy {before} -> {value}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20, help="Passes over the corpus")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mock server seconds per request")
+    parser.add_argument("--api-base", help="Use this OpenAI-compatible endpoint instead of the mock server")
+    parser.add_argument("--token-budget", type=int, default=DEFAULT_TOKEN_BUDGET)
+    parser.add_argument("--no-structured-output", action="store_true", help="Skip output schema validation")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline report to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="Write this report as the new baseline")
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    output_schema = None if args.no_structured_output else build_output_schema(emailpipeline.load_config())
+    server = None
+    if not args.api_base:
+        server = LabelledChatServer(("127.0.0.1", 0), corpus, latency=args.latency)
+        server.start_background()
+    try:
+        llm = emailpipeline.create_llm(api_key=None if args.api_base else "fake", openai_api_base=args.api_base or server.base_url,
+                                       output_schema=output_schema, max_retries=0)
+        report = {"corpus": [item.name for item in corpus], "llm": args.api_base or "mock",
+                  **run_corpus(corpus, llm, output_schema, args.token_budget, args.repeat),
+                  "memory": memory_peak(corpus, llm, output_schema, args.token_budget)}
+    finally:
+        if server:
+            server.shutdown()
+
+    status = 0
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    elif os.path.isfile(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("llm") != report["llm"]:
+            print(f"Baseline was measured against {baseline.get('llm')}, not compared.", file=sys.stderr)
+        else:
+            report["regressions"] = compare(report, baseline)
+            status = 1 if report["regressions"] else 0
+    print(json.dumps(report, indent=2))
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
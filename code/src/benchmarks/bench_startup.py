@@ -0,0 +1,85 @@
+"""Startup benchmark: cold import time of the pipeline modules and first-request latency.
+
+Every measurement runs in a fresh interpreter so nothing is already imported. The
+first request goes to a local fake chat endpoint, so no API key or network is needed.
+
+    python benchmarks/bench_startup.py --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_DIR)
+
+from fakechatserver import FakeChatServer  # noqa: E402
+
+SAMPLE_EMAIL = os.path.join(SRC_DIR, "Input", "Email 1_ Principal Repayment Confirmation.eml")
+
+MODULES = ["ReadEmailContent", "emailpipeline", "batchanalyzer"]
+
+IMPORT_SNIPPET = """
+import json, sys, time
+sys.path.insert(0, {src!r})
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - start}}))
+"""
+
+FIRST_REQUEST_SNIPPET = """
+import json, sys, time
+sys.path.insert(0, {src!r})
+start = time.perf_counter()
+import emailpipeline
+imported = time.perf_counter()
+llm = emailpipeline.create_llm(api_key="fake", openai_api_base={base_url!r}, max_retries=0)
+email_text = emailpipeline.read_email_file({sample!r})
+parsed = time.perf_counter()
+emailpipeline.analyze_email(email_text, llm)
+done = time.perf_counter()
+print(json.dumps({{"import": imported - start, "parse": parsed - imported, "request": done - parsed, "total": done - start}}))
+"""
+
+# Run a snippet in a fresh interpreter and return its JSON output
+def run_fresh(snippet):
+    result = subprocess.run([sys.executable, "-c", snippet], capture_output=True, text=True, cwd=SRC_DIR)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "subprocess failed")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def summarize(samples):
+    return {"median_ms": round(statistics.median(samples) * 1000, 1), "min_ms": round(min(samples) * 1000, 1),
+            "max_ms": round(max(samples) * 1000, 1)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--sample", default=SAMPLE_EMAIL, help="Email used for the first request")
+    args = parser.parse_args()
+
+    report = {"cold_import": {}}
+    for module in MODULES:
+        try:
+            samples = [run_fresh(IMPORT_SNIPPET.format(src=SRC_DIR, module=module))["seconds"] for _ in range(args.repeat)]
+            report["cold_import"][module] = summarize(samples)
+        except RuntimeError as e:
+            report["cold_import"][module] = {"error": str(e)}
+
+    server = FakeChatServer(("127.0.0.1", 0), latency=0.0)
+    server.start_background()
+    try:
+        runs = [run_fresh(FIRST_REQUEST_SNIPPET.format(src=SRC_DIR, base_url=server.base_url, sample=args.sample))
+                for _ in range(args.repeat)]
+        report["first_request"] = {stage: summarize([run[stage] for run in runs]) for stage in runs[0]}
+    except RuntimeError as e:
+        report["first_request"] = {"error": str(e)}
+    finally:
+        server.shutdown()
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Get the directory of the currently running Python script
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Default checkpoint journal database, next to this script
+CHECKPOINT_PATH = os.path.join(script_dir, "batch_checkpoint.sqlite")
+
+class CheckpointJournal:
+    """Durable record of every finished file of a batch run, keyed by the SHA-256 of its content.
+
+    Each result is committed (synchronous, WAL) as soon as it is known, so a run that crashes
+    or is interrupted can be resumed: files with a completed entry are skipped with their
+    recorded result, and files whose entry is a failure are analyzed again. Delete the
+    database to start over.
+    """
+
+    def __init__(self, path=CHECKPOINT_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # A committed entry must survive a power loss, not just a crash of this process
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                file_hash TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                record TEXT NOT NULL,
+                updated REAL NOT NULL
+            )""")
+        self.conn.commit()
+        self.stats = {"resumed": 0, "committed": 0, "failed": 0}
+
+    # The recorded result of a file completed by an earlier run, or None (failures are not returned)
+    def completed(self, file_hash):
+        with self.lock:
+            row = self.conn.execute("SELECT record FROM entries WHERE file_hash = ? AND status = 'done'", (file_hash,)).fetchone()
+            if row is None:
+                return None
+            self.stats["resumed"] += 1
+        return json.loads(row[0])
+
+    # Journal a finished file; records with an "error" are kept as failures to retry on resume
+    def commit(self, file_hash, record):
+        status = "failed" if "error" in record else "done"
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO entries (file_hash, path, status, record, updated) VALUES (?, ?, ?, ?, ?)",
+                              (file_hash, os.path.abspath(record["file"]), status, json.dumps(record), time.time()))
+            self.conn.commit()
+            self.stats["committed" if status == "done" else "failed"] += 1
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,171 @@
+import re
+import struct
+
+# Reads the text of legacy Word 97-2003 (.doc) files in pure Python: a minimal OLE
+# compound file (CFB) reader to get at the WordDocument and table streams, and the
+# piece table (CLX) from the FIB to stitch the text together. No Word installation needed.
+
+CFB_SIGNATURE = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+END_OF_CHAIN = 0xFFFFFFFE
+FREE_SECTOR = 0xFFFFFFFF
+NO_STREAM = 0xFFFFFFFF
+
+# FIB offsets (MS-DOC 2.5)
+FIB_IDENT = 0xA5EC
+FIB_FLAGS_OFFSET = 0x0A
+FIB_CCP_TEXT_OFFSET = 0x4C
+FIB_FC_CLX_OFFSET = 0x01A2
+FLAG_WHICH_TABLE = 0x0200
+FLAG_ENCRYPTED = 0x0100
+
+class DocFormatError(ValueError):
+    pass
+
+class CompoundFile:
+    """Read-only access to the root-level streams of an OLE compound file held in memory."""
+
+    def __init__(self, data):
+        if data[:8] != CFB_SIGNATURE:
+            raise DocFormatError("Not an OLE compound file")
+        self.data = data
+        self.sector_size = 1 << struct.unpack_from("<H", data, 0x1E)[0]
+        self.mini_sector_size = 1 << struct.unpack_from("<H", data, 0x20)[0]
+        (num_fat_sectors, first_dir_sector, _, self.mini_cutoff, first_minifat_sector, num_minifat_sectors,
+         first_difat_sector, num_difat_sectors) = struct.unpack_from("<IIIIIIII", data, 0x2C)
+        self.fat = self._read_fat(num_fat_sectors, first_difat_sector, num_difat_sectors)
+        self.entries = self._read_directory(first_dir_sector)
+        root = self.entries[0]
+        self.mini_stream = self._read_chain(root["start"], root["size"])
+        self.minifat = []
+        if num_minifat_sectors and first_minifat_sector != END_OF_CHAIN:
+            raw = self._read_chain(first_minifat_sector)
+            self.minifat = list(struct.unpack_from(f"<{len(raw) // 4}I", raw))
+        self.streams = self._root_children()
+
+    def _sector(self, index):
+        offset = (index + 1) * self.sector_size
+        return self.data[offset:offset + self.sector_size]
+
+    def _read_fat(self, num_fat_sectors, first_difat_sector, num_difat_sectors):
+        per_sector = self.sector_size // 4
+        difat = list(struct.unpack_from("<109I", self.data, 0x4C))
+        sector = first_difat_sector
+        for _ in range(num_difat_sectors):
+            if sector in (END_OF_CHAIN, FREE_SECTOR):
+                break
+            values = struct.unpack(f"<{per_sector}I", self._sector(sector))
+            difat.extend(values[:-1])
+            sector = values[-1]
+        fat = []
+        for fat_sector in difat[:num_fat_sectors]:
+            fat.extend(struct.unpack(f"<{per_sector}I", self._sector(fat_sector)))
+        return fat
+
+    def _read_chain(self, start, size=None):
+        chunks = []
+        sector = start
+        seen = 0
+        while sector not in (END_OF_CHAIN, FREE_SECTOR) and seen <= len(self.fat):
+            chunks.append(self._sector(sector))
+            sector = self.fat[sector]
+            seen += 1
+        raw = b"".join(chunks)
+        return raw[:size] if size is not None else raw
+
+    def _read_mini_chain(self, start, size):
+        chunks = []
+        sector = start
+        seen = 0
+        while sector not in (END_OF_CHAIN, FREE_SECTOR) and seen <= len(self.minifat):
+            offset = sector * self.mini_sector_size
+            chunks.append(self.mini_stream[offset:offset + self.mini_sector_size])
+            sector = self.minifat[sector]
+            seen += 1
+        return b"".join(chunks)[:size]
+
+    def _read_directory(self, first_dir_sector):
+        raw = self._read_chain(first_dir_sector)
+        entries = []
+        for offset in range(0, len(raw) - 127, 128):
+            name_length, entry_type = struct.unpack_from("<HB", raw, offset + 64)
+            left, right, child = struct.unpack_from("<III", raw, offset + 68)
+            start, size = struct.unpack_from("<IQ", raw, offset + 116)
+            if self.sector_size == 512:
+                size &= 0xFFFFFFFF  # Version 3 files only use the low 32 bits
+            name = raw[offset:offset + max(0, name_length - 2)].decode("utf-16-le", errors="ignore")
+            entries.append({"name": name, "type": entry_type, "left": left, "right": right, "child": child,
+                            "start": start, "size": size})
+        if not entries:
+            raise DocFormatError("Empty compound file directory")
+        return entries
+
+    # Streams directly under the root storage, by name (the red-black tree is walked iteratively)
+    def _root_children(self):
+        streams = {}
+        pending = [self.entries[0]["child"]]
+        while pending:
+            index = pending.pop()
+            if index == NO_STREAM or index >= len(self.entries):
+                continue
+            entry = self.entries[index]
+            if entry["type"] == 2 and entry["name"] not in streams:
+                streams[entry["name"]] = entry
+            pending.extend((entry["left"], entry["right"]))
+        return streams
+
+    def read_stream(self, name):
+        entry = self.streams.get(name)
+        if entry is None:
+            raise DocFormatError(f"Missing stream: {name}")
+        if entry["size"] < self.mini_cutoff:
+            return self._read_mini_chain(entry["start"], entry["size"])
+        return self._read_chain(entry["start"], entry["size"])
+
+# Text pieces (character count, bytes, encoding) listed in the piece table of the CLX
+def _pieces(clx, word_document):
+    pos = 0
+    while pos < len(clx) and clx[pos] == 0x01:  # Skip Prc (formatting) entries
+        pos += 3 + struct.unpack_from("<H", clx, pos + 1)[0]
+    if pos >= len(clx) or clx[pos] != 0x02:
+        raise DocFormatError("Piece table not found")
+    lcb = struct.unpack_from("<I", clx, pos + 1)[0]
+    plc = clx[pos + 5:pos + 5 + lcb]
+    count = (lcb - 4) // 12
+    cps = struct.unpack_from(f"<{count + 1}I", plc, 0)
+    for i in range(count):
+        fc = struct.unpack_from("<I", plc, (count + 1) * 4 + i * 8 + 2)[0]
+        chars = cps[i + 1] - cps[i]
+        if fc & 0x40000000:
+            start = (fc & ~0x40000000) // 2
+            yield cps[i], word_document[start:start + chars].decode("cp1252", errors="ignore")
+        else:
+            yield cps[i], word_document[fc:fc + chars * 2].decode("utf-16-le", errors="ignore")
+
+# Drop field instructions (keep field results) and map Word control characters to plain text
+def _clean_text(text):
+    text = re.sub(r"\x13[^\x13\x14\x15]*\x14", "", text)
+    text = re.sub(r"\x13[^\x13\x14\x15]*\x15", "", text)
+    text = text.replace("\x15", "").replace("\r", "\n").replace("\x0b", "\n").replace("\x0c", "\n").replace("\x07", "\t")
+    text = re.sub(r"[\x00-\x08\x0e-\x1f]", "", text)
+    return re.sub(r"\n{3,}", "\n\n", text)
+
+# Extract the main document text of a Word 97-2003 file from its bytes
+def extract_doc_text(data):
+    data = bytes(data)
+    cfb = CompoundFile(data)
+    word_document = cfb.read_stream("WordDocument")
+    if len(word_document) < FIB_FC_CLX_OFFSET + 8 or struct.unpack_from("<H", word_document, 0)[0] != FIB_IDENT:
+        raise DocFormatError("Not a Word 97-2003 document")
+    flags = struct.unpack_from("<H", word_document, FIB_FLAGS_OFFSET)[0]
+    if flags & FLAG_ENCRYPTED:
+        raise DocFormatError("Encrypted Word documents are not supported")
+    table = cfb.read_stream("1Table" if flags & FLAG_WHICH_TABLE else "0Table")
+    ccp_text = struct.unpack_from("<I", word_document, FIB_CCP_TEXT_OFFSET)[0]
+    fc_clx, lcb_clx = struct.unpack_from("<II", word_document, FIB_FC_CLX_OFFSET)
+
+    text = []
+    for cp, piece in _pieces(table[fc_clx:fc_clx + lcb_clx], word_document):
+        if cp >= ccp_text:
+            break
+        text.append(piece[:ccp_text - cp])
+    return _clean_text("".join(text)).strip()
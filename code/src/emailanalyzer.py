@@ -1,101 +1,96 @@
-import datetime
 import os
-import random
-import re
 import json
-import string
 import streamlit as st
-import uuid  # For SR Number Generation
 import pandas as pd
 import io  # For handling CSV in-memory
 from dotenv import load_dotenv
-from langchain.chat_models import ChatOpenAI
-from langchain.schema import SystemMessage, HumanMessage
-import ReadEmailContent  # External script for processing emails
+from emailpipeline import load_config, create_backend, backend_model_name, backend_token_budget, read_email_file, read_email_headers, SUPPORTED_EXTENSIONS, analyze_email, result_to_row
+from resultcache import ResultCache
+from ingestmanifest import IngestManifest
+from threadindex import ThreadIndex
+from srregistry import SRRegistry
+from localclassifier import LocalClassifier, MODEL_PATH
+from attributeextractor import KeyAttributeExtractor
+from structuredoutput import build_output_schema
 
 # Load API Key from .env file
 load_dotenv()
 api_key = os.getenv("OPENAI_API_KEY")
 
-# Load Configuration File
-with open("config.json", "r") as config_file:
-    config = json.load(config_file)
-
-# Extract predefined request types and key attributes
-request_type_options = config["request_types"]
-key_attributes_options = config["key_attributes"]
-
-# Initialize LangChain Chat Model
-llm = ChatOpenAI(model="gpt-4o-mini", openai_api_key=api_key, temperature=0.3)
+# Load Configuration File (on first use, then shared across Streamlit reruns)
+@st.cache_resource
+def get_config():
+    return load_config()
+
+# Output schema limited to the config.json request types
+@st.cache_resource
+def get_output_schema():
+    return build_output_schema(get_config())
+
+# Initialize the chat backend selected in config.json (on the first analysis, not on every page load)
+@st.cache_resource
+def get_llm():
+    return create_backend(get_config(), api_key=api_key, output_schema=get_output_schema())
+
+# Persistent result cache shared across Streamlit reruns
+@st.cache_resource
+def get_result_cache():
+    return ResultCache()
+
+# Manifest of already parsed input files, shared across Streamlit reruns
+@st.cache_resource
+def get_manifest():
+    return IngestManifest()
+
+# Thread deduplication index shared across Streamlit reruns
+@st.cache_resource
+def get_thread_index():
+    return ThreadIndex()
+
+# SR registry shared across Streamlit reruns (and with batch runs using the same database)
+@st.cache_resource
+def get_sr_registry():
+    return SRRegistry()
+
+# Local pre-classifier, when a model has been trained (python localclassifier.py)
+@st.cache_resource
+def get_pre_classifier():
+    return LocalClassifier.load(config=get_config()) if os.path.exists(MODEL_PATH) else None
+
+# Regex key-attribute rules for the attributes listed in config.json
+@st.cache_resource
+def get_attribute_extractor():
+    return KeyAttributeExtractor.from_config(get_config())
 
 # Set Streamlit page config
 st.set_page_config(page_title="📩 Email Analyzer", layout="wide")
 
-# Email Preprocessing Function
-def preprocess_email(email_text):
-    email_text = re.sub(r"\n{2,}", "\n", email_text.strip())  
-    email_text = re.sub(r"\s{2,}", " ", email_text)  
-    return email_text
-
-# Function to check if an existing SR number is in the email
-def check_existing_sr_number(email_text):
-    sr_match = re.search(r"\bSR-\d{8}-\d{4}-[A-Z0-9]{6}\b", email_text, re.IGNORECASE)  
-    return sr_match.group(0) if sr_match else None
-
-# Generate SR Number
-def generate_sr_number():
-    date_part = datetime.datetime.now().strftime("%d%m%Y-%H%M")
-    random_part = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-    return f"SR-{date_part}-{random_part}"
-
-# Improved Confidence Score Calculation
-def compute_confidence(response_json):
-    W_Lexical = 0.25
-    W_Attributes = 0.30
-    W_Intent = 0.20
-    W_Ambiguity = 0.25
-
-    lexical_score = 1.0 if response_json["request_type"] != "Unknown" else 0.5
-    key_attr_score = min(1.0, len(response_json.get("key_attributes", [])) / 5)
-    intent_score = 1.0 if response_json["main_intent"] else 0.6
-    ambiguous_terms = ["maybe", "not sure", "possibly", "check", "update something"]
-    ambiguity_penalty = 0.1 if any(term in response_json["main_intent"].lower() for term in ambiguous_terms) else 0.0
-
-    confidence = (W_Lexical * lexical_score) + (W_Attributes * key_attr_score) + (W_Intent * intent_score) - (W_Ambiguity * ambiguity_penalty)
-    return round(max(0.5, min(1.0, confidence)), 2)  # Ensure a reasonable minimum score
-
 # Analyze Email Function
-def AnalyzeEmail(email_text):
+def AnalyzeEmail(email_text, source_file=None):
     if email_text.strip():  
-        with st.spinner("Preprocessing email..."):
-            clean_email_text = preprocess_email(email_text)
-
-        existing_sr_number = check_existing_sr_number(clean_email_text)
-        sr_number = f"Duplicate/Follow-up - {existing_sr_number}" if existing_sr_number else generate_sr_number()
-
-        final_prompt = f"""
-        You are an AI email analyzer for a commercial bank lending service team. Categorize the email and extract key details.
-        Return a **valid JSON** with:
-        - `request_type`
-        - `sub_request_type`
-        - `key_attributes`
-        - `main_intent`
-        - `confidence_score`
-        - `confidence_explanation`
-        {clean_email_text}
-        """
-
-        response = llm([SystemMessage(content=final_prompt), HumanMessage(content="Analyze this email.")])
-        try:
-            response_text = response.content.strip()
-            json_match = re.search(r"```json\n(.*?)\n```", response_text, re.DOTALL)
-            if json_match:
-                response_text = json_match.group(1)
-            response_json = json.loads(response_text)
+        thread_headers = read_email_headers(source_file) if source_file else None
 
-            # Compute confidence score
-            response_json["confidence_score"] = compute_confidence(response_json)
-            response_json["sr_number"] = sr_number
+        # Routing fields are shown as soon as they stream in, before the rest of the reply
+        routing_placeholder = st.empty()
+        streamed_fields = {}
+
+        def on_field(name, value):
+            if name in ("request_type", "sub_request_type"):
+                streamed_fields[name] = value
+                routing_placeholder.info(" / ".join(f"**{streamed_fields[key]}**" for key in ("request_type", "sub_request_type")
+                                                    if key in streamed_fields))
+
+        try:
+            with st.spinner("Analyzing email..."):
+                response_json = analyze_email(email_text, get_llm(), get_result_cache(), backend_model_name(get_llm()), get_llm().temperature,
+                                              backend_token_budget(get_llm(), output_schema=get_output_schema()),
+                                              thread_index=get_thread_index(), thread_headers=thread_headers,
+                                              pre_classifier=get_pre_classifier(), attribute_extractor=get_attribute_extractor(),
+                                              output_schema=get_output_schema(), on_field=on_field, sr_registry=get_sr_registry())
+            sr_number = response_json["sr_number"]
+            if response_json.get("streaming", {}).get("first_field") is not None:
+                st.caption(f"⏱️ First field after {response_json['streaming']['first_field']}s, "
+                           f"full reply after {response_json['streaming']['total']}s")
 
             # Display results
             st.subheader("📜 Final Output (Response)")
@@ -108,15 +103,7 @@ def AnalyzeEmail(email_text):
             st.write(f"**{response_json['sr_number']}**")
 
             # Convert JSON to DataFrame for CSV export
-            df = pd.DataFrame([{
-                "SR Number": response_json["sr_number"],
-                "Request Type": response_json.get("request_type", ""),
-                "Sub Request Type": response_json.get("sub_request_type", ""),
-                "Key Attributes": ", ".join(response_json.get("key_attributes", [])),
-                "Main Intent": response_json.get("main_intent", ""),
-                "Confidence Score": response_json["confidence_score"],
-                "Confidence Explanation": response_json.get("confidence_explanation", ""),
-            }])
+            df = pd.DataFrame([result_to_row(response_json)])
 
             # Convert DataFrame to CSV format
             csv_buffer = io.StringIO()
@@ -127,9 +114,16 @@ def AnalyzeEmail(email_text):
             st.download_button(label="📥 Download JSON", data=json.dumps(response_json, indent=4), file_name=f"email_analysis_{sr_number}.json", mime="application/json")
             st.download_button(label="📥 Download CSV", data=csv_data, file_name=f"email_analysis_{sr_number}.csv", mime="text/csv")
 
-        except json.JSONDecodeError:
-            st.error("Error parsing AI response. AI did not return valid JSON.")
-            st.text(f"Raw AI Response: {response_text}")
+            # The stored file is handled: move it out of the input folder
+            if source_file:
+                processed_path = get_manifest().move_to_processed(source_file)
+                st.info(f"📦 Moved `{os.path.basename(source_file)}` to `{os.path.dirname(processed_path)}`")
+
+        except json.JSONDecodeError as e:
+            st.error(f"Error parsing AI response. {e.msg}")
+            if getattr(e, "repairs", 0):
+                st.caption(f"Still invalid after {e.repairs} repair attempt(s).")
+            st.text(f"Raw AI Response: {e.doc}")
 
 # Create input folder if not exists
 INPUT_FOLDER = "input"
@@ -156,28 +150,26 @@ if uploaded_files:
 
     st.success(f"✅ {len(uploaded_files)} file(s) saved in '{INPUT_FOLDER}' folder.")
 
-# Loop through files
+# Parse only new or changed files; unchanged ones come from the manifest
 st.subheader("📂 Processing Stored Files")
-for file_name in os.listdir(INPUT_FOLDER):
-    file_path = os.path.join(INPUT_FOLDER, file_name)
-    file_extension = file_name.split(".")[-1].lower()
-
-    st.write(f"🔍 Processing: `{file_name}`")
-
+manifest = get_manifest()
+for file_path in manifest.scan(INPUT_FOLDER):
+    file_name = os.path.basename(file_path)
     try:
-        if file_extension == "txt":
-            with open(file_path, "r", encoding="utf-8") as f:
-                email_text = f.read()
-        elif file_extension in ["eml", "msg"]:
-            email_text = ReadEmailContent.extract_email_content(file_path)  
+        if file_name.lower().endswith(SUPPORTED_EXTENSIONS):
+            manifest.record(file_path, read_email_file(file_path))
         else:
-            email_text = "⚠️ Unsupported file format. Please use TXT, EML, or MSG."
-
-        st.text_area(f"📄 Content of `{file_name}`", email_text, height=200)
-
+            manifest.record(file_path, "⚠️ Unsupported file format. Please use TXT, EML, or MSG.")
     except Exception as e:
         st.error(f"❌ Error processing `{file_name}`: {str(e)}")
 
+email_file = None
+for file_path, status, stored_text in manifest.entries(INPUT_FOLDER):
+    file_name = os.path.basename(file_path)
+    st.write(f"🔍 Processing: `{file_name}`")
+    email_text, email_file = stored_text, file_path
+    st.text_area(f"📄 Content of `{file_name}`", email_text, height=200)
+
 # Run analysis when button is clicked
 if st.button("Analyze Email"):
-    AnalyzeEmail(email_text)
+    AnalyzeEmail(email_text, email_file)
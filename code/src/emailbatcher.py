@@ -0,0 +1,181 @@
+import json
+import re
+import threading
+from emailpipeline import prompt_assembler
+from llmbackends import BackendMessage
+from promptbudget import count_tokens, response_token_usage, response_cached_tokens
+from structuredoutput import coerce_result, validate_result
+
+# Emails packed into one request, prompt tokens their texts may use together, and the size
+# above which an email is sent on its own
+DEFAULT_BATCH_EMAILS = 8
+DEFAULT_BATCH_TOKENS = 6000
+DEFAULT_SHORT_EMAIL_TOKENS = 800
+
+# Seconds a waiting email gives others to join its batch before the batch is sent as is
+DEFAULT_MAX_WAIT = 0.2
+
+BATCH_INSTRUCTIONS = """
+The user message contains several emails, each starting with a line `### Email <id>`. Analyze each one on its own.
+Return only a JSON object {"results": [...]} with one entry per email, in order; each entry has the email's numeric `id` and the fields above.
+"""
+
+EMAIL_HEADER = "### Email {}\n"
+
+_decoder = json.JSONDecoder()
+
+class _PendingEmail:
+    def __init__(self, messages, tokens):
+        self.messages = messages
+        self.tokens = tokens
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+class EmailBatcher:
+    """Packs concurrent classification calls for short emails into one request, sized by a token budget.
+
+    Wraps a chat model and is called like one, so it sits under the LLMDispatcher: each
+    dispatcher thread blocks in `__call__` until its email's batch is answered. The batch
+    prompt repeats the single-email prefix and numbers the emails; the returned array is
+    demultiplexed by id, each entry is validated against the output schema, and an email
+    whose entry is missing or invalid falls back to an individual call. Calls that are not
+    classifications of a short email (summaries, repairs, long emails) pass straight through.
+    """
+
+    def __init__(self, llm, output_schema=None, max_emails=DEFAULT_BATCH_EMAILS, batch_tokens=DEFAULT_BATCH_TOKENS,
+                 max_email_tokens=DEFAULT_SHORT_EMAIL_TOKENS, max_wait=DEFAULT_MAX_WAIT):
+        self.llm = llm
+        self.output_schema = output_schema
+        self.prefix = prompt_assembler(output_schema).prefix
+        self.batch_prefix = self.prefix + BATCH_INSTRUCTIONS
+        self.batch_prefix_tokens = count_tokens(self.batch_prefix)
+        self.max_emails = max_emails
+        self.batch_tokens = batch_tokens
+        self.max_email_tokens = max_email_tokens
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.pending = []
+        self.pending_tokens = 0
+        self.stats = {"batches": 0, "batched_emails": 0, "fallbacks": 0, "unbatched": 0}
+
+    def _count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def __call__(self, messages):
+        tokens = self._batchable_tokens(messages)
+        if tokens is None:
+            self._count("unbatched")
+            return self.llm(messages)
+        item = _PendingEmail(messages, tokens)
+        ready = []
+        with self.lock:
+            if self.pending and self.pending_tokens + tokens > self.batch_tokens:
+                ready.append(self._take())
+            self.pending.append(item)
+            self.pending_tokens += tokens
+            if len(self.pending) >= self.max_emails:
+                ready.append(self._take())
+        for batch in ready:
+            self._send(batch)
+        if not item.done.wait(self.max_wait):
+            with self.lock:
+                batch = self._take() if item in self.pending else None
+            if batch:
+                self._send(batch)
+            item.done.wait()
+        if item.error is not None:
+            raise item.error
+        if item.response is None:
+            self._count("fallbacks")
+            return self.llm(messages)
+        return item.response
+
+    # The reply is demultiplexed from a whole batch, so it is streamed as one chunk
+    def stream(self, messages):
+        yield self(messages)
+
+    # Email tokens of a single-email classification call, or None for any other call
+    def _batchable_tokens(self, messages):
+        if len(messages) != 2 or messages[0].content != self.prefix:
+            return None
+        tokens = count_tokens(messages[1].content)
+        return tokens if tokens <= self.max_email_tokens else None
+
+    def _take(self):
+        batch = self.pending
+        self.pending = []
+        self.pending_tokens = 0
+        return batch
+
+    def _send(self, batch):
+        if len(batch) == 1:  # Nobody joined: a plain call costs less than the batch prompt
+            item = batch[0]
+            try:
+                item.response = self.llm(item.messages)
+            except Exception as e:
+                item.error = e
+            self._count("unbatched")
+            item.done.set()
+            return
+        from langchain.schema import SystemMessage, HumanMessage
+        messages = [SystemMessage(content=self.batch_prefix),
+                    HumanMessage(content="\n".join(EMAIL_HEADER.format(index) + item.messages[1].content
+                                                   for index, item in enumerate(batch, 1)))]
+        try:
+            response = self.llm(messages)
+            self._demultiplex(batch, messages, response)
+            self._count("batches")
+            self._count("batched_emails", len(batch))
+        except Exception as e:
+            for item in batch:
+                item.error = e
+        finally:
+            for item in batch:
+                item.done.set()
+
+    # Hand each email its own entry of the batch reply, with its share of the tokens
+    def _demultiplex(self, batch, messages, response):
+        entries = {}
+        for entry in _reply_entries(response.content):
+            if isinstance(entry, dict) and isinstance(entry.get("id"), (int, str)) and str(entry["id"]).isdigit():
+                entries.setdefault(int(entry["id"]), entry)
+        prompt_tokens, completion_tokens = response_token_usage(response)
+        if prompt_tokens is None:
+            prompt_tokens = sum(count_tokens(message.content) for message in messages)
+            completion_tokens = count_tokens(response.content)
+        cached_tokens = response_cached_tokens(response)
+        email_tokens = sum(item.tokens for item in batch) or 1
+        texts = {}
+        for index, item in enumerate(batch, 1):
+            result = {name: value for name, value in entries.get(index, {}).items() if name != "id"}
+            if result and self._valid(result):
+                texts[index] = json.dumps(result)
+        reply_chars = sum(len(text) for text in texts.values()) or 1
+        for index, item in enumerate(batch, 1):
+            if index not in texts:
+                continue
+            item_prompt = round(self.batch_prefix_tokens / len(batch) + (prompt_tokens - self.batch_prefix_tokens) * item.tokens / email_tokens)
+            item_completion = round(completion_tokens * len(texts[index]) / reply_chars)
+            item.response = BackendMessage(texts[index], {
+                "input_tokens": item_prompt, "output_tokens": item_completion, "total_tokens": item_prompt + item_completion,
+                "input_token_details": {"cache_read": round(cached_tokens / len(batch))}})
+
+    def _valid(self, result):
+        if self.output_schema is None:
+            return "request_type" in result
+        return not validate_result(coerce_result(dict(result), self.output_schema), self.output_schema)
+
+# Entries of a batch reply: the "results" array of the object, or a bare array
+def _reply_entries(text):
+    match = re.search(r"[\[{]", text)
+    if match is None:
+        return []
+    try:
+        value = _decoder.raw_decode(text, match.start())[0]
+    except json.JSONDecodeError:
+        return []
+    if isinstance(value, dict):
+        value = value.get("results", [])
+    return value if isinstance(value, list) else []
@@ -0,0 +1,410 @@
+import datetime
+import os
+import random
+import re
+import json
+import string
+import time
+import instrumentation
+from resultcache import cache_key
+from srregistry import content_hash
+from utilities.Utilities import split_thread_segments
+from attributeextractor import merge_key_attributes
+from structuredoutput import DEFAULT_MAX_REPAIRS, IncrementalJSONParser, response_format, schema_fingerprint, parse_structured_response, parse_with_repair
+from promptbudget import DEFAULT_TOKEN_BUDGET, TokenUsage, count_tokens, fit_email_to_budget, split_email_sections, join_email_sections
+
+# LangChain and the email parsers are imported on first use to keep startup fast
+
+# Get the directory of the currently running Python script
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Default configuration file, next to this script
+CONFIG_PATH = os.path.join(script_dir, "config.json")
+
+# Model settings shared by the Streamlit app and the batch engine
+MODEL_NAME = "gpt-4o-mini"
+TEMPERATURE = 0.3
+
+# Bump whenever the prompt changes so cached results from the old prompt are not reused
+PROMPT_VERSION = "2"
+
+# Fields that route an email, reported as soon as both have streamed in
+ROUTING_FIELDS = ("request_type", "sub_request_type")
+
+# File types the pipeline can read as a whole email
+SUPPORTED_EXTENSIONS = (".txt", ".eml", ".msg")
+
+# Load Configuration File
+def load_config(config_path=CONFIG_PATH):
+    with open(config_path, "r") as config_file:
+        return json.load(config_file)
+
+# Initialize LangChain Chat Model (with an output schema, the API is asked for JSON following it)
+def create_llm(api_key=None, model=MODEL_NAME, temperature=TEMPERATURE, output_schema=None, **kwargs):
+    from langchain.chat_models import ChatOpenAI
+    if output_schema is not None:
+        kwargs["model_kwargs"] = dict(kwargs.get("model_kwargs") or {}, response_format=response_format(output_schema))
+    return ChatOpenAI(model=model, openai_api_key=api_key or os.getenv("OPENAI_API_KEY"), temperature=temperature, **kwargs)
+
+# Initialize the chat backend selected in the "llm" section of config.json ("openai" or "llamacpp");
+# backend names the one to use instead, and options override its config.json settings
+def create_backend(config, backend=None, api_key=None, output_schema=None, **options):
+    settings = config.get("llm", {})
+    backend = backend or settings.get("backend", "openai")
+    options = dict(settings.get(backend, {}), **options)
+    if backend == "openai":
+        return create_llm(api_key, output_schema=output_schema, **options)
+    if backend == "llamacpp":
+        from llmbackends import LlamaCppBackend
+        if "model_path" in options:  # Relative to this folder, like config.json
+            options["model_path"] = os.path.join(script_dir, options["model_path"])
+        return LlamaCppBackend(output_schema=output_schema, **options)
+    raise ValueError(f"Unknown LLM backend: {backend}")
+
+# Model name a backend's results are cached under
+def backend_model_name(llm):
+    return getattr(llm, "model_name", None) or MODEL_NAME
+
+# Share of a context window the token estimate may fill: count_tokens uses the OpenAI tokenizer,
+# which splits the same text into fewer tokens than llama's
+CONTEXT_TOKEN_SHARE = 0.8
+
+# Prompt tokens the email may use with this backend: token_budget (None or 0: no limit), capped for
+# backends with a context size (n_ctx) to what the prompt prefix and the reply leave of it
+def backend_token_budget(llm, token_budget=DEFAULT_TOKEN_BUDGET, output_schema=None):
+    n_ctx = getattr(llm, "n_ctx", None)
+    if not n_ctx:
+        return token_budget or None
+    available = int(n_ctx * CONTEXT_TOKEN_SHARE) - prompt_assembler(output_schema).prefix_tokens - getattr(llm, "max_tokens", 0)
+    available = max(1, available)
+    return min(token_budget, available) if token_budget else available
+
+# Email Preprocessing Function
+def preprocess_email(email_text):
+    email_text = re.sub(r"\n{2,}", "\n", email_text.strip())
+    email_text = re.sub(r"\s{2,}", " ", email_text)
+    return email_text
+
+# Function to check if an existing SR number is in the email
+def check_existing_sr_number(email_text):
+    sr_match = re.search(r"\bSR-\d{8}-\d{4}-[A-Z0-9]{6}\b", email_text, re.IGNORECASE)
+    return sr_match.group(0) if sr_match else None
+
+# Generate SR Number
+def generate_sr_number():
+    date_part = datetime.datetime.now().strftime("%d%m%Y-%H%M")
+    random_part = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+    return f"SR-{date_part}-{random_part}"
+
+# Allocate a new SR number: from the registry when given (unique across workers and processes), else random
+def new_sr_number(sr_registry=None):
+    return sr_registry.allocate() if sr_registry is not None else generate_sr_number()
+
+# Pick the SR number for an email: reuse the referenced one or allocate a new one
+def assign_sr_number(clean_email_text, sr_registry=None):
+    existing_sr_number = check_existing_sr_number(clean_email_text)
+    return f"Duplicate/Follow-up - {existing_sr_number}" if existing_sr_number else new_sr_number(sr_registry)
+
+# Improved Confidence Score Calculation
+def compute_confidence(response_json):
+    W_Lexical = 0.25
+    W_Attributes = 0.30
+    W_Intent = 0.20
+    W_Ambiguity = 0.25
+
+    lexical_score = 1.0 if response_json["request_type"] != "Unknown" else 0.5
+    # Attributes only the regex rules found say nothing about how well the model understood the email
+    model_attributes = len(response_json.get("key_attributes", [])) - len(response_json.get("extracted_attributes", []))
+    key_attr_score = min(1.0, max(0, model_attributes) / 5)
+    intent_score = 1.0 if response_json["main_intent"] else 0.6
+    ambiguous_terms = ["maybe", "not sure", "possibly", "check", "update something"]
+    ambiguity_penalty = 0.1 if any(term in response_json["main_intent"].lower() for term in ambiguous_terms) else 0.0
+
+    confidence = (W_Lexical * lexical_score) + (W_Attributes * key_attr_score) + (W_Intent * intent_score) - (W_Ambiguity * ambiguity_penalty)
+    return round(max(0.5, min(1.0, confidence)), 2)  # Ensure a reasonable minimum score
+
+# Instructions that open every prompt
+PROMPT_INSTRUCTIONS = "You are an AI email analyzer for a commercial bank lending service team. Categorize the email in the user message and extract key details.\n"
+
+# System prompt shared by every email: the instructions and, with an output schema, the allowed
+# request types from config.json. Nothing email-specific goes in, so it is the same bytes on every call.
+def build_prompt_prefix(output_schema=None):
+    if output_schema is None:
+        return PROMPT_INSTRUCTIONS + """Return a **valid JSON** with:
+- `request_type`
+- `sub_request_type`
+- `key_attributes`
+- `main_intent`
+- `confidence_score`
+- `confidence_explanation`
+"""
+    properties = output_schema["properties"]
+    return PROMPT_INSTRUCTIONS + f"""Return only a JSON object with:
+- `request_type`: one of {json.dumps(properties["request_type"]["enum"])}
+- `sub_request_type`: one of {json.dumps(properties["sub_request_type"]["enum"])}
+- `key_attributes`: an object mapping attribute names to string values
+- `main_intent`
+- `confidence_explanation`
+"""
+
+class PromptAssembler:
+    """Chat messages for an email: the byte-stable system prefix first, the email last.
+
+    OpenAI and llama.cpp reuse a prompt's leading tokens from earlier requests, so keeping the
+    email after a prefix built once lets every request but the first hit that cache.
+    """
+
+    def __init__(self, output_schema=None):
+        self.prefix = build_prompt_prefix(output_schema)
+        self.prefix_tokens = count_tokens(self.prefix)
+
+    def messages(self, clean_email_text):
+        from langchain.schema import SystemMessage, HumanMessage
+        return [SystemMessage(content=self.prefix), HumanMessage(content=clean_email_text)]
+
+_assemblers = {}
+
+# Prompt assembler for an output schema, built on first use
+def prompt_assembler(output_schema=None):
+    key = None if output_schema is None else schema_fingerprint(output_schema)
+    if key not in _assemblers:
+        _assemblers[key] = PromptAssembler(output_schema)
+    return _assemblers[key]
+
+# Build the chat messages sent to the model
+def build_messages(clean_email_text, output_schema=None):
+    return prompt_assembler(output_schema).messages(clean_email_text)
+
+# Parse the model reply, skipping any prose or ```json fence around the object (raises json.JSONDecodeError)
+def parse_response(response_text, output_schema=None):
+    return parse_structured_response(response_text, output_schema)
+
+# Finish a parsed model reply with the confidence score and SR number
+def finalize_response(response_json, sr_number):
+    response_json["confidence_score"] = compute_confidence(response_json)
+    response_json["sr_number"] = sr_number
+    return response_json
+
+# Stream the model reply, passing each top-level field to on_field(name, value) as soon as it is
+# complete. Returns the whole response and its timings in seconds since the request was sent.
+def stream_response(llm, messages, on_field):
+    start = time.perf_counter()
+    timing = {"first_token": None, "first_field": None, "routing_fields": None, "total": None}
+    parser = IncrementalJSONParser()
+    chunks = llm.stream(messages) if hasattr(llm, "stream") else [llm(messages)]
+    response = None
+    for chunk in chunks:
+        response = chunk if response is None else response + chunk
+        elapsed = round(time.perf_counter() - start, 3)
+        if timing["first_token"] is None:
+            timing["first_token"] = elapsed
+        if parser is None:
+            continue
+        try:
+            fields = parser.feed(chunk.content)
+        except json.JSONDecodeError:
+            parser = None  # Broken reply: it goes through the repair path once complete
+            continue
+        for name, value in fields:
+            if timing["first_field"] is None:
+                timing["first_field"] = elapsed
+            on_field(name, value)
+        if timing["routing_fields"] is None and all(name in parser.fields for name in ROUTING_FIELDS):
+            timing["routing_fields"] = elapsed
+    timing["total"] = round(time.perf_counter() - start, 3)
+    if response is None:
+        from langchain.schema import AIMessage
+        response = AIMessage(content="")
+    return response, timing
+
+# Ask the model about a preprocessed email, going through the result cache when one is given.
+# The email is first fitted into token_budget prompt tokens (None disables budgeting); the
+# returned dict carries the tokens spent on it under "token_usage". With an output schema,
+# the reply is validated against it and an invalid reply gets up to max_repairs repair calls.
+# With on_field, the reply is streamed and each field is passed to on_field(name, value) as soon
+# as it is complete; the timings go under "streaming".
+def classify_email(clean_email_text, llm, cache=None, model=MODEL_NAME, temperature=TEMPERATURE, token_budget=DEFAULT_TOKEN_BUDGET,
+                   output_schema=None, max_repairs=DEFAULT_MAX_REPAIRS, on_field=None):
+    usage = TokenUsage()
+    prompt_version = f"{PROMPT_VERSION}/budget={token_budget}"
+    if output_schema is not None:
+        prompt_version += f"/schema={schema_fingerprint(output_schema)}"
+    key = cache_key(clean_email_text, prompt_version, model, temperature) if cache is not None else None
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            usage.cached = True
+            if on_field:
+                for name, value in cached.items():
+                    on_field(name, value)
+            return dict(cached, token_usage=usage.to_dict())
+    with instrumentation.span("prompt"):
+        prompt_text = clean_email_text
+        if token_budget:
+            prompt_text = fit_email_to_budget(clean_email_text, token_budget, llm, usage)
+        assembler = prompt_assembler(output_schema)
+        messages = assembler.messages(prompt_text)
+        usage.prompt_prefix_tokens = assembler.prefix_tokens
+    timing = None
+    with instrumentation.span("llm", streamed=bool(on_field)):
+        if on_field:
+            response, timing = stream_response(llm, messages, on_field)
+        else:
+            response = llm(messages)
+    usage.add(messages, response)
+    with instrumentation.span("parse_reply"):
+        response_json, _ = parse_with_repair(response.content, llm, usage, output_schema, max_repairs)
+    if cache is not None:
+        cache.put(key, response_json)
+    response_json = dict(response_json, token_usage=usage.to_dict())
+    if timing:
+        response_json["streaming"] = timing
+    return response_json
+
+# Analysis result produced without calling the model (reused from an index or classified locally)
+def local_result(result):
+    usage = TokenUsage()
+    usage.cached = True
+    return dict(result, token_usage=usage.to_dict())
+
+# Classify with the local pre-classifier when it is confident and its answer is valid, otherwise escalate to the LLM.
+# With an attribute extractor, the rule-based key attributes fill in and check the answer.
+# local_prediction is the pre-classifier's prediction for this text when it was scored in a batch.
+def classify_locally_or_with_llm(clean_email_text, llm, cache=None, model=MODEL_NAME, temperature=TEMPERATURE,
+                                 token_budget=DEFAULT_TOKEN_BUDGET, pre_classifier=None, attribute_extractor=None, output_schema=None,
+                                 on_field=None, local_prediction=None):
+    response_json = None
+    if pre_classifier is not None:
+        prediction = local_prediction or pre_classifier.classify(clean_email_text, output_schema)
+        if prediction.confident:
+            response_json = dict(local_result(prediction.to_result()), local_classifier={"probability": prediction.probability})
+    if response_json is None:
+        response_json = classify_email(clean_email_text, llm, cache, model, temperature, token_budget, output_schema,
+                                       on_field=on_field)
+    if attribute_extractor is not None:
+        merge_key_attributes(response_json, attribute_extractor.extract(clean_email_text))
+    return response_json
+
+# Run the full pipeline on one email: preprocess, SR lookup, prompt, LLM, parse, confidence.
+# With a thread index, an email whose messages were all classified before reuses that result,
+# and a reply to a known thread is classified on its new messages only and linked to the thread's SR.
+# With a near-duplicate index, an email close enough to an earlier one reuses its result and SR.
+# With a local pre-classifier, the LLM is only called when the local model is not confident
+# (local_prediction: its prediction for the preprocessed email, when emails are scored in batches).
+# With an attribute extractor, key attributes found by the regex rules are merged into the result.
+# With on_field, the LLM reply is streamed and fields are reported as they complete (see classify_email).
+# With an SR registry, new SR numbers come from it, an exact resubmission is filed under its earlier SR
+# (its result comes from the versioned result cache, not the registry), and a follow-up to a registered SR
+# carries that SR's original classification.
+def analyze_email(email_text, llm, cache=None, model=MODEL_NAME, temperature=TEMPERATURE, token_budget=DEFAULT_TOKEN_BUDGET,
+                  thread_index=None, thread_headers=None, near_duplicates=None, pre_classifier=None, attribute_extractor=None,
+                  output_schema=None, on_field=None, sr_registry=None, local_prediction=None):
+    with instrumentation.span("preprocess"):
+        clean_email_text = preprocess_email(email_text)
+    email_hash = None
+    resubmitted_sr_number = None
+    if sr_registry is not None:
+        email_hash = content_hash(clean_email_text)
+        known = sr_registry.find_by_content(email_hash)
+        resubmitted_sr_number = known.sr_number if known is not None else None
+    if thread_index is None and near_duplicates is None:
+        existing_sr_number = check_existing_sr_number(clean_email_text) or resubmitted_sr_number
+        response_json = classify_locally_or_with_llm(clean_email_text, llm, cache, model, temperature, token_budget,
+                                                     pre_classifier, attribute_extractor, output_schema, on_field, local_prediction)
+        return file_result(response_json, existing_sr_number or new_sr_number(sr_registry), bool(existing_sr_number),
+                           sr_registry, email_hash)
+
+    header, body, attachments = split_email_sections(clean_email_text)
+    thread_match = thread_index.match(body, thread_headers, attachments) if thread_index else None
+    if thread_match and thread_match.fully_known:
+        response_json = local_result(thread_match.result)
+        response_json["thread"] = {"thread_id": thread_match.thread_id, "new_segments": 0, "total_segments": thread_match.total_segments}
+        return file_result(response_json, thread_match.sr_number, True, sr_registry, email_hash)
+
+    existing_sr_number = check_existing_sr_number(clean_email_text) or resubmitted_sr_number
+    near_match = near_duplicates.match(clean_email_text) if near_duplicates and not thread_match else None
+    if thread_match:
+        base_sr_number = thread_match.sr_number
+        prompt_text = join_email_sections(header, "\n".join(thread_match.new_segments), attachments)
+    else:
+        # A new SR is only allocated once the email is classified, so failures leave no empty SRs behind
+        base_sr_number = existing_sr_number or (near_match.sr_number if near_match else None)
+        prompt_text = clean_email_text
+
+    if near_match:
+        response_json = local_result(near_match.result)
+        response_json["near_duplicate"] = {"sr_number": near_match.sr_number, "similarity": near_match.similarity}
+        if attribute_extractor is not None:
+            # The reused attributes belong to the earlier email; this email's own values take precedence
+            merge_key_attributes(response_json, attribute_extractor.extract(clean_email_text), prefer_extracted=True)
+    else:
+        # A reply to a known thread is classified on its new messages, not the text the batch scored
+        response_json = classify_locally_or_with_llm(prompt_text, llm, cache, model, temperature, token_budget,
+                                                     pre_classifier, attribute_extractor, output_schema, on_field,
+                                                     None if thread_match else local_prediction)
+        base_sr_number = base_sr_number or new_sr_number(sr_registry)
+        if near_duplicates and not thread_match and "local_classifier" not in response_json:
+            near_duplicates.add(clean_email_text, base_sr_number, {key: value for key, value in response_json.items() if key != "token_usage"})
+
+    if thread_index:
+        thread_id = thread_index.record(body, thread_headers, base_sr_number,
+                                        {key: value for key, value in response_json.items() if key not in ("token_usage", "near_duplicate")},
+                                        thread_match.thread_id if thread_match else None, attachments)
+        total_segments = thread_match.total_segments if thread_match else len(split_thread_segments(body))
+        response_json["thread"] = {"thread_id": thread_id, "new_segments": len(thread_match.new_segments) if thread_match else total_segments,
+                                   "total_segments": total_segments}
+    linked = bool(thread_match or near_match or existing_sr_number)
+    return file_result(response_json, base_sr_number, linked, sr_registry, email_hash)
+
+# Finish a result under its SR number ("Duplicate/Follow-up - SR" when linked to an earlier one).
+# With an SR registry, the email is filed under the SR, and a linked SR's original classification
+# is attached as "follow_up".
+def file_result(response_json, sr_number, linked, sr_registry=None, email_hash=None):
+    if sr_registry is not None:
+        original = sr_registry.lookup(sr_number) if linked else None
+        if original is not None and original.result:
+            response_json["follow_up"] = dict({key: original.result.get(key) for key in ("request_type", "sub_request_type", "main_intent")},
+                                              sr_number=sr_number)
+        sr_registry.record(email_hash, sr_number,
+                           {key: value for key, value in response_json.items() if key not in ("token_usage", "near_duplicate", "thread", "follow_up")},
+                           response_json.get("thread", {}).get("thread_id"))
+    return finalize_response(response_json, f"Duplicate/Follow-up - {sr_number}" if linked else sr_number)
+
+# Flatten key attributes (list or dict) into a single CSV cell
+def format_key_attributes(key_attributes):
+    if isinstance(key_attributes, dict):
+        return ", ".join(f"{key}: {value}" for key, value in key_attributes.items())
+    return ", ".join(str(item) for item in key_attributes)
+
+# Convert an analysis result into a flat row for CSV export
+def result_to_row(response_json):
+    return {
+        "SR Number": response_json["sr_number"],
+        "Request Type": response_json.get("request_type", ""),
+        "Sub Request Type": response_json.get("sub_request_type", ""),
+        "Key Attributes": format_key_attributes(response_json.get("key_attributes", [])),
+        "Main Intent": response_json.get("main_intent", ""),
+        "Confidence Score": response_json["confidence_score"],
+        "Confidence Explanation": response_json.get("confidence_explanation", ""),
+        "Total Tokens": response_json.get("token_usage", {}).get("total_tokens", ""),
+        "Repairs": response_json.get("token_usage", {}).get("repairs", ""),
+    }
+
+# Threading headers of an .eml or .msg file ({} for plain text)
+def read_email_headers(file_path):
+    if os.path.splitext(file_path)[1].lower() in [".eml", ".msg"]:
+        import ReadEmailContent  # External script for processing emails
+        return ReadEmailContent.read_thread_headers(file_path)
+    return {}
+
+# Read the email text from a .txt, .eml or .msg file (attachments go to attachment_pool when given)
+def read_email_file(file_path, attachment_pool=None):
+    file_extension = os.path.splitext(file_path)[1].lower()
+    if file_extension == ".txt":
+        with instrumentation.span("parse_email", extension=file_extension), open(file_path, "r", encoding="utf-8") as f:
+            return f.read()
+    elif file_extension in [".eml", ".msg"]:
+        import ReadEmailContent  # External script for processing emails
+        with instrumentation.span("parse_email", extension=file_extension):
+            return ReadEmailContent.extract_email_content(file_path, attachment_pool)
+    raise ValueError(f"Unsupported file format: {file_extension}")
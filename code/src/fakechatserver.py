@@ -0,0 +1,167 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Canned classification returned for every request
+DEFAULT_REPLY = {
+    "request_type": "Loan Repayment",
+    "sub_request_type": "Early Loan Repayment",
+    "key_attributes": {"Loan ID": "TEST-0001", "Payment Reference": "FAKE"},
+    "main_intent": "Confirm a loan repayment",
+    "confidence_score": 0.9,
+    "confidence_explanation": "Fake response from the local test endpoint.",
+}
+
+class FakeChatServer(ThreadingHTTPServer):
+    """OpenAI-compatible /v1/chat/completions endpoint that injects latency and throttling.
+
+    Point ChatOpenAI at it with `openai_api_base="http://127.0.0.1:<port>/v1"`.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, jitter=0.0, throttle_rate=0.0, error_rate=0.0,
+                 max_inflight=None, retry_after=1, reply=None, seed=None):
+        super().__init__(address, FakeChatHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.max_inflight = max_inflight
+        self.retry_after = retry_after
+        self.reply = reply or DEFAULT_REPLY
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.prefixes = set()
+        self.stats = {"requests": 0, "throttled": 0, "errors": 0, "completed": 0}
+
+    # Decide how to answer the next request: "ok", "throttle" or "error"
+    def admit(self):
+        with self.lock:
+            self.stats["requests"] += 1
+            if self.max_inflight is not None and self.inflight >= self.max_inflight:
+                outcome = "throttle"
+            else:
+                roll = self.random.random()
+                outcome = "throttle" if roll < self.throttle_rate else "error" if roll < self.throttle_rate + self.error_rate else "ok"
+            if outcome == "throttle":
+                self.stats["throttled"] += 1
+            elif outcome == "error":
+                self.stats["errors"] += 1
+            else:
+                self.inflight += 1
+            return outcome
+
+    def release(self):
+        with self.lock:
+            self.inflight -= 1
+            self.stats["completed"] += 1
+
+    # Content of the assistant message for a request (override for custom replies); a batch of
+    # "### Email <id>" sections gets one entry per email
+    def reply_content(self, request):
+        user_text = next((m.get("content") or "" for m in reversed(request.get("messages", [])) if m.get("role") == "user"), "")
+        ids = [int(match) for match in re.findall(r"^### Email (\d+)$", user_text, re.MULTILINE)]
+        if ids:
+            return json.dumps({"results": [dict(self.reply, id=index) for index in ids]})
+        return "```json\n" + json.dumps(self.reply, indent=2) + "\n```"
+
+    # Prompt tokens a caching provider would serve from cache, as OpenAI does: the leading system
+    # message once it has been seen before, in 128-token steps, for prompts of 1024 tokens or more
+    def cached_prompt_tokens(self, request, prompt_tokens):
+        messages = request.get("messages") or [{}]
+        prefix = messages[0].get("content") or ""
+        with self.lock:
+            seen = prefix in self.prefixes
+            self.prefixes.add(prefix)
+        if not seen or prompt_tokens < 1024:
+            return 0
+        return min(len(prefix) // 4, prompt_tokens) // 128 * 128
+
+    def start_background(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/v1"
+
+class FakeChatHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+
+        outcome = self.server.admit()
+        if outcome == "throttle":
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                            {"Retry-After": str(self.server.retry_after)})
+            return
+        if outcome == "error":
+            self._send_json(500, {"error": {"message": "Injected server error"}})
+            return
+
+        try:
+            time.sleep(max(0.0, self.server.latency + self.server.random.uniform(-self.server.jitter, self.server.jitter)))
+            content = self.server.reply_content(request)
+            prompt_tokens = sum(len(m.get("content") or "") for m in request.get("messages", [])) // 4
+            completion_tokens = len(content) // 4
+            cached_tokens = self.server.cached_prompt_tokens(request, prompt_tokens)
+            self._send_json(200, {
+                "id": f"chatcmpl-fake-{self.server.stats['requests']}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens,
+                          "prompt_tokens_details": {"cached_tokens": cached_tokens}},
+            })
+        finally:
+            self.server.release()
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake chat completion endpoint for load and retry testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds added to every successful response")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Random +/- seconds around the latency")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 500")
+    parser.add_argument("--max-inflight", type=int, help="Answer 429 while this many requests are in flight")
+    parser.add_argument("--seed", type=int, help="Seed for reproducible injection")
+    args = parser.parse_args()
+
+    server = FakeChatServer((args.host, args.port), latency=args.latency, jitter=args.jitter, throttle_rate=args.throttle_rate,
+                            error_rate=args.error_rate, max_inflight=args.max_inflight, seed=args.seed)
+    print(f"Fake chat endpoint listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.stats))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import errno
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+# Get the directory of the currently running Python script
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Default manifest database and the folder handled files are moved to
+MANIFEST_PATH = os.path.join(script_dir, "ingest_manifest.sqlite")
+PROCESSED_FOLDER = os.path.join(script_dir, "processed")
+
+# SHA-256 of a file, read in chunks
+def file_sha256(file_path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Move a file atomically, copying through a temp file when crossing filesystems
+def atomic_move(src, dest):
+    try:
+        os.replace(src, dest)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        tmp_path = f"{dest}.{os.getpid()}.tmp"
+        shutil.copy2(src, tmp_path)
+        os.replace(tmp_path, dest)
+        os.remove(src)
+
+class IngestManifest:
+    """Tracks path, size, mtime and content hash of input files so only new or changed ones are parsed.
+
+    `scan` is a stat pass over a folder; a file is hashed only when its size or mtime moved,
+    and counts as changed only when its content hash differs from the recorded one.
+    """
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.hashes = {}  # Hashes computed by scan, reused by record
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                status TEXT NOT NULL,
+                text TEXT,
+                updated REAL NOT NULL
+            )""")
+        self.conn.commit()
+
+    def _rows(self, folder):
+        prefix = os.path.join(os.path.abspath(folder), "")
+        rows = self.conn.execute("SELECT path, size, mtime_ns, sha256 FROM files WHERE substr(path, 1, ?) = ?",
+                                 (len(prefix), prefix)).fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    # Return the new or changed files in folder (absolute paths, sorted) and forget vanished ones
+    def scan(self, folder, extensions=None):
+        changed = []
+        with self.lock:
+            known = self._rows(folder)
+            seen = set()
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if not entry.is_file() or (extensions and not entry.name.lower().endswith(tuple(extensions))):
+                        continue
+                    path = os.path.abspath(entry.path)
+                    seen.add(path)
+                    stat = entry.stat()
+                    row = known.get(path)
+                    if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+                        continue
+                    sha256 = file_sha256(path)
+                    if row and row[2] == sha256:
+                        # Touched but identical: refresh the stat so the next scan skips it again
+                        self.conn.execute("UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?",
+                                          (stat.st_size, stat.st_mtime_ns, path))
+                        continue
+                    self.hashes[path] = (stat.st_size, stat.st_mtime_ns, sha256)
+                    changed.append(path)
+            for path in set(known) - seen:
+                self.conn.execute("DELETE FROM files WHERE path = ?", (path,))
+            self.conn.commit()
+        return sorted(changed)
+
+    # Record a file as handled, optionally with its extracted text
+    def record(self, file_path, text=None, status="parsed"):
+        path = os.path.abspath(file_path)
+        with self.lock:
+            size, mtime_ns, sha256 = self.hashes.pop(path, None) or self._stat_and_hash(path)
+            self.conn.execute("INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256, status, text, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (path, size, mtime_ns, sha256, status, text, time.time()))
+            self.conn.commit()
+
+    def _stat_and_hash(self, path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns, file_sha256(path)
+
+    # Extracted text stored for a file, or None
+    def get_text(self, file_path):
+        with self.lock:
+            row = self.conn.execute("SELECT text FROM files WHERE path = ?", (os.path.abspath(file_path),)).fetchone()
+        return row[0] if row else None
+
+    def get_status(self, file_path):
+        with self.lock:
+            row = self.conn.execute("SELECT status FROM files WHERE path = ?", (os.path.abspath(file_path),)).fetchone()
+        return row[0] if row else None
+
+    # Known files in folder with their status and stored text, sorted by name
+    def entries(self, folder):
+        prefix = os.path.join(os.path.abspath(folder), "")
+        with self.lock:
+            return self.conn.execute("SELECT path, status, text FROM files WHERE substr(path, 1, ?) = ? ORDER BY path",
+                                     (len(prefix), prefix)).fetchall()
+
+    # Move a handled file into the processed folder and drop it from the manifest
+    def move_to_processed(self, file_path, processed_folder=PROCESSED_FOLDER):
+        path = os.path.abspath(file_path)
+        os.makedirs(processed_folder, exist_ok=True)
+        dest = os.path.join(processed_folder, os.path.basename(path))
+        if os.path.exists(dest) and file_sha256(dest) != file_sha256(path):
+            # Keep both versions when a different file with the same name was processed before
+            name, extension = os.path.splitext(dest)
+            dest = f"{name}-{file_sha256(path)[:8]}{extension}"
+        atomic_move(path, dest)
+        with self.lock:
+            self.conn.execute("DELETE FROM files WHERE path = ?", (path,))
+            self.hashes.pop(path, None)
+            self.conn.commit()
+        return dest
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,342 @@
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import queue
+import select
+import statistics
+import struct
+import sys
+import threading
+import time
+from dotenv import load_dotenv
+import emailpipeline
+from batchanalyzer import ResultWriter, add_pipeline_arguments, build_analyzer, close_analyzer
+from ingestmanifest import IngestManifest
+
+# Get the directory of the currently running Python script
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Folder watched by default
+WATCH_FOLDER = os.path.join(script_dir, "Input")
+
+# Files waiting for a worker; when the LLM stage falls behind, the watcher blocks on a full queue
+DEFAULT_QUEUE_SIZE = 64
+# Seconds between scans of the polling watcher
+DEFAULT_POLL_INTERVAL = 1.0
+# Seconds a file's size and mtime must stay unchanged before the polling watcher reports it
+DEFAULT_SETTLE_SECONDS = 1.0
+
+# inotify event flags (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len; followed by the NUL-padded name
+
+# Email files worth analyzing (editors' lock and temp files are skipped)
+def is_input_file(name):
+    return not name.startswith((".", "~$")) and name.lower().endswith(emailpipeline.SUPPORTED_EXTENSIONS)
+
+class InotifyWatch:
+    """Reports files in a folder once their writer closes them, or once they are moved in (Linux only).
+
+    `poll` returns None when the kernel event queue overflowed, so the caller has to rescan.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {folder}")
+
+    # Paths completed within timeout seconds
+    def poll(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if name:
+                paths.append(os.path.join(self.folder, os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatch:
+    """Reports files in a folder once their size and mtime have stayed unchanged for `settle` seconds."""
+
+    def __init__(self, folder, interval=DEFAULT_POLL_INTERVAL, settle=DEFAULT_SETTLE_SECONDS):
+        self.folder = folder
+        self.interval = interval
+        self.settle = settle
+        self.seen = {}  # path -> ((size, mtime_ns), first time seen with that stat, reported)
+
+    # Mark files as already reported with their current size and mtime (all files in the folder
+    # when paths is None), so files handled by the initial scan are only reported again if they change
+    def mark_reported(self, paths=None):
+        if paths is None:
+            with os.scandir(self.folder) as entries:
+                paths = [entry.path for entry in entries if entry.is_file()]
+        now = time.monotonic()
+        for path in paths:
+            if path in self.seen:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            self.seen[path] = ((stat.st_size, stat.st_mtime_ns), now, True)
+
+    def poll(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        now = time.monotonic()
+        paths = []
+        current = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                key = (stat.st_size, stat.st_mtime_ns)
+                previous = self.seen.get(entry.path)
+                if previous is None or previous[0] != key:
+                    current[entry.path] = (key, now, False)
+                elif not previous[2] and now - previous[1] >= self.settle:
+                    current[entry.path] = (key, previous[1], True)
+                    paths.append(entry.path)
+                else:
+                    current[entry.path] = previous
+        # Vanished files are forgotten, so a file dropped again under the same name is reported again
+        self.seen = current
+        return paths
+
+    def close(self):
+        pass
+
+# inotify where the platform has it, polling otherwise
+def open_watch(folder, polling=False, interval=DEFAULT_POLL_INTERVAL, settle=DEFAULT_SETTLE_SECONDS):
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatch(folder)
+        except OSError as e:
+            print(f"inotify unavailable ({e}), polling {folder} instead", file=sys.stderr)
+    return PollingWatch(folder, interval, settle)
+
+class InputWatcher:
+    """Long-running service that analyzes every email file dropped into a folder.
+
+    A watcher thread turns file events into a bounded work queue and `workers` threads run
+    analyzer.analyze_file on it (the analyzer's dispatcher still limits LLM concurrency).
+    When the workers fall behind, the watcher blocks on the full queue, so pending files wait
+    in the folder (and in the kernel event queue) instead of in memory. Each record gets
+    a "latency" entry: seconds queued, and seconds from the file drop (its ctime, which a
+    write or a move into the folder sets; the start of the watcher for older files) to the SR.
+    """
+
+    def __init__(self, folder, analyzer, on_record, workers=4, queue_size=DEFAULT_QUEUE_SIZE,
+                 watch=None, manifest=None, processed_folder=None, incremental=False):
+        self.folder = os.path.abspath(folder)
+        self.analyzer = analyzer
+        self.on_record = on_record
+        self.watch = watch or open_watch(self.folder)
+        self.manifest = manifest
+        self.processed_folder = processed_folder
+        self.incremental = incremental
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.pending = set()  # Queued or in-progress paths, so repeated events do not enqueue a file twice
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.stats = {"detected": 0, "analyzed": 0, "failed": 0, "worker_errors": 0, "rescans": 0, "backpressure_waits": 0}
+        self.latencies = []
+        self.started = time.time()
+        self.threads = [threading.Thread(target=self._watch_loop, name="input-watcher", daemon=True)]
+        self.threads += [threading.Thread(target=self._work_loop, name=f"input-worker-{i}", daemon=True) for i in range(workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    # Stop watching, let the workers finish the files already queued and join the threads
+    def stop(self):
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+        self.watch.close()
+
+    # Files already in the folder (only new or changed ones when incremental)
+    def _scan(self):
+        if self.incremental:
+            return self.manifest.scan(self.folder, emailpipeline.SUPPORTED_EXTENSIONS)
+        with os.scandir(self.folder) as entries:
+            return sorted(entry.path for entry in entries if entry.is_file())
+
+    # Queue a file, waiting while the queue is full; returns False when stopping
+    def _enqueue(self, path):
+        if not is_input_file(os.path.basename(path)):
+            return True
+        try:
+            dropped = max(os.stat(path).st_ctime, self.started)
+        except FileNotFoundError:
+            return True
+        with self.lock:
+            if path in self.pending:
+                return True
+            self.pending.add(path)
+            self.stats["detected"] += 1
+        item = (path, dropped, time.monotonic())
+        if self.queue.full():
+            with self.lock:
+                self.stats["backpressure_waits"] += 1
+        while not self.stopping.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _watch_loop(self):
+        # The polling watcher would otherwise report every file of the initial scan again once it
+        # settles: files present before the scan (an incremental scan skips unchanged ones), then
+        # those the scan picked up, are marked reported
+        seeded = isinstance(self.watch, PollingWatch)
+        if seeded:
+            self.watch.mark_reported()
+        paths = self._scan()
+        if seeded:
+            self.watch.mark_reported(paths)
+        while not self.stopping.is_set():
+            for path in paths:
+                if not self._enqueue(path):
+                    return
+            paths = self.watch.poll(0.5)
+            if paths is None:
+                # Events were dropped by the kernel: pick up whatever is in the folder
+                with self.lock:
+                    self.stats["rescans"] += 1
+                paths = self._scan()
+
+    def _work_loop(self):
+        while True:
+            try:
+                path, dropped, queued = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                if self.stopping.is_set():
+                    return
+                continue
+            try:
+                self._process(path, dropped, queued)
+            except Exception as e:
+                # A failure outside the analyzer (e.g. a full disk under the outputs) costs this file, not the worker
+                print(f"Error processing {path}: {e}", file=sys.stderr)
+                with self.lock:
+                    self.stats["worker_errors"] += 1
+            finally:
+                with self.lock:
+                    self.pending.discard(path)
+
+    def _process(self, path, dropped, queued):
+        queued = time.monotonic() - queued
+        record = self.analyzer.analyze_file(path)
+        total = time.time() - dropped
+        record["latency"] = {"queued": round(queued, 3), "total": round(total, 3)}
+        try:
+            if "error" not in record and self.processed_folder:
+                record["moved_to"] = self.manifest.move_to_processed(path, self.processed_folder)
+            elif self.manifest is not None:
+                self.manifest.record(path, status="failed" if "error" in record else "analyzed")
+        except OSError as e:
+            print(f"Could not record {path}: {e}", file=sys.stderr)
+        with self.lock:
+            self.stats["failed" if "error" in record else "analyzed"] += 1
+            if "error" not in record:
+                self.latencies.append(total)
+            self.on_record(record)
+
+    # Median, 90th percentile and maximum of the drop-to-SR seconds
+    def latency_summary(self):
+        with self.lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return {}
+        return {"p50_seconds": round(statistics.median(samples), 3),
+                "p90_seconds": round(samples[min(len(samples) - 1, int(0.9 * len(samples)))], 3),
+                "max_seconds": round(samples[-1], 3)}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Watch a folder and analyze every email file dropped into it.")
+    parser.add_argument("folder", nargs="?", default=WATCH_FOLDER, help="Folder to watch (default: Input/)")
+    parser.add_argument("--workers", type=int, default=4, help="Threads parsing and classifying files")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="Files waiting for a worker before the watcher stops taking new ones")
+    parser.add_argument("--poll", action="store_true", help="Poll the folder instead of using inotify")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL, help="Seconds between polls")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE_SECONDS,
+                        help="Seconds a polled file must stay unchanged before it is analyzed")
+    parser.add_argument("--incremental", action="store_true", help="On startup, skip files the manifest has already seen unchanged")
+    add_pipeline_arguments(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    load_dotenv()
+    manifest = IngestManifest(args.manifest) if args.incremental or args.move_processed else None
+    analyzer = build_analyzer(args, emailpipeline.load_config())
+    watch = open_watch(args.folder, args.poll, args.poll_interval, args.settle)
+    print(f"Watching {os.path.abspath(args.folder)} ({type(watch).__name__}), Ctrl+C to stop.", file=sys.stderr)
+
+    # Appended to, so the results of earlier runs (whose inputs may have been moved away) are kept
+    with ResultWriter(args.jsonl, args.csv, append=True) as writer:
+        # Called by the workers one at a time, under the watcher's lock
+        def on_record(record):
+            writer.write(record)
+            if not (args.jsonl or args.csv):
+                print(json.dumps(record), flush=True)
+            if "error" in record:
+                print(f"Error processing {record['file']}: {record['error']}", file=sys.stderr)
+                return
+            print(f"{record['result'].get('sr_number')} for {os.path.basename(record['file'])} "
+                  f"in {record['latency']['total']:.2f}s ({record['latency']['queued']:.2f}s queued)", file=sys.stderr)
+
+        watcher = InputWatcher(args.folder, analyzer, on_record, args.workers, args.queue_size, watch, manifest,
+                               args.move_processed, args.incremental).start()
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("Stopping, finishing queued files...", file=sys.stderr)
+        watcher.stop()
+
+    print(f"Watcher: {json.dumps(watcher.stats)}", file=sys.stderr)
+    if watcher.latencies:
+        print(f"Latency from file drop to SR: {json.dumps(watcher.latency_summary())}", file=sys.stderr)
+    close_analyzer(analyzer)
+    if manifest is not None:
+        manifest.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
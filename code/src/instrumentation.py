@@ -0,0 +1,217 @@
+import collections
+import contextlib
+import json
+import sys
+import threading
+import time
+
+# Prefix of every exported metric name
+METRIC_PREFIX = "emailanalyzer_"
+
+# Upper bounds (seconds) of the stage duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Returned by span() while instrumentation is off, so a disabled span costs one global lookup
+_NOOP = contextlib.nullcontext()
+
+# The enabled _Recorder, or None (the default: instrumentation off)
+_recorder = None
+_local = threading.local()
+
+class _Recorder:
+    """Aggregated stage durations and counters, plus the optional JSONL trace file."""
+
+    def __init__(self, trace_path=None):
+        self.lock = threading.Lock()
+        self.durations = {}  # stage -> [bucket counts..., count, sum]
+        self.counters = collections.Counter()  # (name, ((label, value), ...)) -> amount
+        self.trace_file = open(trace_path, "a", encoding="utf-8") if trace_path else None
+        self.server = None
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.durations.get(stage)
+            if histogram is None:
+                histogram = self.durations[stage] = [0] * (len(DURATION_BUCKETS) + 1) + [0.0]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+    def count(self, name, amount, labels):
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def trace(self, event):
+        if self.trace_file is not None:
+            line = json.dumps(event, default=str) + "\n"
+            with self.lock:
+                # Spans still open when instrumentation is disabled end after the file is closed
+                if self.trace_file is not None:
+                    self.trace_file.write(line)
+                    self.trace_file.flush()
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        with self.lock:
+            trace_file, self.trace_file = self.trace_file, None
+        if trace_file is not None:
+            trace_file.close()
+
+class _Span:
+    """One timed stage. A span opened with a trace ID starts a trace: spans nested in it (on the same
+    thread) share its ID and counters, and its trace line carries the counters gathered meanwhile."""
+
+    def __init__(self, recorder, name, trace_id, attrs):
+        self.recorder = recorder
+        self.name = name
+        self.trace_id = trace_id
+        self.attrs = attrs
+        self.counters = collections.Counter() if trace_id is not None else None
+
+    # Add attributes to the span's trace line
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.parent = getattr(_local, "span", None)
+        if self.parent is not None and self.trace_id is None:
+            self.trace_id = self.parent.trace_id
+            self.counters = self.parent.counters
+        _local.span = self
+        self.started = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        _local.span = self.parent
+        self.recorder.observe(self.name, seconds)
+        event = {"trace": self.trace_id, "span": self.name, "parent": self.parent.name if self.parent else None,
+                 "start": round(self.started, 6), "seconds": round(seconds, 6)}
+        if self.attrs:
+            event["attrs"] = self.attrs
+        if exc is not None:
+            event["error"] = f"{exc_type.__name__}: {exc}"
+            # Count an exception once, in the innermost span it went through
+            if getattr(_local, "last_error", None) is not exc:
+                _local.last_error = exc
+                count("failures", stage=self.name)
+        if self.counters is not None and self.parent is None:
+            event["counters"] = dict(self.counters)
+        self.recorder.trace(event)
+        return False
+
+# Turn instrumentation on; spans are appended to trace_path as JSON lines when given
+def enable(trace_path=None):
+    global _recorder
+    disable()
+    _recorder = _Recorder(trace_path)
+
+# Turn instrumentation off, stop the metrics endpoint and close the trace file
+def disable():
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is not None:
+        recorder.close()
+
+def enabled():
+    return _recorder is not None
+
+# Context manager timing one stage (a no-op while disabled). `trace_id` starts a per-email trace.
+def span(name, trace_id=None, **attrs):
+    recorder = _recorder
+    if recorder is None:
+        return _NOOP
+    return _Span(recorder, name, trace_id, attrs)
+
+# Increment a counter, also counted on the current email's trace
+def count(name, amount=1, **labels):
+    recorder = _recorder
+    if recorder is None or not amount:
+        return
+    recorder.count(name, amount, labels)
+    current = getattr(_local, "span", None)
+    if current is not None and current.counters is not None:
+        key = name if not labels else name + "{" + ",".join(f"{k}={v}" for k, v in sorted(labels.items())) + "}"
+        current.counters[key] += amount
+
+# Record an error that was handled (the pipeline carried on): a failure count and a trace line
+def record_error(stage, error, **attrs):
+    recorder = _recorder
+    if recorder is None:
+        return
+    if getattr(_local, "last_error", None) is not error:
+        _local.last_error = error
+        count("failures", stage=stage)
+    current = getattr(_local, "span", None)
+    recorder.trace({"trace": current.trace_id if current else None, "event": "error", "stage": stage,
+                    "error": str(error), "time": round(time.time(), 6), **attrs})
+
+# Label value escaped for the exposition format
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+# Current metrics in the Prometheus text exposition format
+def render_metrics():
+    recorder = _recorder
+    if recorder is None:
+        return ""
+    with recorder.lock:
+        durations = {stage: list(histogram) for stage, histogram in recorder.durations.items()}
+        counters = dict(recorder.counters)
+    lines = []
+    name = f"{METRIC_PREFIX}stage_duration_seconds"
+    lines += [f"# HELP {name} Time spent in each pipeline stage.", f"# TYPE {name} histogram"]
+    for stage, histogram in sorted(durations.items()):
+        stage = _escape(stage)
+        for bound, bucket in zip(DURATION_BUCKETS, histogram):
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {bucket}')
+        lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram[-2]}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {histogram[-2]}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {histogram[-1]:.6f}')
+    by_name = collections.defaultdict(list)
+    for (counter, labels), value in counters.items():
+        by_name[counter].append((labels, value))
+    for counter, series in sorted(by_name.items()):
+        name = f"{METRIC_PREFIX}{counter}_total"
+        lines.append(f"# TYPE {name} counter")
+        lines += [f"{name}{_labels(labels)} {value}" for labels, value in sorted(series)]
+    return "\n".join(lines) + "\n"
+
+# Serve /metrics for Prometheus on a background thread (instrumentation must be enabled)
+def serve_metrics(port, host="127.0.0.1"):
+    if _recorder is None:
+        raise RuntimeError("instrumentation is not enabled")
+    # Imported here: http.server is slow to import and only needed when metrics are served
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_metrics().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-endpoint", daemon=True).start()
+    _recorder.server = server
+    print(f"Metrics at http://{host}:{server.server_address[1]}/metrics", file=sys.stderr)
+    return server
@@ -0,0 +1,105 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# A backend is anything the pipeline can call like a LangChain chat model: `llm(messages)`
+# returns a message with `.content` (and usage metadata when known), and `llm.stream(messages)`
+# yields chunks that add up to one. ChatOpenAI is used as is (emailpipeline.create_llm);
+# LlamaCppBackend runs a local GGUF model through llama.cpp with no network access.
+
+# Default local model, as in archive/app.py
+LLAMA_MODEL_PATH = os.path.join("llama_model", "llama-2-7b-chat.Q4_K_M.gguf")
+
+# Context window (llama-2 was trained on 4096 tokens), reply length and prompt cache size of the local model
+DEFAULT_N_CTX = 4096
+DEFAULT_MAX_TOKENS = 512
+DEFAULT_CACHE_BYTES = 2 << 30
+
+# LangChain message types to chat roles
+ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+class BackendMessage:
+    """Chat reply of a non-LangChain backend, shaped like a LangChain AIMessage."""
+
+    def __init__(self, content, usage_metadata=None):
+        self.content = content
+        self.usage_metadata = usage_metadata or {}
+        self.response_metadata = {}
+
+    # Chunks of a streamed reply add up to the whole reply
+    def __add__(self, other):
+        usage = {key: self.usage_metadata.get(key, 0) + other.usage_metadata.get(key, 0)
+                 for key in set(self.usage_metadata) | set(other.usage_metadata)}
+        return BackendMessage(self.content + other.content, usage)
+
+def _chat_messages(messages):
+    return [{"role": ROLES.get(getattr(message, "type", "human"), "user"), "content": message.content} for message in messages]
+
+# The model loaded in this worker process (one instance per worker, kept for its whole life)
+_llama = None
+
+def _init_llama_worker(model_path, n_ctx, n_threads, cache_bytes):
+    global _llama
+    from llama_cpp import Llama, LlamaRAMCache
+    _llama = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, verbose=False)
+    # The evaluated prompt tokens are kept between calls, so a shared prompt prefix is only
+    # evaluated once; the RAM cache keeps the states of several prefixes
+    _llama.set_cache(LlamaRAMCache(capacity_bytes=cache_bytes))
+
+def _llama_complete(chat_messages, temperature, max_tokens, response_format):
+    completion = _llama.create_chat_completion(messages=chat_messages, temperature=temperature, max_tokens=max_tokens,
+                                               response_format=response_format)
+    usage = completion.get("usage") or {}
+    return (completion["choices"][0]["message"]["content"] or "",
+            {"input_tokens": usage.get("prompt_tokens", 0), "output_tokens": usage.get("completion_tokens", 0),
+             "total_tokens": usage.get("total_tokens", 0)})
+
+# Run several prompts in one worker task, one after the other on the same loaded model
+def _llama_complete_batch(batch, temperature, max_tokens, response_format):
+    return [_llama_complete(chat_messages, temperature, max_tokens, response_format) for chat_messages in batch]
+
+class LlamaCppBackend:
+    """Local llama.cpp chat backend: a pool of worker processes, each holding one loaded GGUF model.
+
+    Requests are spread over the workers; a worker keeps the evaluated tokens of its last prompt
+    (and a RAM cache of earlier ones), so the long shared instruction prefix is reused instead
+    of being evaluated again. `n_ctx` bounds the prompt plus the reply; the analyzers size
+    their token budget from it (emailpipeline.backend_token_budget). `batch` is only used by
+    benchmarks/bench_backends.py: the analyzers call the backend once per email from the
+    dispatcher's threads, which keeps every worker busy.
+    """
+
+    def __init__(self, model_path=LLAMA_MODEL_PATH, workers=1, n_ctx=DEFAULT_N_CTX, n_threads=None, temperature=0.3,
+                 max_tokens=DEFAULT_MAX_TOKENS, cache_bytes=DEFAULT_CACHE_BYTES, output_schema=None):
+        if not os.path.isfile(model_path):
+            raise FileNotFoundError(f"llama.cpp model not found: {model_path}")
+        self.model_name = f"llamacpp:{os.path.basename(model_path)}"
+        self.workers = workers
+        self.n_ctx = n_ctx
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        # llama.cpp turns the schema into a grammar, so replies always parse
+        self.response_format = {"type": "json_object", "schema": output_schema} if output_schema else {"type": "json_object"}
+        n_threads = n_threads or max(1, (os.cpu_count() or 1) // workers)
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=_init_llama_worker, initargs=(model_path, n_ctx, n_threads, cache_bytes))
+
+    def __call__(self, messages):
+        content, usage = self.executor.submit(_llama_complete, _chat_messages(messages), self.temperature, self.max_tokens,
+                                              self.response_format).result()
+        return BackendMessage(content, usage)
+
+    # The reply is produced in a worker process, so it is streamed as one chunk
+    def stream(self, messages):
+        yield self(messages)
+
+    # Replies for many prompts, in order: split into one contiguous slice per worker
+    def batch(self, messages_list):
+        chat_batches = [_chat_messages(messages) for messages in messages_list]
+        size = max(1, -(-len(chat_batches) // self.workers))
+        futures = [self.executor.submit(_llama_complete_batch, chat_batches[start:start + size], self.temperature, self.max_tokens,
+                                        self.response_format) for start in range(0, len(chat_batches), size)]
+        return [BackendMessage(content, usage) for future in futures for content, usage in future.result()]
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
@@ -0,0 +1,203 @@
+import collections
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import instrumentation
+
+# HTTP status codes worth retrying: throttling and transient server errors
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Exception class names raised by the openai client for transient failures
+RETRYABLE_ERROR_NAMES = {"RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError",
+                         "ServiceUnavailableError", "Timeout", "TryAgain"}
+
+# Rough completion size reserved per request when budgeting tokens
+DEFAULT_COMPLETION_TOKENS = 500
+
+class TokenBucket:
+    """Blocking token bucket refilled continuously at `rate_per_minute`."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Wait until `amount` tokens are available and take them
+    def acquire(self, amount=1):
+        amount = min(amount, self.capacity)  # A single oversized request must still be able to run
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    # Charge tokens after the fact (e.g. real usage above the estimate); may go negative
+    def consume(self, amount):
+        with self.lock:
+            self._refill()
+            self.tokens -= amount
+
+# Pull an HTTP status code out of an openai/httpx/requests style exception
+def get_status_code(exc):
+    for attr in ("status_code", "http_status", "status"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+# Decide whether a failed LLM call should be retried
+def is_retryable(exc):
+    status_code = get_status_code(exc)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    return type(exc).__name__ in RETRYABLE_ERROR_NAMES or isinstance(exc, (ConnectionError, TimeoutError))
+
+# Server-requested delay from a Retry-After header, if any
+def get_retry_after(exc):
+    headers = getattr(getattr(exc, "response", None), "headers", None) or getattr(exc, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+# Rough prompt token estimate (~4 characters per token)
+def estimate_tokens(messages):
+    return sum(len(getattr(message, "content", "") or "") for message in messages) // 4
+
+# Actual tokens used by a chat response, when the client reports them
+def get_response_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage and usage.get("total_tokens"):
+        return usage["total_tokens"]
+    token_usage = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+    return token_usage.get("total_tokens")
+
+class LLMDispatcher:
+    """Wraps a chat model with rate limits, retries and a bounded pool of concurrent calls.
+
+    The dispatcher is callable like the model itself, so it can be passed anywhere an
+    `llm` is expected. At most `max_concurrency` requests (calls and open streams) run at
+    once, however many threads use the dispatcher. `imap` runs a function over many items
+    concurrently and yields the results in input order.
+    """
+
+    def __init__(self, llm, max_concurrency=8, requests_per_minute=None, tokens_per_minute=None,
+                 max_retries=5, base_delay=1.0, max_delay=60.0, completion_tokens=DEFAULT_COMPLETION_TOKENS):
+        self.llm = llm
+        self.max_concurrency = max_concurrency
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.completion_tokens = completion_tokens
+        self.stats = collections.Counter()
+        self.stats_lock = threading.Lock()
+
+    def _count(self, key, amount=1):
+        with self.stats_lock:
+            self.stats[key] += amount
+        instrumentation.count(f"llm_{key}", amount)
+
+    # Full-jitter exponential backoff, never shorter than a server-requested Retry-After
+    def _backoff(self, attempt, exc):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        retry_after = get_retry_after(exc)
+        return max(delay, retry_after) if retry_after else delay
+
+    # Call the model once the rate limits allow it, retrying transient failures
+    def __call__(self, messages):
+        estimate = estimate_tokens(messages) + self.completion_tokens
+        attempt = 0
+        while True:
+            if self.request_bucket:
+                self.request_bucket.acquire()
+            if self.token_bucket:
+                self.token_bucket.acquire(estimate)
+            self._count("requests")
+            try:
+                with self.slots:
+                    response = self.llm(messages)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self._count("failures")
+                    raise
+                self._count("retries")
+                time.sleep(self._backoff(attempt, e))
+                attempt += 1
+                continue
+            used = get_response_tokens(response)
+            if used and self.token_bucket and used > estimate:
+                self.token_bucket.consume(used - estimate)
+            return response
+
+    # Stream the model reply once the rate limits allow it; failures before the first chunk are
+    # retried like __call__, a stream that breaks later is raised to the caller
+    def stream(self, messages):
+        estimate = estimate_tokens(messages) + self.completion_tokens
+        attempt = 0
+        while True:
+            if self.request_bucket:
+                self.request_bucket.acquire()
+            if self.token_bucket:
+                self.token_bucket.acquire(estimate)
+            self._count("requests")
+            # The slot is held until the stream ends (or is abandoned), released early only on failure
+            self.slots.acquire()
+            try:
+                chunks = iter(self.llm.stream(messages))
+                first = next(chunks, None)
+            except Exception as e:
+                self.slots.release()
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self._count("failures")
+                    raise
+                self._count("retries")
+                time.sleep(self._backoff(attempt, e))
+                attempt += 1
+                continue
+            break
+        try:
+            if first is None:
+                return
+            response = first
+            yield first
+            for chunk in chunks:
+                response = response + chunk
+                yield chunk
+        finally:
+            self.slots.release()
+        used = get_response_tokens(response)
+        if used and self.token_bucket and used > estimate:
+            self.token_bucket.consume(used - estimate)
+
+    # Run func over items with at most max_concurrency in flight, yielding results in input order
+    def imap(self, func, items):
+        window = collections.deque()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for item in items:
+                window.append(executor.submit(func, item))
+                if len(window) >= self.max_concurrency * 2:
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
+
+    # Same as imap, collected into a list
+    def map(self, func, items):
+        return list(self.imap(func, items))
@@ -0,0 +1,370 @@
+import argparse
+import csv
+import glob
+import json
+import math
+import os
+import random
+import re
+import sys
+import time
+import zlib
+from structuredoutput import validate_result
+
+# Get the directory of the currently running Python script
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Default model file and the labelled examples it is trained on
+MODEL_PATH = os.path.join(script_dir, "local_classifier.json")
+TEST_DIR = os.path.join(os.path.dirname(script_dir), "test")
+TRAINING_CSV = os.path.join(TEST_DIR, "Emails.csv")
+TRAINING_XLSX = os.path.join(TEST_DIR, "DataSet details.xlsx")
+
+# Probability the local model needs before its answer is used instead of the LLM's. Training
+# calibrates it on held-out folds and stores it in the model; this default is for models saved
+# without one. Calibrated on Emails.csv and DataSet details.xlsx (9 emails, one fold each), held-out
+# predictions at 0.85 or above were all right and the most probable wrong one had 0.82.
+DEFAULT_CONFIDENCE_THRESHOLD = 0.85
+
+# Held-out folds for calibration and the precision the predictions above the threshold must keep:
+# a wrong local answer is never checked by the LLM
+CALIBRATION_FOLDS = 10
+TARGET_PRECISION = 0.95
+
+# Hashed feature space (power of two) and training settings
+NUM_FEATURES = 1 << 18
+EPOCHS = 60
+LEARNING_RATE = 0.5
+L2 = 1e-4
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9$%]+")
+
+# Unigram and bigram tokens of an email, digits masked so amounts and dates do not matter
+def _tokens(email_text):
+    words = TOKEN_PATTERN.findall(re.sub(r"\d", "0", email_text.lower()))
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+# Sublinear term frequencies by hashed feature index
+def _term_counts(email_text, num_features):
+    counts = {}
+    for token in _tokens(email_text):
+        index = zlib.crc32(token.encode("utf-8")) & (num_features - 1)
+        counts[index] = counts.get(index, 0) + 1
+    return {index: 1.0 + math.log(count) for index, count in counts.items()}
+
+# Emails below which the arrays of a batch cost more to set up than the plain loop
+NUMPY_MIN_BATCH = 8
+
+_numpy = None
+
+# numpy when installed (batches are then scored as one sparse matrix), else False
+def _get_numpy():
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy
+
+def _softmax(scores):
+    top = max(scores)
+    exps = [math.exp(score - top) for score in scores]
+    total = sum(exps)
+    return [value / total for value in exps]
+
+class LocalPrediction:
+    """Label and probability the local classifier gives one email."""
+
+    def __init__(self, request_type, sub_request_type, main_intent, probability, threshold):
+        self.request_type = request_type
+        self.sub_request_type = sub_request_type
+        self.main_intent = main_intent
+        self.probability = probability
+        self.confident = probability >= threshold
+
+    # Analysis result in the shape the LLM returns (key attributes are filled in by attributeextractor)
+    def to_result(self):
+        return {"request_type": self.request_type, "sub_request_type": self.sub_request_type, "key_attributes": {},
+                "main_intent": self.main_intent,
+                "confidence_explanation": f"Classified locally with probability {self.probability:.2f}; the LLM was not called."}
+
+class LocalClassifier:
+    """Hashed TF-IDF features and a multinomial logistic regression over (request type, sub-request type).
+
+    Sparse features and no extra dependency: one email is scored in pure Python, while
+    `classify_batch` scores a list of emails as one sparse matrix product when numpy is installed.
+    A prediction is only confident when its result is also valid: request types within the
+    configured ones (`request_types`, `sub_request_types`) and, when given, the output schema.
+    """
+
+    def __init__(self, labels, weights, bias, idf, threshold=DEFAULT_CONFIDENCE_THRESHOLD, num_features=NUM_FEATURES,
+                 request_types=None, sub_request_types=None):
+        self.labels = labels  # [request_type, sub_request_type, main_intent] per class
+        self.weights = weights  # Feature index -> per-class weights
+        self.bias = bias
+        self.idf = idf
+        self.threshold = threshold
+        self.num_features = num_features
+        self.request_types = set(request_types) if request_types else None
+        self.sub_request_types = set(sub_request_types) | {"N/A"} if sub_request_types else None
+        self.stats = {"classified": 0, "confident": 0, "rejected": 0}
+        self.arrays = None
+
+    # L2-normalized TF-IDF vector of an email as a sparse dict
+    def vectorize(self, email_text):
+        return self.vectorize_counts(_term_counts(email_text, self.num_features))
+
+    def vectorize_counts(self, counts):
+        vector = {index: tf * self.idf.get(index, 1.0) for index, tf in counts.items()}
+        norm = math.sqrt(sum(value * value for value in vector.values())) or 1.0
+        return {index: value / norm for index, value in vector.items()}
+
+    def _probabilities(self, vector):
+        scores = list(self.bias)
+        for index, value in vector.items():
+            row = self.weights.get(index)
+            if row is not None:
+                for label, weight in enumerate(row):
+                    scores[label] += weight * value
+        return _softmax(scores)
+
+    # The model as arrays: sorted feature indexes with their idf and weight rows, and the bias
+    def _arrays(self, np):
+        if self.arrays is None:
+            idf_features = np.array(sorted(self.idf), dtype=np.int64)
+            weight_features = np.array(sorted(self.weights), dtype=np.int64)
+            weights = np.array([self.weights[index] for index in weight_features.tolist()], dtype=np.float64)
+            self.arrays = (idf_features, np.array([self.idf[index] for index in idf_features.tolist()], dtype=np.float64),
+                           weight_features, weights.reshape(len(weight_features), len(self.labels)),
+                           np.array(self.bias, dtype=np.float64))
+        return self.arrays
+
+    # Class probabilities of a batch: its term counts as a sparse (row, feature, value) matrix
+    # times the weights, the same arithmetic as vectorize and _probabilities
+    def _batch_probabilities(self, np, email_texts):
+        idf_features, idf_values, weight_features, weights, bias = self._arrays(np)
+        rows, features, values = [], [], []
+        for row, email_text in enumerate(email_texts):
+            counts = _term_counts(email_text, self.num_features)
+            rows += [row] * len(counts)
+            features += counts.keys()
+            values += counts.values()
+        rows = np.array(rows, dtype=np.intp)
+        features = np.array(features, dtype=np.int64)
+        values = np.array(values, dtype=np.float64)
+
+        # Features the model has no idf for keep a weight of 1.0, as in vectorize_counts
+        position = np.minimum(np.searchsorted(idf_features, features), max(len(idf_features) - 1, 0))
+        known = idf_features[position] == features if len(idf_features) else np.zeros(len(features), dtype=bool)
+        values = values * np.where(known, idf_values[position] if len(idf_values) else 1.0, 1.0)
+        norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=len(email_texts)))
+        norms[norms == 0] = 1.0
+        values /= norms[rows]
+
+        scores = np.tile(bias, (len(email_texts), 1))
+        if len(weight_features):
+            position = np.minimum(np.searchsorted(weight_features, features), len(weight_features) - 1)
+            known = weight_features[position] == features
+            np.add.at(scores, rows[known], values[known, None] * weights[position[known]])
+        scores -= scores.max(axis=1, keepdims=True)
+        probabilities = np.exp(scores)
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+    # Problems with a prediction's result: request types outside the configured ones, schema violations
+    def result_errors(self, prediction, output_schema=None):
+        errors = []
+        if self.request_types is not None and prediction.request_type not in self.request_types:
+            errors.append(f"request type {prediction.request_type!r} is not configured")
+        if self.sub_request_types is not None and prediction.sub_request_type not in self.sub_request_types:
+            errors.append(f"sub-request type {prediction.sub_request_type!r} is not configured")
+        if output_schema is not None:
+            errors += validate_result(prediction.to_result(), output_schema)
+        return errors
+
+    # Predictions for many emails; confident ones whose result is invalid are marked not confident
+    def classify_batch(self, email_texts, output_schema=None):
+        np = _get_numpy()
+        if np and len(email_texts) >= NUMPY_MIN_BATCH:
+            probabilities = self._batch_probabilities(np, email_texts)
+            best = probabilities.argmax(axis=1)
+            scored = zip(best.tolist(), probabilities[np.arange(len(email_texts)), best].tolist())
+        else:
+            scored = []
+            for email_text in email_texts:
+                probabilities = self._probabilities(self.vectorize(email_text))
+                best = max(range(len(probabilities)), key=probabilities.__getitem__)
+                scored.append((best, probabilities[best]))
+        predictions = []
+        rejected = 0
+        for best, probability in scored:
+            prediction = LocalPrediction(*self.labels[best], round(probability, 4), self.threshold)
+            if prediction.confident and self.result_errors(prediction, output_schema):
+                prediction.confident = False
+                rejected += 1
+            predictions.append(prediction)
+        self.stats["classified"] += len(predictions)
+        self.stats["confident"] += sum(prediction.confident for prediction in predictions)
+        self.stats["rejected"] += rejected
+        return predictions
+
+    def classify(self, email_text, output_schema=None):
+        return self.classify_batch([email_text], output_schema)[0]
+
+    # Train on (email_text, request_type, sub_request_type, main_intent) examples
+    @classmethod
+    def train(cls, examples, threshold=DEFAULT_CONFIDENCE_THRESHOLD, num_features=NUM_FEATURES, epochs=EPOCHS, seed=0):
+        labels, label_index, samples = [], {}, []
+        for email_text, request_type, sub_request_type, main_intent in examples:
+            key = (request_type, sub_request_type)
+            if key not in label_index:
+                label_index[key] = len(labels)
+                labels.append([request_type, sub_request_type, main_intent])
+            samples.append((_term_counts(email_text, num_features), label_index[key]))
+        if not samples:
+            raise ValueError("No training examples")
+
+        document_frequency = {}
+        for counts, _ in samples:
+            for index in counts:
+                document_frequency[index] = document_frequency.get(index, 0) + 1
+        idf = {index: math.log((1 + len(samples)) / (1 + df)) + 1.0 for index, df in document_frequency.items()}
+        model = cls(labels, {}, [0.0] * len(labels), idf, threshold, num_features)
+        vectors = [(model.vectorize_counts(counts), label) for counts, label in samples]
+
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(vectors)
+            rate = LEARNING_RATE / (1 + epoch * 0.1)
+            for vector, label in vectors:
+                probabilities = model._probabilities(vector)
+                for k, probability in enumerate(probabilities):
+                    gradient = probability - (k == label)
+                    model.bias[k] -= rate * gradient
+                    for index, value in vector.items():
+                        row = model.weights.setdefault(index, [0.0] * len(labels))
+                        row[k] -= rate * (gradient * value + L2 * row[k])
+        return model
+
+    # Lowest probability at which predictions on held-out examples were right at least
+    # target_precision of the time: each fold is scored by a model trained on the other folds.
+    # None when there are too few examples or no probability reaches the target.
+    @classmethod
+    def calibrate_threshold(cls, examples, folds=CALIBRATION_FOLDS, target_precision=TARGET_PRECISION, seed=0):
+        folds = min(folds, len(examples))
+        if folds < 2:
+            return None
+        order = list(range(len(examples)))
+        random.Random(seed).shuffle(order)
+        scored = []
+        for fold in range(folds):
+            held_out = order[fold::folds]
+            model = cls.train([examples[i] for i in order if i not in held_out], seed=seed)
+            for i, prediction in zip(held_out, model.classify_batch([examples[i][0] for i in held_out])):
+                scored.append((prediction.probability, [prediction.request_type, prediction.sub_request_type] == list(examples[i][1:3])))
+
+        scored.sort(key=lambda item: item[0], reverse=True)
+        threshold, correct = None, 0
+        for count, (probability, right) in enumerate(scored, 1):
+            correct += right
+            # Only between distinct probabilities: a threshold cannot split a tie
+            if (count == len(scored) or scored[count][0] < probability) and correct / count >= target_precision:
+                threshold = probability
+        return threshold
+
+    def save(self, path=MODEL_PATH):
+        model = {"labels": self.labels, "bias": self.bias, "num_features": self.num_features, "threshold": self.threshold,
+                 "idf": {str(index): value for index, value in self.idf.items()},
+                 "weights": {str(index): [round(weight, 6) for weight in row] for index, row in self.weights.items()}}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(model, f)
+        os.replace(tmp_path, path)
+
+    # Load a saved model with its calibrated threshold unless one is given; with config,
+    # predictions are limited to its request and sub-request types
+    @classmethod
+    def load(cls, path=MODEL_PATH, threshold=None, config=None):
+        with open(path, "r", encoding="utf-8") as f:
+            model = json.load(f)
+        config = config or {}
+        if threshold is None:
+            threshold = model.get("threshold", DEFAULT_CONFIDENCE_THRESHOLD)
+        return cls(model["labels"], {int(index): row for index, row in model["weights"].items()}, model["bias"],
+                   {int(index): value for index, value in model["idf"].items()}, threshold, model["num_features"],
+                   config.get("request_types"), config.get("sub_request_types"))
+
+# Labelled emails from Emails.csv (email text in the "email" column)
+def load_csv_examples(csv_path=TRAINING_CSV):
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        return [(f"{row.get('EmailSubject', '')}\n{row['email']}", row["request_type"], row["sub_request_type"], row.get("main_intent", ""))
+                for row in csv.DictReader(f) if row.get("email") and row.get("request_type")]
+
+# Labelled emails from DataSet details.xlsx: row N labels the "Email N_ ..." file next to the workbook
+def load_xlsx_examples(xlsx_path=TRAINING_XLSX):
+    import pandas as pd
+    from emailpipeline import read_email_file, SUPPORTED_EXTENSIONS
+    examples = []
+    for row in pd.read_excel(xlsx_path).fillna("").to_dict("records"):
+        files = [path for path in glob.glob(os.path.join(os.path.dirname(xlsx_path), f"Email {row.get('S.No')}_*"))
+                 if path.lower().endswith(SUPPORTED_EXTENSIONS)]
+        if files and row.get("Request Type"):
+            examples.append((read_email_file(files[0]), row["Request Type"], row.get("Sub-Request Type") or row["Request Type"],
+                             row.get("Intent", "")))
+    return examples
+
+# LLM-labelled emails from batchanalyzer JSONL output (the analyzed files are read again)
+def load_jsonl_examples(jsonl_path):
+    from emailpipeline import read_email_file
+    examples = []
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            result = record.get("result")
+            if result and "local_classifier" not in result and os.path.isfile(record.get("file", "")):
+                examples.append((read_email_file(record["file"]), result.get("request_type", ""), result.get("sub_request_type", ""),
+                                 result.get("main_intent", "")))
+    return examples
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the local pre-classifier and report its speed.")
+    parser.add_argument("--csv", default=TRAINING_CSV, help="Labelled emails CSV (Emails.csv layout)")
+    parser.add_argument("--xlsx", default=TRAINING_XLSX, help="Labelled dataset workbook (DataSet details.xlsx layout)")
+    parser.add_argument("--jsonl", action="append", default=[], help="batchanalyzer JSONL results to learn from (repeatable)")
+    parser.add_argument("--output", default=MODEL_PATH, help="Where to write the model")
+    parser.add_argument("--folds", type=int, default=CALIBRATION_FOLDS, help="Held-out folds for calibrating the confidence threshold")
+    args = parser.parse_args(argv)
+
+    examples = load_csv_examples(args.csv) if args.csv and os.path.isfile(args.csv) else []
+    if args.xlsx and os.path.isfile(args.xlsx):
+        try:
+            examples += load_xlsx_examples(args.xlsx)
+        except ImportError as e:
+            print(f"Skipping {args.xlsx}: {e}", file=sys.stderr)
+    for jsonl_path in args.jsonl:
+        examples += load_jsonl_examples(jsonl_path)
+
+    threshold = LocalClassifier.calibrate_threshold(examples, args.folds)
+    if threshold is None:
+        print(f"Too few examples to calibrate the threshold; using {DEFAULT_CONFIDENCE_THRESHOLD}.", file=sys.stderr)
+        threshold = DEFAULT_CONFIDENCE_THRESHOLD
+    model = LocalClassifier.train(examples, threshold)
+    model.save(args.output)
+
+    from emailpipeline import load_config
+    known = set(load_config().get("request_types", []))
+    unknown = sorted({label[0] for label in model.labels} - known)
+    if unknown:
+        print(f"Note: request types not in config.json: {', '.join(unknown)}", file=sys.stderr)
+
+    texts = [example[0] for example in examples] * max(1, 2000 // len(examples))
+    start = time.perf_counter()
+    model.classify_batch(texts)
+    elapsed = time.perf_counter() - start
+    print(f"Trained on {len(examples)} email(s), {len(model.labels)} label(s); confidence threshold {threshold}; "
+          f"scores {len(texts) / elapsed:.0f} emails/s.", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
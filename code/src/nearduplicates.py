@@ -0,0 +1,275 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+
+# Get the directory of the currently running Python script
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Default near-duplicate index database, next to this script
+NEAR_DUPLICATE_PATH = os.path.join(script_dir, "near_duplicates.sqlite")
+
+# Estimated Jaccard similarity above which an email counts as a near-duplicate
+DEFAULT_SIMILARITY_THRESHOLD = 0.9
+
+# MinHash signature length and word shingle size (_bins hashes shingles of exactly this many words)
+NUM_HASHES = 128
+SHINGLE_SIZE = 3
+
+# Words shingled per email: a longer email is shingled on runs of SAMPLE_RUN_TOKENS words spread
+# evenly over the whole text, which keeps the signature cost flat for long attachments while a
+# difference anywhere (the same cover text over another attachment) still lowers the similarity
+MAX_SHINGLE_TOKENS = 1000
+SAMPLE_RUN_TOKENS = 50
+
+# Bumped whenever the signature of a text changes; indexed signatures of another version are ignored
+SIGNATURE_VERSION = 2
+
+_MASK_64 = (1 << 64) - 1
+_DENSIFY_OFFSET = 0x9E3779B97F4A7C15  # Keeps borrowed values apart from the bin's own ones
+
+# Masks every ASCII digit (bytes.translate, much cheaper than a regex substitution)
+_DIGITS_TO_ZERO = bytes.maketrans(b"123456789", b"000000000")
+
+# UTF-8 words of a preprocessed email with digits masked, so notices that only differ in dates,
+# amounts or identifiers shingle the same; returns (words, run_length), where run_length is the
+# length of the sampled runs of a long email (None when every word is kept)
+def _tokens(clean_email_text):
+    tokens = clean_email_text.lower().encode("utf-8").translate(_DIGITS_TO_ZERO, b"*").split()
+    if len(tokens) <= MAX_SHINGLE_TOKENS:
+        return tokens, None
+    # Run starts scale with the length, so an edit moves each run by a word or so at most
+    runs = MAX_SHINGLE_TOKENS // SAMPLE_RUN_TOKENS
+    step = (len(tokens) - SAMPLE_RUN_TOKENS) / (runs - 1)
+    sampled = []
+    for run in range(runs):
+        start = round(run * step)
+        sampled += tokens[start:start + SAMPLE_RUN_TOKENS]
+    return sampled, SAMPLE_RUN_TOKENS
+
+# Odd multipliers of the first two word hashes of a shingle, so word order matters
+_FIRST_FACTOR = 0x9E3779B97F4A7C15
+_SECOND_FACTOR = 0xC2B2AE3D27D4EB4F
+
+# 64-bit hash of every word, each distinct word hashed once
+def _word_hashes(tokens):
+    known = {}
+    hashes = []
+    for token in tokens:
+        value = known.get(token)
+        if value is None:
+            value = known[token] = int.from_bytes(hashlib.blake2b(token, digest_size=8).digest(), "little")
+        hashes.append(value)
+    return hashes
+
+# Shingles below which the arrays cost more to set up than the plain loop
+NUMPY_MIN_SHINGLES = 64
+
+_numpy = None
+
+# numpy when installed (shingle hashes and bin minimums are then computed on arrays), else False
+def _get_numpy():
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy
+
+# Minimum per bin of the shingle hashes (None for an empty bin). A shingle hash combines its three
+# word hashes, first * _FIRST_FACTOR + second * _SECOND_FACTOR + third (mod 2**64), so each word
+# is hashed once instead of every shingle; a text shorter than a shingle is one padded shingle.
+# With run_length, the words are consecutive runs of that length and shingles across runs are skipped.
+def _bins(word_hashes, num_hashes, run_length=None):
+    if not word_hashes:
+        return [None] * num_hashes
+    words = word_hashes + [0] * (SHINGLE_SIZE - len(word_hashes))
+    np = _get_numpy()
+    if np and len(words) >= NUMPY_MIN_SHINGLES:
+        words = np.array(words, dtype=np.uint64)
+        # uint64 products and sums wrap around like & _MASK_64
+        values = words[:-2] * np.uint64(_FIRST_FACTOR) + words[1:-1] * np.uint64(_SECOND_FACTOR) + words[2:]
+        if run_length:
+            values = values[np.arange(len(values)) % run_length <= run_length - SHINGLE_SIZE]
+        empty = np.iinfo(np.uint64).max  # Above any value // num_hashes
+        bins = np.full(num_hashes, empty, dtype=np.uint64)
+        np.minimum.at(bins, (values % np.uint64(num_hashes)).astype(np.intp), values // np.uint64(num_hashes))
+        return [None if value == empty else value for value in bins.tolist()]
+    bins = [None] * num_hashes
+    shingles = zip(words, words[1:], words[2:])
+    if run_length:
+        shingles = (shingle for start, shingle in enumerate(shingles) if start % run_length <= run_length - SHINGLE_SIZE)
+    # Repeated shingles only count once
+    for value in {(first * _FIRST_FACTOR + second * _SECOND_FACTOR + third) & _MASK_64 for first, second, third in shingles}:
+        index = value % num_hashes
+        value //= num_hashes
+        if bins[index] is None or value < bins[index]:
+            bins[index] = value
+    return bins
+
+# MinHash signature by one-permutation hashing: every shingle is hashed once into one of
+# num_hashes bins, each bin keeps its minimum, and empty bins borrow from the next full one
+def minhash_signature(clean_email_text, num_hashes=NUM_HASHES):
+    tokens, run_length = _tokens(clean_email_text)
+    bins = _bins(_word_hashes(tokens), num_hashes, run_length)
+    if all(value is None for value in bins):
+        return [0] * num_hashes
+    for index in range(num_hashes):
+        distance = 1
+        while bins[index] is None:
+            source = bins[(index + distance) % num_hashes]
+            if source is not None:
+                bins[index] = (source + distance * _DENSIFY_OFFSET) & _MASK_64
+            distance += 1
+    return bins
+
+def signature_similarity(a, b):
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+# Bands and rows per band for a threshold: the widest bands whose LSH S-curve still rises
+# below the threshold (candidates are verified against the threshold afterwards)
+def lsh_params(threshold, num_hashes=NUM_HASHES):
+    bands, rows = num_hashes, 1
+    for candidate_rows in range(2, num_hashes + 1):
+        if num_hashes % candidate_rows == 0 and (candidate_rows / num_hashes) ** (1 / candidate_rows) <= threshold:
+            bands, rows = num_hashes // candidate_rows, candidate_rows
+    return bands, rows
+
+class NearDuplicateMatch:
+    """Closest previously classified email above the similarity threshold."""
+
+    def __init__(self, doc_id, sr_number, result, similarity):
+        self.doc_id = doc_id
+        self.sr_number = sr_number
+        self.result = result
+        self.similarity = similarity
+
+class NearDuplicateIndex:
+    """MinHash + LSH index of classified emails, persisted in SQLite and held in memory for lookups.
+
+    `match` finds an earlier email whose estimated Jaccard similarity to this one (over word
+    shingles of the preprocessed text, digits masked) is at least `threshold`, so its
+    classification and SR number can be reused instead of calling the LLM again. Emails
+    indexed with another SIGNATURE_VERSION stay in the database but are not matched (run
+    the backfill again to index them).
+    """
+
+    def __init__(self, path=NEAR_DUPLICATE_PATH, threshold=DEFAULT_SIMILARITY_THRESHOLD, num_hashes=NUM_HASHES):
+        self.path = path
+        self.threshold = threshold
+        self.num_hashes = num_hashes
+        self.bands, self.rows = lsh_params(threshold, num_hashes)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_id INTEGER PRIMARY KEY,
+                sr_number TEXT NOT NULL,
+                result TEXT NOT NULL,
+                signature BLOB NOT NULL,
+                created REAL NOT NULL,
+                version INTEGER NOT NULL DEFAULT 1
+            )""")
+        if "version" not in [row[1] for row in self.conn.execute("PRAGMA table_info(documents)")]:
+            self.conn.execute("ALTER TABLE documents ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+        self.conn.commit()
+        self.signatures = {}
+        self.buckets = {}
+        self.stats = {"lookups": 0, "candidates": 0, "matches": 0}
+        for doc_id, blob in self.conn.execute("SELECT doc_id, signature FROM documents WHERE version = ?", (SIGNATURE_VERSION,)):
+            signature = list(struct.unpack(f"<{len(blob) // 8}Q", blob))
+            if len(signature) == num_hashes:
+                self._index(doc_id, signature)
+
+    def _band_keys(self, signature):
+        return [(band, tuple(signature[band * self.rows:(band + 1) * self.rows])) for band in range(self.bands)]
+
+    def _index(self, doc_id, signature):
+        self.signatures[doc_id] = signature
+        for key in self._band_keys(signature):
+            self.buckets.setdefault(key, []).append(doc_id)
+
+    # Most similar indexed email at or above the threshold, or None
+    def match(self, clean_email_text):
+        signature = minhash_signature(clean_email_text, self.num_hashes)
+        with self.lock:
+            self.stats["lookups"] += 1
+            candidates = {doc_id for key in self._band_keys(signature) for doc_id in self.buckets.get(key, ())}
+            self.stats["candidates"] += len(candidates)
+            best_id, best_similarity = None, self.threshold
+            for doc_id in candidates:
+                similarity = signature_similarity(signature, self.signatures[doc_id])
+                if similarity >= best_similarity:
+                    best_id, best_similarity = doc_id, similarity
+            if best_id is None:
+                return None
+            self.stats["matches"] += 1
+            sr_number, result = self.conn.execute("SELECT sr_number, result FROM documents WHERE doc_id = ?", (best_id,)).fetchone()
+        return NearDuplicateMatch(best_id, sr_number, json.loads(result), round(best_similarity, 3))
+
+    # Index one classified email; returns its doc_id
+    def add(self, clean_email_text, sr_number, result):
+        return self.build([(clean_email_text, sr_number, result)])[0]
+
+    # Bulk-build: index many (clean_email_text, sr_number, result) tuples in a single transaction
+    def build(self, items):
+        doc_ids = []
+        now = time.time()
+        with self.lock:
+            for clean_email_text, sr_number, result in items:
+                signature = minhash_signature(clean_email_text, self.num_hashes)
+                cursor = self.conn.execute("INSERT INTO documents (sr_number, result, signature, created, version) VALUES (?, ?, ?, ?, ?)",
+                                           (sr_number, json.dumps(result), struct.pack(f"<{len(signature)}Q", *signature), now,
+                                            SIGNATURE_VERSION))
+                self._index(cursor.lastrowid, signature)
+                doc_ids.append(cursor.lastrowid)
+            self.conn.commit()
+        return doc_ids
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+# Backfill the index from batchanalyzer JSONL output: each analyzed file is read again for its text
+def backfill_from_jsonl(index, jsonl_paths, attachment_pool=None):
+    import emailpipeline
+    items, skipped = [], 0
+    for jsonl_path in jsonl_paths:
+        with open(jsonl_path, "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                result = record.get("result")
+                if not result or not os.path.isfile(record.get("file", "")):
+                    skipped += 1
+                    continue
+                clean_email_text = emailpipeline.preprocess_email(emailpipeline.read_email_file(record["file"], attachment_pool))
+                sr_number = result.get("sr_number", "").replace("Duplicate/Follow-up - ", "")
+                result = {key: value for key, value in result.items() if key not in ("sr_number", "token_usage", "thread", "near_duplicate")}
+                items.append((clean_email_text, sr_number, result))
+    index.build(items)
+    return len(items), skipped
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill the near-duplicate index from batchanalyzer JSONL results.")
+    parser.add_argument("jsonl", nargs="+", help="JSONL files written by batchanalyzer.py --jsonl")
+    parser.add_argument("--index", default=NEAR_DUPLICATE_PATH, help="Near-duplicate index database")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_SIMILARITY_THRESHOLD, help="Similarity threshold")
+    args = parser.parse_args(argv)
+
+    index = NearDuplicateIndex(args.index, args.threshold)
+    start = time.perf_counter()
+    added, skipped = backfill_from_jsonl(index, args.jsonl)
+    print(f"Indexed {added} email(s), skipped {skipped}, {len(index.signatures)} in index ({time.perf_counter() - start:.1f}s).", file=sys.stderr)
+    index.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import instrumentation
+from utilities.Utilities import split_thread_segments
+
+# Default number of prompt tokens the email content may use
+DEFAULT_TOKEN_BUDGET = 8000
+
+# Size of the attachment chunks summarized in the map step
+DEFAULT_CHUNK_TOKENS = 3000
+
+# Parallel summarization calls per email (rate limits still apply through the dispatcher)
+MAP_WORKERS = 4
+
+# Share of the budget the headers may take before they are truncated
+HEADER_SHARE = 0.05
+
+# Share of the remaining budget kept for quoted history when attachments compete for it
+QUOTED_SHARE = 0.2
+
+SUMMARY_PROMPT = """
+You are summarizing part of an attachment to an email received by a commercial bank lending service team.
+Keep every amount, date, rate, party name, deal/facility name, identifier (CUSIP, ISIN, MEI, ABA, account
+and loan numbers) and requested action. Drop boilerplate and legal text. Answer with the summary only.
+"""
+
+REDUCE_PROMPT = """
+Combine these partial summaries of one attachment into a single concise summary.
+Keep every amount, date, rate, party name, identifier and requested action. Answer with the summary only.
+"""
+
+_encoding = None
+
+# Token counter for the chat model: tiktoken when installed, otherwise ~4 characters per token
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = False
+    return _encoding
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+# First max_tokens tokens of text
+def _head(text, max_tokens):
+    encoding = _get_encoding()
+    if encoding:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    return text[:max_tokens * 4]
+
+# Cut text down to at most max_tokens tokens, keeping the beginning
+def truncate_tokens(text, max_tokens):
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    return _head(text, max_tokens) + " [...]"
+
+# Split text into consecutive pieces of at most chunk_tokens tokens, preferring line breaks
+def chunk_text(text, chunk_tokens):
+    chunks, current, current_tokens = [], [], 0
+    for line in text.splitlines(keepends=True):
+        line_tokens = count_tokens(line)
+        if current and current_tokens + line_tokens > chunk_tokens:
+            chunks.append("".join(current))
+            current, current_tokens = [], 0
+        while line_tokens > chunk_tokens:  # A single huge line is cut hard
+            head = _head(line, chunk_tokens)
+            chunks.append(head)
+            line = line[len(head):]
+            line_tokens = count_tokens(line)
+        current.append(line)
+        current_tokens += line_tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+class TokenUsage:
+    """Per-email token accounting across the classification call and any summarization calls."""
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.summary_prompt_tokens = 0
+        self.summary_completion_tokens = 0
+        self.llm_calls = 0
+        self.summarized_attachments = 0
+        self.repairs = 0
+        self.prompt_prefix_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.cached = False
+        self.lock = threading.Lock()
+
+    # Add the usage of one model call, from the response metadata when present, else estimated
+    # (repair calls count as classification tokens and are also counted in `repairs`)
+    def add(self, messages, response, summary=False, repair=False):
+        prompt_tokens, completion_tokens = response_token_usage(response)
+        cached_prompt_tokens = response_cached_tokens(response)
+        if prompt_tokens is None:
+            prompt_tokens = sum(count_tokens(message.content) for message in messages)
+            completion_tokens = count_tokens(response.content)
+        with self.lock:
+            if summary:
+                self.summary_prompt_tokens += prompt_tokens
+                self.summary_completion_tokens += completion_tokens
+            else:
+                self.prompt_tokens += prompt_tokens
+                self.completion_tokens += completion_tokens
+            self.cached_prompt_tokens += cached_prompt_tokens
+            self.llm_calls += 1
+            self.repairs += repair
+        kind = "summary" if summary else "repair" if repair else "classify"
+        instrumentation.count("tokens", prompt_tokens, direction="in", call=kind)
+        instrumentation.count("tokens", completion_tokens, direction="out", call=kind)
+        instrumentation.count("cached_prompt_tokens", cached_prompt_tokens)
+
+    def to_dict(self):
+        with self.lock:
+            total = self.prompt_tokens + self.completion_tokens + self.summary_prompt_tokens + self.summary_completion_tokens
+            return {"prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens,
+                    "summary_prompt_tokens": self.summary_prompt_tokens, "summary_completion_tokens": self.summary_completion_tokens,
+                    "total_tokens": total, "llm_calls": self.llm_calls, "summarized_attachments": self.summarized_attachments,
+                    "repairs": self.repairs, "prompt_prefix_tokens": self.prompt_prefix_tokens,
+                    "cached_prompt_tokens": self.cached_prompt_tokens, "cached": self.cached}
+
+# (prompt_tokens, completion_tokens) reported by a LangChain chat response, or (None, None)
+def response_token_usage(response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage and "input_tokens" in usage:
+        return usage["input_tokens"], usage.get("output_tokens", 0)
+    token_usage = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+    if "prompt_tokens" in token_usage:
+        return token_usage["prompt_tokens"], token_usage.get("completion_tokens", 0)
+    return None, None
+
+# Prompt tokens the provider served from its prompt cache, as reported by the response (0 when not reported)
+def response_cached_tokens(response):
+    usage = getattr(response, "usage_metadata", None) or {}
+    if "input_token_details" in usage:
+        return (usage["input_token_details"] or {}).get("cache_read", 0) or 0
+    token_usage = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+    return (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0) or 0
+
+# Split ReadEmailContent output into headers, body and (filename, text) attachments
+def split_email_sections(email_text):
+    header, body, attachments = "", email_text, []
+    body_match = re.search(r"\bEmailBody: ", email_text)
+    if email_text.startswith("Subject: ") and body_match:
+        header = email_text[:body_match.start()].rstrip(", ")
+        body = email_text[body_match.end():]
+    marker = body.find(", Attachment Content:")
+    if marker != -1:
+        attachment_text = body[marker + len(", Attachment Content:"):]
+        body = body[:marker]
+        for part in re.split(r"\n(?=Filename: )", attachment_text):
+            part = part.strip()
+            if not part:
+                continue
+            name_match = re.match(r"Filename: ([^\n]*)\nContent:\n?", part)
+            if name_match:
+                attachments.append((name_match.group(1), part[name_match.end():]))
+            else:
+                attachments.append(("", part))
+    return header, body.strip(), attachments
+
+# Inverse of split_email_sections: put headers, body and attachments back into one text
+def join_email_sections(header, body, attachments):
+    email_text = f"{header}, EmailBody: {body}" if header else body
+    if attachments:
+        attachment_text = "\n".join(f"Filename: {name}\nContent:\n{text}" for name, text in attachments)
+        email_text += f", Attachment Content:\n{attachment_text}"
+    return email_text
+
+# Summarize one oversized attachment into roughly target_tokens: summarize each chunk, then combine
+def summarize_attachment(text, target_tokens, llm, usage, chunk_tokens=DEFAULT_CHUNK_TOKENS):
+    from langchain.schema import SystemMessage, HumanMessage
+
+    def call(prompt, content):
+        messages = [SystemMessage(content=prompt), HumanMessage(content=content)]
+        response = llm(messages)
+        usage.add(messages, response, summary=True)
+        return response.content.strip()
+
+    chunks = chunk_text(text, chunk_tokens)
+    with ThreadPoolExecutor(max_workers=MAP_WORKERS) as executor:
+        summaries = list(executor.map(lambda chunk: call(SUMMARY_PROMPT, chunk), chunks))
+    combined = "\n".join(summaries)
+    while count_tokens(combined) > target_tokens and len(summaries) > 1:
+        groups = chunk_text(combined, chunk_tokens)
+        if len(groups) >= len(summaries):  # No progress possible, fall back to truncation
+            break
+        summaries = [call(REDUCE_PROMPT, group) for group in groups]
+        combined = "\n".join(summaries)
+    # Attachments of one email may be summarized on several threads
+    with usage.lock:
+        usage.summarized_attachments += 1
+    return truncate_tokens(combined, target_tokens)
+
+# Rebuild the email text so it fits token_budget: headers first, then the latest message,
+# then attachments (summarized when they do not fit) and whatever quoted history still fits
+def fit_email_to_budget(clean_email_text, token_budget, llm, usage, chunk_tokens=DEFAULT_CHUNK_TOKENS):
+    if count_tokens(clean_email_text) <= token_budget:
+        return clean_email_text
+
+    header, body, attachments = split_email_sections(clean_email_text)
+    segments = split_thread_segments(body) if body else [""]
+    latest, quoted = segments[0], "\n".join(segments[1:])
+
+    header = truncate_tokens(header, int(token_budget * HEADER_SHARE))
+    remaining = token_budget - count_tokens(header)
+    latest = truncate_tokens(latest, remaining)
+    remaining -= count_tokens(latest)
+
+    attachment_tokens = [count_tokens(text) for _, text in attachments]
+    quoted_reserve = min(count_tokens(quoted), int(remaining * QUOTED_SHARE)) if attachments else remaining
+    attachment_budget = remaining - quoted_reserve
+
+    fitted_attachments = []
+    if sum(attachment_tokens) <= attachment_budget:
+        fitted_attachments = [(name, text) for name, text in attachments]
+    elif attachments:
+        # Attachments that fit their fair share go in verbatim; the rest are summarized into it
+        share = attachment_budget // len(attachments)
+        for (name, text), tokens in zip(attachments, attachment_tokens):
+            if tokens <= share:
+                fitted_attachments.append((name, text))
+            else:
+                fitted_attachments.append((name, "[Summary] " + summarize_attachment(text, share, llm, usage, chunk_tokens)))
+
+    remaining -= count_tokens(join_email_sections("", "", fitted_attachments))
+    quoted = truncate_tokens(quoted, remaining)
+
+    body_text = "\n".join(part for part in (latest, quoted) if part)
+    return join_email_sections(header, body_text, fitted_attachments)
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import instrumentation
+
+# Get the directory of the currently running Python script
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Default cache database, next to this script
+CACHE_PATH = os.path.join(script_dir, "analysis_cache.sqlite")
+
+# Build the content address of an analysis: email text plus everything that shapes the answer
+def cache_key(clean_email_text, prompt_version, model, temperature):
+    digest = hashlib.sha256()
+    for part in (prompt_version, model, repr(float(temperature)), clean_email_text):
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class ResultCache:
+    """Persistent SQLite cache of parsed LLM responses, keyed by `cache_key`.
+
+    Entries older than `ttl_seconds` are treated as misses and purged; once more than
+    `max_entries` are stored, the least recently used ones are evicted.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=10000, ttl_seconds=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+        self.conn.commit()
+
+    def _expired(self, created, now):
+        return self.ttl_seconds is not None and now - created > self.ttl_seconds
+
+    # Return the cached response for key, or None on a miss
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value, created FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None or self._expired(row[1], now):
+                if row is not None:
+                    self.conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                    self.conn.commit()
+                self.misses += 1
+                instrumentation.count("cache_lookups", result="miss")
+                return None
+            self.conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+            instrumentation.count("cache_lookups", result="hit")
+            return json.loads(row[0])
+
+    # Store a response and apply the eviction policy
+    def put(self, key, value):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO results (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                              (key, json.dumps(value), now, now))
+            self._evict(now)
+            self.conn.commit()
+
+    def _evict(self, now):
+        if self.ttl_seconds is not None:
+            self.conn.execute("DELETE FROM results WHERE created < ?", (now - self.ttl_seconds,))
+        if self.max_entries:
+            self.conn.execute("""
+                DELETE FROM results WHERE key IN (
+                    SELECT key FROM results ORDER BY accessed DESC LIMIT -1 OFFSET ?
+                )""", (self.max_entries,))
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "entries": len(self)}
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM results")
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
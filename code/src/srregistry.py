@@ -0,0 +1,164 @@
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+# Get the directory of the currently running Python script
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Default SR registry database, next to this script
+SR_REGISTRY_PATH = os.path.join(script_dir, "sr_registry.sqlite")
+
+# Characters of the 6-character SR suffix (the format check_existing_sr_number matches)
+SUFFIX_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+SUFFIX_LENGTH = 6
+
+# Seconds a writer waits for another process holding the database lock
+BUSY_TIMEOUT = 30
+
+# Hash of a preprocessed email, the key exact resubmissions are found by
+def content_hash(clean_email_text):
+    return hashlib.sha256(clean_email_text.encode("utf-8")).hexdigest()
+
+# Suffix for the n-th SR of a minute: base 36, scrambled by a fixed odd multiplier so that
+# consecutive numbers do not look sequential (a bijection on the 36^6 suffixes, so still unique)
+def _suffix(sequence):
+    value = (sequence * 0x5DEECE66D) % (len(SUFFIX_ALPHABET) ** SUFFIX_LENGTH)
+    chars = []
+    for _ in range(SUFFIX_LENGTH):
+        value, digit = divmod(value, len(SUFFIX_ALPHABET))
+        chars.append(SUFFIX_ALPHABET[digit])
+    return "".join(reversed(chars))
+
+class SRRecord:
+    """A service request in the registry and the classification it was opened with."""
+
+    def __init__(self, sr_number, thread_id, result, created):
+        self.sr_number = sr_number
+        self.thread_id = thread_id
+        self.result = result
+        self.created = created
+
+    def to_dict(self):
+        return {"sr_number": self.sr_number, "thread_id": self.thread_id, "result": self.result, "created": self.created}
+
+class SRRegistry:
+    """Persistent registry of issued SR numbers, with every analyzed email indexed by content hash.
+
+    SR numbers keep the SR-DDMMYYYY-HHMM-XXXXXX format, but the suffix comes from a per-minute
+    counter incremented in an immediate transaction, so any number of threads and processes
+    sharing the database never issue the same number. Lookups by SR number, thread ID and
+    content hash go through indexes.
+    """
+
+    def __init__(self, path=SR_REGISTRY_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        # Autocommit mode, so allocation can take the write lock with BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS service_requests (
+                sr_number TEXT PRIMARY KEY,
+                thread_id TEXT,
+                result TEXT,
+                created REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS service_requests_thread ON service_requests (thread_id);
+            CREATE TABLE IF NOT EXISTS emails (
+                content_hash TEXT PRIMARY KEY,
+                sr_number TEXT NOT NULL,
+                created REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS emails_sr_number ON emails (sr_number);
+            CREATE TABLE IF NOT EXISTS sr_sequence (
+                minute TEXT PRIMARY KEY,
+                last INTEGER NOT NULL
+            );
+        """)
+        self.stats = {"allocated": 0, "lookups": 0, "found": 0}
+
+    # Issue a new SR number (atomic across threads and processes)
+    def allocate(self, thread_id=None):
+        minute = datetime.datetime.now().strftime("%d%m%Y-%H%M")
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("INSERT INTO sr_sequence (minute, last) VALUES (?, 1) "
+                                  "ON CONFLICT (minute) DO UPDATE SET last = last + 1", (minute,))
+                sequence = self.conn.execute("SELECT last FROM sr_sequence WHERE minute = ?", (minute,)).fetchone()[0]
+                sr_number = f"SR-{minute}-{_suffix(sequence)}"
+                self.conn.execute("INSERT INTO service_requests (sr_number, thread_id, created) VALUES (?, ?, ?)",
+                                  (sr_number, thread_id, time.time()))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.stats["allocated"] += 1
+        return sr_number
+
+    def _record(self, row):
+        return SRRecord(row[0], row[1], json.loads(row[2]) if row[2] else None, row[3]) if row else None
+
+    def _lookup(self, query, value):
+        with self.lock:
+            self.stats["lookups"] += 1
+            row = self.conn.execute(query, (value,)).fetchone()
+            self.stats["found"] += row is not None
+        return self._record(row)
+
+    # The SR with this number, or None
+    def lookup(self, sr_number):
+        return self._lookup("SELECT sr_number, thread_id, result, created FROM service_requests WHERE sr_number = ?", sr_number)
+
+    # The SR opened for this thread, or None
+    def find_by_thread(self, thread_id):
+        return self._lookup("SELECT sr_number, thread_id, result, created FROM service_requests WHERE thread_id = ? "
+                            "ORDER BY created LIMIT 1", thread_id)
+
+    # The SR an identical email was filed under, or None
+    def find_by_content(self, content_hash):
+        return self._lookup("SELECT s.sr_number, s.thread_id, s.result, s.created FROM emails e "
+                            "JOIN service_requests s ON s.sr_number = e.sr_number WHERE e.content_hash = ?", content_hash)
+
+    # File an analyzed email under its SR; the SR keeps the classification of the email that opened it
+    def record(self, content_hash, sr_number, result, thread_id=None):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("INSERT OR IGNORE INTO service_requests (sr_number, created) VALUES (?, ?)", (sr_number, time.time()))
+                self.conn.execute("UPDATE service_requests SET result = COALESCE(result, ?), thread_id = COALESCE(thread_id, ?) "
+                                  "WHERE sr_number = ?", (json.dumps(result), thread_id, sr_number))
+                self.conn.execute("INSERT OR IGNORE INTO emails (content_hash, sr_number, created) VALUES (?, ?, ?)",
+                                  (content_hash, sr_number, time.time()))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Look up service requests in the SR registry.")
+    parser.add_argument("sr_numbers", nargs="*", help="SR numbers to show")
+    parser.add_argument("--thread", action="append", default=[], help="Show the SR of this thread ID (repeatable)")
+    parser.add_argument("--registry", default=SR_REGISTRY_PATH, help="SR registry database")
+    args = parser.parse_args(argv)
+
+    registry = SRRegistry(args.registry)
+    records = [registry.lookup(sr_number) for sr_number in args.sr_numbers]
+    records += [registry.find_by_thread(thread_id) for thread_id in args.thread]
+    for query, record in zip(args.sr_numbers + args.thread, records):
+        print(json.dumps(record.to_dict() if record else {"query": query, "error": "not found"}))
+    registry.close()
+    return 0 if all(records) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
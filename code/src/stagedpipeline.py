@@ -0,0 +1,233 @@
+import queue
+import threading
+import time
+
+# How often blocked threads check whether the pipeline was abandoned
+POLL_INTERVAL = 0.1
+
+# Marks the end of the input on a stage queue (one per worker)
+_DONE = object()
+
+class _Failure:
+    """An exception raised by a stage, carried past the remaining stages to the consumer."""
+
+    def __init__(self, exc):
+        self.exc = exc
+
+class Stage:
+    """One pipeline step: `workers` threads applying `func` to items taken from a bounded queue.
+
+    With `batch_size`, `func` takes a list of up to that many values and returns their results in
+    order: a worker takes the next item and whatever else is already queued behind it, so batches
+    fill up when the following stage is the slower one and nothing waits for a batch to fill.
+    The queue depth is sampled on every put and get, so the stats report its time-weighted mean
+    and maximum along with the share of the workers' time spent inside `func`.
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=None, batch_size=None):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size or 2 * workers * (batch_size or 1))
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.depth = 0
+        self.max_depth = 0
+        self.depth_area = 0.0
+        self.depth_updated = time.monotonic()
+        self.running = workers
+
+    def _sample_depth(self):
+        with self.lock:
+            now = time.monotonic()
+            self.depth_area += self.depth * (now - self.depth_updated)
+            self.depth_updated = now
+            self.depth = self.queue.qsize()
+            self.max_depth = max(self.max_depth, self.depth)
+
+    # Queue an item, waiting for room; returns False when the pipeline was abandoned
+    def put(self, item, stopping):
+        while not stopping.is_set():
+            try:
+                self.queue.put(item, timeout=POLL_INTERVAL)
+            except queue.Full:
+                continue
+            self._sample_depth()
+            return True
+        return False
+
+    def get(self, stopping):
+        while not stopping.is_set():
+            try:
+                item = self.queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            self._sample_depth()
+            return item
+        return _DONE
+
+    # The next queued items, up to batch_size without waiting past the first, and whether the input ended
+    def get_batch(self, stopping):
+        item = self.get(stopping)
+        if item is _DONE:
+            return [], True
+        batch = [item]
+        while len(batch) < (self.batch_size or 1):
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self._sample_depth()
+            if item is _DONE:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    # Run func on one value (values that already failed upstream pass through)
+    def run(self, value):
+        if isinstance(value, _Failure):
+            return value
+        start = time.perf_counter()
+        try:
+            value = self.func(value)
+        except BaseException as e:
+            # Also KeyboardInterrupt/SystemExit: re-raised by the consumer instead of killing this worker
+            value = _Failure(e)
+        with self.lock:
+            self.busy_seconds += time.perf_counter() - start
+            self.processed += 1
+            self.errors += isinstance(value, _Failure)
+        return value
+
+    # Run func on a batch of values (an exception fails every value of the batch)
+    def run_batch(self, values):
+        if self.batch_size is None:
+            return [self.run(value) for value in values]
+        pending = [index for index, value in enumerate(values) if not isinstance(value, _Failure)]
+        if not pending:
+            return values
+        values = list(values)
+        start = time.perf_counter()
+        try:
+            results = self.func([values[index] for index in pending])
+        except BaseException as e:
+            results = [_Failure(e)] * len(pending)
+        for index, result in zip(pending, results):
+            values[index] = result
+        with self.lock:
+            self.busy_seconds += time.perf_counter() - start
+            self.processed += len(pending)
+            self.errors += sum(isinstance(result, _Failure) for result in results)
+        return values
+
+    def stats(self, elapsed):
+        self._sample_depth()
+        with self.lock:
+            return {"workers": self.workers, "processed": self.processed, "errors": self.errors,
+                    "queue_size": self.queue.maxsize, "queue_depth": self.depth, "max_queue_depth": self.max_depth,
+                    "mean_queue_depth": round(self.depth_area / elapsed, 2) if elapsed else 0.0,
+                    "busy_seconds": round(self.busy_seconds, 3),
+                    "utilization": round(self.busy_seconds / (self.workers * elapsed), 3) if elapsed else 0.0}
+
+class StagedPipeline:
+    """Runs items through a chain of stages, each with its own worker threads and bounded queue.
+
+    Stages overlap: while one email waits on the LLM, the next ones are already being parsed.
+    Items in flight are capped by the queue sizes and worker counts, so a slow stage holds the
+    earlier ones back instead of letting work pile up in memory. `imap` yields the results in
+    input order and raises the first stage exception it reaches.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.started = None
+        self.finished = None
+
+    # Per-stage queue depth, utilization and counts for the current or last run
+    def stats(self):
+        if self.started is None:
+            return {}
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return {stage.name: stage.stats(elapsed) for stage in self.stages}
+
+    def imap(self, items):
+        stopping = threading.Event()
+        # Results waiting for an earlier item count as in flight, so the reorder buffer is bounded too
+        in_flight = threading.Semaphore(sum(stage.queue.maxsize + stage.workers * (stage.batch_size or 1) for stage in self.stages))
+        results = {}
+        done = threading.Condition()
+        fed = {"count": None, "error": None}
+
+        def feed():
+            count = 0
+            try:
+                for item in items:
+                    while not in_flight.acquire(timeout=POLL_INTERVAL):
+                        if stopping.is_set():
+                            return
+                    if not self.stages[0].put((count, item), stopping):
+                        return
+                    count += 1
+            except Exception as e:
+                fed["error"] = e
+            finally:
+                with done:
+                    fed["count"] = count
+                    done.notify_all()
+                for _ in range(self.stages[0].workers):
+                    self.stages[0].put(_DONE, stopping)
+
+        def work(index):
+            stage = self.stages[index]
+            following = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            finished = False
+            while not finished:
+                batch, finished = stage.get_batch(stopping)
+                values = stage.run_batch([value for _, value in batch])
+                for (sequence, _), value in zip(batch, values):
+                    if following is None:
+                        with done:
+                            results[sequence] = value
+                            done.notify_all()
+                    elif not following.put((sequence, value), stopping):
+                        return
+            # The last worker of a stage to finish ends the next stage
+            with stage.lock:
+                stage.running -= 1
+                last = stage.running == 0
+            if last and following is not None:
+                for _ in range(following.workers):
+                    following.put(_DONE, stopping)
+
+        for stage in self.stages:
+            stage.running = stage.workers
+        self.started = time.monotonic()
+        self.finished = None
+        threads = [threading.Thread(target=feed, name="pipeline-feed", daemon=True)]
+        threads += [threading.Thread(target=work, args=(index,), name=f"pipeline-{stage.name}-{n}", daemon=True)
+                    for index, stage in enumerate(self.stages) for n in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            sequence = 0
+            while True:
+                with done:
+                    while sequence not in results and (fed["count"] is None or sequence < fed["count"]):
+                        done.wait()
+                    if sequence not in results:
+                        break
+                    value = results.pop(sequence)
+                in_flight.release()
+                if isinstance(value, _Failure):
+                    raise value.exc
+                yield value
+                sequence += 1
+            if fed["error"] is not None:
+                raise fed["error"]
+        finally:
+            # Also reached when the consumer stops early: release every blocked thread
+            stopping.set()
+            self.finished = time.monotonic()
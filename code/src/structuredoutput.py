@@ -0,0 +1,266 @@
+import hashlib
+import json
+import re
+import instrumentation
+
+# Repair round trips allowed after the first reply before the email is reported as failed
+DEFAULT_MAX_REPAIRS = 2
+
+# Reply characters cut from the repair prompt (the email itself is never sent again)
+REPAIR_REPLY_CHARS = 4000
+
+REPAIR_PROMPT = """
+Your previous reply could not be used: {errors}.
+Reply with the corrected JSON object only, no prose and no code fence. It must have exactly these keys:
+- `request_type`: one of {request_types}
+- `sub_request_type`: one of {sub_request_types}
+- `key_attributes`: an object mapping attribute names to string values
+- `main_intent`: a short string
+- `confidence_explanation`: a short string
+"""
+
+REPAIR_REQUEST = """Your previous reply:
+{reply}
+
+Return the corrected JSON."""
+
+class StructuredOutputError(json.JSONDecodeError):
+    """The model reply is not a valid analysis, even after the repair retries."""
+
+    def __init__(self, msg, doc, errors, repairs=0):
+        super().__init__(msg, doc, 0)
+        self.errors = errors
+        self.repairs = repairs
+
+# JSON schema of an analysis, with the request types limited to the config.json enumerations
+def build_output_schema(config):
+    return {
+        "type": "object",
+        "properties": {
+            "request_type": {"type": "string", "enum": list(config.get("request_types", [])) + ["Unknown"]},
+            "sub_request_type": {"type": "string", "enum": list(config.get("sub_request_types", [])) + ["N/A"]},
+            "key_attributes": {"type": "object", "additionalProperties": {"type": "string"}},
+            "main_intent": {"type": "string"},
+            "confidence_explanation": {"type": "string"},
+        },
+        "required": ["request_type", "sub_request_type", "key_attributes", "main_intent"],
+        "additionalProperties": False,
+    }
+
+# OpenAI response_format asking the model for JSON that follows schema
+def response_format(schema):
+    return {"type": "json_schema", "json_schema": {"name": "email_analysis", "schema": schema, "strict": False}}
+
+# Short fingerprint of a schema, part of the result cache key
+def schema_fingerprint(schema):
+    return hashlib.sha256(json.dumps(schema, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+_SPECIAL = re.compile(r'[{}\[\]",:]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+class IncrementalJSONParser:
+    """Parses a JSON object out of a model reply as it arrives, chunk by chunk.
+
+    Anything before the first "{" (prose, a ```json fence) is skipped. `feed` returns the
+    top-level fields completed by the chunk, so callers can act on `request_type` before the
+    rest of the reply exists; the scan jumps between structural characters with a regex.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.started = False
+        self.done = False
+        self.pos = 0
+        self.end = None
+        self.depth = 0
+        self.in_string = False
+        self.expect_key = True
+        self.key = None
+        self.key_start = None
+        self.value_start = None
+        self.value_done = False
+        self.fields = {}
+
+    def _finish_value(self, end):
+        if self.value_done or self.key is None:
+            return None
+        self.value_done = True
+        text = self.buffer[self.value_start:end].strip()
+        if not text:
+            raise json.JSONDecodeError("Missing value", self.buffer, end)
+        self.fields[self.key] = json.loads(text)
+        return self.key, self.fields[self.key]
+
+    # Add the next piece of the reply; returns the [(key, value)] fields it completed
+    def feed(self, chunk):
+        completed = []
+        if self.done:
+            return completed
+        if not self.started:
+            start = chunk.find("{")
+            if start == -1:
+                return completed
+            self.started = True
+            chunk = chunk[start:]
+        self.buffer += chunk
+        buffer = self.buffer
+        while self.pos < len(buffer) and not self.done:
+            if self.in_string:
+                match = _STRING_SPECIAL.search(buffer, self.pos)
+                if match is None:
+                    self.pos = len(buffer)
+                    break
+                if match.group() == "\\":
+                    if match.end() >= len(buffer):  # The escaped character is in the next chunk
+                        self.pos = match.start()
+                        break
+                    self.pos = match.end() + 1
+                    continue
+                self.in_string = False
+                self.pos = match.end()
+                if self.depth == 1 and self.expect_key:
+                    self.key = json.loads(buffer[self.key_start:self.pos])
+                elif self.depth == 1:
+                    completed.append(self._finish_value(self.pos))
+                continue
+            match = _SPECIAL.search(buffer, self.pos)
+            if match is None:
+                self.pos = len(buffer)
+                break
+            char = match.group()
+            self.pos = match.end()
+            if char == '"':
+                self.in_string = True
+                if self.depth == 1 and self.expect_key:
+                    self.key_start = match.start()
+            elif char in "{[":
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 1 and not self.expect_key:
+                    completed.append(self._finish_value(self.pos))
+                elif self.depth == 0:
+                    if not self.expect_key:
+                        completed.append(self._finish_value(match.start()))
+                    self.done = True
+                    self.end = self.pos
+            elif char == ":" and self.depth == 1:
+                self.expect_key = False
+                self.value_start = self.pos
+                self.value_done = False
+            elif char == "," and self.depth == 1:
+                if not self.expect_key:
+                    completed.append(self._finish_value(match.start()))
+                self.expect_key = True
+                self.key = None
+        return [field for field in completed if field]
+
+    # The whole object once the closing brace has arrived (raises json.JSONDecodeError otherwise)
+    def result(self):
+        if not self.started:
+            raise json.JSONDecodeError("No JSON object in the reply", self.buffer, 0)
+        if not self.done:
+            raise json.JSONDecodeError("Unterminated JSON object", self.buffer, len(self.buffer))
+        value = json.loads(self.buffer[:self.end])
+        if not isinstance(value, dict):
+            raise json.JSONDecodeError("Reply is not a JSON object", self.buffer, 0)
+        return value
+
+_decoder = json.JSONDecoder()
+
+# The first JSON object in a complete reply: decoded in one C-speed pass from the first "{",
+# with the incremental parser only used to explain a failure
+def parse_json_object(text):
+    start = text.find("{")
+    if start != -1:
+        try:
+            value = _decoder.raw_decode(text, start)[0]
+            if isinstance(value, dict):
+                return value
+        except json.JSONDecodeError:
+            pass
+    parser = IncrementalJSONParser()
+    parser.feed(text)
+    return parser.result()
+
+# Local fixes that need no model call: extra keys (such as a confidence_score, which is computed
+# locally anyway) are dropped, "name: value" attribute lists become objects and enumeration
+# values are matched case-insensitively
+def coerce_result(response_json, schema):
+    if schema.get("additionalProperties") is False:
+        response_json = {name: value for name, value in response_json.items() if name in schema["properties"]}
+    key_attributes = response_json.get("key_attributes")
+    if isinstance(key_attributes, list) and all(isinstance(item, str) for item in key_attributes):
+        response_json["key_attributes"] = {name.strip(): value.strip() for name, _, value in
+                                           (item.partition(":") for item in key_attributes)}
+    if isinstance(response_json.get("key_attributes"), dict):
+        response_json["key_attributes"] = {str(name): value if isinstance(value, str) else json.dumps(value)
+                                           for name, value in response_json["key_attributes"].items()}
+    for name, rule in schema["properties"].items():
+        value = response_json.get(name)
+        if "enum" in rule and isinstance(value, str) and value not in rule["enum"]:
+            matches = [option for option in rule["enum"] if option.lower() == value.strip().lower()]
+            if matches:
+                response_json[name] = matches[0]
+    return response_json
+
+# Problems with a parsed reply against the schema (empty when valid)
+def validate_result(response_json, schema):
+    errors = []
+    properties = schema["properties"]
+    for name in schema.get("required", []):
+        if name not in response_json:
+            errors.append(f"missing `{name}`")
+    for name, value in response_json.items():
+        rule = properties.get(name)
+        if rule is None:
+            if schema.get("additionalProperties") is False:
+                errors.append(f"unexpected key `{name}`")
+            continue
+        if rule["type"] == "string" and not isinstance(value, str):
+            errors.append(f"`{name}` must be a string")
+        elif rule["type"] == "object" and not isinstance(value, dict):
+            errors.append(f"`{name}` must be an object")
+        elif "enum" in rule and value not in rule["enum"]:
+            errors.append(f"`{name}` {json.dumps(value)} is not an allowed value")
+    return errors
+
+# Parse and check one reply; raises StructuredOutputError with the problems found
+def parse_structured_response(response_text, schema=None):
+    try:
+        response_json = parse_json_object(response_text)
+    except json.JSONDecodeError as e:
+        raise StructuredOutputError(f"AI did not return valid JSON: {e.msg}", response_text, [f"invalid JSON ({e.msg})"])
+    if schema is None:
+        return response_json
+    response_json = coerce_result(response_json, schema)
+    errors = validate_result(response_json, schema)
+    if errors:
+        raise StructuredOutputError(f"AI reply does not match the output schema: {'; '.join(errors)}", response_text, errors)
+    return response_json
+
+# Parse a reply, asking the model to fix it (with the errors, not the email) up to max_repairs times.
+# Returns (response_json, repairs); repair calls are counted in usage.
+def parse_with_repair(response_text, llm, usage, schema=None, max_repairs=DEFAULT_MAX_REPAIRS):
+    repairs = 0
+    while True:
+        try:
+            return parse_structured_response(response_text, schema), repairs
+        except StructuredOutputError as e:
+            if repairs >= max_repairs:
+                e.repairs = repairs
+                raise
+            from langchain.schema import SystemMessage, HumanMessage
+            properties = (schema or {}).get("properties", {})
+            prompt = REPAIR_PROMPT.format(errors="; ".join(e.errors),
+                                          request_types=json.dumps(properties.get("request_type", {}).get("enum", "a string")),
+                                          sub_request_types=json.dumps(properties.get("sub_request_type", {}).get("enum", "a string")))
+            # System turn first and the bad reply quoted in the user turn: chat templates that require
+            # system/user/assistant order (llama.cpp's llama-2 template among them) accept this conversation
+            messages = [SystemMessage(content=prompt),
+                        HumanMessage(content=REPAIR_REQUEST.format(reply=response_text[:REPAIR_REPLY_CHARS]))]
+            with instrumentation.span("json_repair", attempt=repairs + 1):
+                response = llm(messages)
+            repairs += 1
+            usage.add(messages, response, repair=True)
+            response_text = response.content
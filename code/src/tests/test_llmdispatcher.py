@@ -0,0 +1,108 @@
+"""LLMDispatcher against the local fake chat endpoint: result order, 429 retries and the concurrency cap.
+
+    python -m pytest tests
+"""
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_DIR)
+
+from fakechatserver import FakeChatServer  # noqa: E402
+from llmdispatcher import LLMDispatcher  # noqa: E402
+
+class EchoChatServer(FakeChatServer):
+    """Replies with the user message, throttling the first `throttled` requests."""
+
+    def __init__(self, address, throttled=0, **kwargs):
+        super().__init__(address, **kwargs)
+        self.throttled = throttled
+
+    def admit(self):
+        with self.lock:
+            if self.throttled:
+                self.throttled -= 1
+                self.stats["requests"] += 1
+                self.stats["throttled"] += 1
+                return "throttle"
+        return super().admit()
+
+    def reply_content(self, request):
+        return request["messages"][-1]["content"]
+
+class ChatClient:
+    """Minimal chat model over urllib: HTTP errors (with their Retry-After) reach the dispatcher as raised."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.peak_inflight = 0
+
+    def __call__(self, messages):
+        with self.lock:
+            self.inflight += 1
+            self.peak_inflight = max(self.peak_inflight, self.inflight)
+        try:
+            body = json.dumps({"model": "fake", "messages": [{"role": "user", "content": message} for message in messages]})
+            request = urllib.request.Request(f"{self.base_url}/chat/completions", body.encode("utf-8"),
+                                             {"Content-Type": "application/json"})
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return json.loads(response.read())["choices"][0]["message"]["content"]
+        finally:
+            with self.lock:
+                self.inflight -= 1
+
+def start_server(**kwargs):
+    server = EchoChatServer(("127.0.0.1", 0), **kwargs)
+    server.start_background()
+    return server
+
+def test_imap_returns_results_in_input_order():
+    server = start_server(latency=0.02, jitter=0.02, seed=1)
+    try:
+        dispatcher = LLMDispatcher(ChatClient(server.base_url), max_concurrency=4, max_retries=0)
+        results = list(dispatcher.imap(lambda index: dispatcher([f"email {index}"]), range(40)))
+    finally:
+        server.shutdown()
+    assert results == [f"email {index}" for index in range(40)]
+
+def test_throttled_request_is_retried_after_retry_after():
+    server = start_server(throttled=1, retry_after=0.5)
+    try:
+        dispatcher = LLMDispatcher(ChatClient(server.base_url), max_retries=3, base_delay=0.01)
+        start = time.monotonic()
+        result = dispatcher(["email"])
+        elapsed = time.monotonic() - start
+    finally:
+        server.shutdown()
+    assert result == "email"
+    assert elapsed >= 0.5
+    assert dispatcher.stats["retries"] == 1
+    assert server.stats["throttled"] == 1 and server.stats["completed"] == 1
+
+def test_concurrency_cap_holds_across_imap_calls():
+    server = start_server(latency=0.05)
+    client = ChatClient(server.base_url)
+    dispatcher = LLMDispatcher(client, max_concurrency=2, max_retries=0)
+    results = {}
+
+    # Two imap runs share the dispatcher, so their thread pools together would allow four calls
+    def run(name):
+        results[name] = list(dispatcher.imap(lambda index: dispatcher([f"{name} {index}"]), range(12)))
+
+    try:
+        threads = [threading.Thread(target=run, args=(name,)) for name in ("a", "b")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.shutdown()
+    assert client.peak_inflight == 2
+    assert results == {name: [f"{name} {index}" for index in range(12)] for name in ("a", "b")}
+    assert server.stats["completed"] == 24 and server.stats["throttled"] == 0
@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from utilities.Utilities import split_thread_segments
+
+# Get the directory of the currently running Python script
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Default thread index database, next to this script
+THREAD_INDEX_PATH = os.path.join(script_dir, "thread_index.sqlite")
+
+# Attribution that introduces a quoted message ("On ... wrote:" or an Outlook header block)
+QUOTE_HEADER = re.compile(
+    r"^(?:On [^\n]{1,300}? wrote:\s*|(?:-{2,} ?Original Message ?-{2,}\s*)?(?:(?:From|Sent|Date|To|Cc|Subject): [^\n]*(?:\n|$))+)",
+    re.IGNORECASE,
+)
+
+# Normalize one message of a thread so re-quoted copies hash the same (the quote attribution,
+# quote markers, markdown emphasis, case and whitespace differences are ignored)
+def normalize_segment(segment):
+    lines = [re.sub(r"^[>\s]+", "", line) for line in segment.strip().splitlines()]
+    lines = QUOTE_HEADER.sub("", "\n".join(lines)).splitlines()
+    text = " ".join(lines).replace("*", "").lower()
+    return re.sub(r"\s+", " ", text).strip()
+
+# Normalized segments shorter than this ("Thanks", a bare signature) are too common to identify a message
+MIN_SEGMENT_CHARS = 40
+
+def segment_hash(segment):
+    return hashlib.sha256(normalize_segment(segment).encode("utf-8")).hexdigest()
+
+# (segment, hash) pairs of an email, newest first, without the trivially short segments. The newest
+# segment is the message itself, so its hash also covers the attachments: the same boilerplate body
+# with a different attached notice is a different message.
+def segment_hashes(body, attachments=None):
+    pairs = []
+    for index, segment in enumerate(split_thread_segments(body) if body else []):
+        if len(normalize_segment(segment)) < MIN_SEGMENT_CHARS and not (index == 0 and attachments):
+            continue
+        value = segment_hash(segment)
+        if index == 0 and attachments:
+            digest = hashlib.sha256(value.encode("ascii"))
+            for name, text in attachments:
+                digest.update(f"\0{name}\0{text}".encode("utf-8"))
+            value = digest.hexdigest()
+        pairs.append((segment, value))
+    return pairs
+
+# Attribution naming the sender and date of a quoted message
+ATTRIBUTION = re.compile(r"^(?:On [^\n]{1,300}? wrote:|From: [^\n]+\n(?:Sent|Date): [^\n]+)", re.IGNORECASE | re.MULTILINE)
+
+# Normalized characters a quoted message needs before it can link an email to a thread by content
+MIN_LINK_CHARS = 200
+
+# Hashes that link an email to a thread without message IDs: one per quoted message (never the
+# newest segment) that opens with its sender/date attribution and is long enough to be specific.
+# The attribution is part of the hash, so the same boilerplate quoted from two unrelated
+# messages does not link their emails.
+def quote_link_hashes(body):
+    values = []
+    for segment in (split_thread_segments(body)[1:] if body else []):
+        lines = "\n".join(re.sub(r"^[>\s]+", "", line) for line in segment.strip().splitlines())
+        header = QUOTE_HEADER.match(lines)
+        attribution = ATTRIBUTION.search(header.group()) if header else None
+        text = normalize_segment(segment)
+        if attribution is None or len(text) < MIN_LINK_CHARS:
+            continue
+        attribution = re.sub(r"\s+", " ", attribution.group().replace("*", "").lower())
+        values.append(hashlib.sha256(f"{attribution}\0{text}".encode("utf-8")).hexdigest())
+    return values
+
+# Message-IDs found in a header value ("<a@b> <c@d>")
+def parse_message_ids(value):
+    return re.findall(r"<[^<>\s]+>", value or "")
+
+class ThreadMatch:
+    """Result of looking an email up in the thread index."""
+
+    def __init__(self, thread_id, sr_number, result, new_segments, total_segments):
+        self.thread_id = thread_id
+        self.sr_number = sr_number
+        self.result = result
+        self.new_segments = new_segments
+        self.total_segments = total_segments
+
+    # Every message in the email has been classified before: nothing new to send to the LLM
+    @property
+    def fully_known(self):
+        return not self.new_segments
+
+class ThreadIndex:
+    """Persistent index of classified messages, keyed on Message-ID/In-Reply-To/References
+    and on a normalized hash of every quoted segment.
+
+    An email is linked to a known thread by its message IDs or, when its headers name no
+    known message (forwarded or re-sent mail), by a quoted message of that thread: long and
+    quoted with its attribution (see quote_link_hashes), so a shared boilerplate body never
+    links unrelated notices. Within a linked thread, a reply that only adds one message is
+    matched to the thread's SR, and only its new segments need classifying.
+    """
+
+    def __init__(self, path=THREAD_INDEX_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS threads (
+                thread_id TEXT PRIMARY KEY,
+                sr_number TEXT NOT NULL,
+                result TEXT NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                message_id TEXT PRIMARY KEY,
+                thread_id TEXT NOT NULL
+            );
+            -- The same segment text may occur in unrelated threads, so segments are known per thread
+            CREATE TABLE IF NOT EXISTS thread_segments (
+                thread_id TEXT NOT NULL,
+                segment_hash TEXT NOT NULL,
+                PRIMARY KEY (thread_id, segment_hash)
+            );
+            CREATE TABLE IF NOT EXISTS quoted_messages (
+                link_hash TEXT PRIMARY KEY,
+                thread_id TEXT NOT NULL
+            );
+            -- Segment hashes of earlier versions, which linked any emails sharing a text
+            DROP TABLE IF EXISTS segments;
+        """)
+        self.conn.commit()
+        self.stats = {"lookups": 0, "thread_matches": 0, "content_links": 0, "fully_known": 0, "segments_skipped": 0}
+
+    def _thread_for_ids(self, message_ids):
+        for message_id in message_ids:
+            row = self.conn.execute("SELECT thread_id FROM messages WHERE message_id = ?", (message_id,)).fetchone()
+            if row:
+                return row[0]
+        return None
+
+    def _thread_for_quotes(self, link_hashes):
+        for value in link_hashes:
+            row = self.conn.execute("SELECT thread_id FROM quoted_messages WHERE link_hash = ?", (value,)).fetchone()
+            if row:
+                return row[0]
+        return None
+
+    # Find the thread an email is linked to (by its headers, else by a quoted message) and which
+    # of its segments are new; None if it is not linked to a known thread.
+    # `attachments` are the email's (name, text) pairs.
+    def match(self, body, headers=None, attachments=None):
+        headers = headers or {}
+        segments = split_thread_segments(body) if body else []
+        hashed = segment_hashes(body, attachments)
+        own_ids = parse_message_ids(headers.get("message_id"))
+        parent_ids = parse_message_ids(headers.get("in_reply_to")) + list(reversed(parse_message_ids(headers.get("references"))))
+
+        with self.lock:
+            self.stats["lookups"] += 1
+            thread_id = self._thread_for_ids(own_ids + parent_ids)
+            if thread_id is None:
+                thread_id = self._thread_for_quotes(quote_link_hashes(body))
+                if thread_id is None:
+                    return None
+                self.stats["content_links"] += 1
+            row = self.conn.execute("SELECT sr_number, result FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+            if row is None:
+                return None
+            known = {value for _, value in hashed
+                     if self.conn.execute("SELECT 1 FROM thread_segments WHERE thread_id = ? AND segment_hash = ?", (thread_id, value)).fetchone()}
+            # Short segments are never known, so they are classified again with the new messages
+            skipped = {segment for segment, value in hashed if value in known}
+            new_segments = [segment for segment in segments if segment not in skipped]
+            if own_ids and self._thread_for_ids(own_ids) and all(value in known for _, value in hashed):
+                new_segments = []  # Same message (same text and attachments) delivered again
+            self.stats["thread_matches"] += 1
+            self.stats["segments_skipped"] += len(segments) - len(new_segments)
+            if not new_segments:
+                self.stats["fully_known"] += 1
+            return ThreadMatch(thread_id, row[0], json.loads(row[1]), new_segments, len(segments))
+
+    # Record a classified email: its IDs, segments and quoted messages point at the thread and its SR number
+    def record(self, body, headers, sr_number, result, thread_id=None, attachments=None):
+        headers = headers or {}
+        hashed = segment_hashes(body, attachments)
+        link_hashes = quote_link_hashes(body)
+        hashes = [value for _, value in hashed]
+        if hashed and attachments:
+            # A later reply quotes this message without its attachments
+            hashes.append(segment_hash(hashed[0][0]))
+        own_ids = parse_message_ids(headers.get("message_id"))
+        parent_ids = parse_message_ids(headers.get("references")) + parse_message_ids(headers.get("in_reply_to"))
+        # A new thread is named after its root message (first reference), else this message or its oldest segment
+        thread_id = thread_id or (parent_ids[0] if parent_ids else own_ids[0] if own_ids else hashed[-1][1] if hashed else sr_number)
+
+        with self.lock:
+            existing = self.conn.execute("SELECT sr_number FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO threads (thread_id, sr_number, result, updated) VALUES (?, ?, ?, ?)",
+                              (thread_id, existing[0] if existing else sr_number, json.dumps(result), time.time()))
+            for message_id in own_ids + parent_ids:
+                self.conn.execute("INSERT OR IGNORE INTO messages (message_id, thread_id) VALUES (?, ?)", (message_id, thread_id))
+            for value in hashes:
+                self.conn.execute("INSERT OR IGNORE INTO thread_segments (thread_id, segment_hash) VALUES (?, ?)", (thread_id, value))
+            for value in link_hashes:
+                self.conn.execute("INSERT OR IGNORE INTO quoted_messages (link_hash, thread_id) VALUES (?, ?)", (value, thread_id))
+            self.conn.commit()
+        return thread_id
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -25,6 +25,23 @@ def extract_latest_email(email_text):
         return emails[0].strip()  # The latest email (before any quoted text)
     return email_text.strip()  # Return as is if no split happens
 
+# Reply separators that start a quoted message: "On <date>, <person> wrote:", Outlook
+# "From: ... Sent:/Date:" header blocks and "-----Original Message-----" markers
+THREAD_SEPARATOR = re.compile(
+    r"^(?:On [^\n]{1,300}? wrote:|-{2,} ?Original Message ?-{2,}|From: [^\n]+\n(?:Sent|Date): )",
+    re.MULTILINE | re.IGNORECASE,
+)
+
+def split_thread_segments(email_text):
+    """
+    Splits an email thread into its individual messages, newest first.
+    The first segment is the latest message; each following one starts at its reply separator.
+    """
+    starts = [match.start() for match in THREAD_SEPARATOR.finditer(email_text) if match.start() > 0]
+    bounds = [0] + starts + [len(email_text)]
+    segments = [email_text[begin:end].strip() for begin, end in zip(bounds, bounds[1:])]
+    return [segment for segment in segments if segment] or [email_text.strip()]
+
 def generate_prompt(email_text):
     """
     Generates the appropriate prompt based on whether it's a single email or multiple conversations.